@@ -16,12 +16,106 @@ ALGORITHM = os.getenv("AUTH_ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 600
 SECRET_KEY = os.getenv("SECRET_KEY")
 
+# bcrypt cost. passwords hashed with a different cost are rehashed on the next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASHING_WORKERS = int(os.getenv("PASSWORD_HASHING_WORKERS", 2)) # threads per process
+PASSWORD_ROUTES_MAX_CONCURRENCY = int(os.getenv("PASSWORD_ROUTES_MAX_CONCURRENCY", 16)) # /token and /signup requests per process
+
 SQLALCHEMY_DATABASE_URL = os.getenv("SQLALCHEMY_DATABASE_URL")
 SQLALCHEMY_TEST_DATABASE_URL = os.getenv("SQLALCHEMY_TEST_DATABASE_URL")
+# a second local database standing in for a replica in tests.
+SQLALCHEMY_TEST_REPLICA_DATABASE_URL = os.getenv("SQLALCHEMY_TEST_REPLICA_DATABASE_URL", "sqlite:///./sql_test_replica.db")
+# optional. read-only routes query this replica of the database, except for users who wrote something
+# in the last READ_YOUR_WRITES_WINDOW seconds. they read from the primary so they see their own changes.
+SQLALCHEMY_REPLICA_DATABASE_URL = os.getenv("SQLALCHEMY_REPLICA_DATABASE_URL")
+READ_YOUR_WRITES_WINDOW = int(os.getenv("READ_YOUR_WRITES_WINDOW", 10)) # should be more than the replication lag
+
+# connection pool settings. applied to both sync and async engines, so each process may
+# open up to 2 * (POOL_SIZE + MAX_OVERFLOW) connections.
+SQLALCHEMY_POOL_SIZE = int(os.getenv("SQLALCHEMY_POOL_SIZE", 5))
+SQLALCHEMY_MAX_OVERFLOW = int(os.getenv("SQLALCHEMY_MAX_OVERFLOW", 10))
+SQLALCHEMY_POOL_TIMEOUT = int(os.getenv("SQLALCHEMY_POOL_TIMEOUT", 30)) # seconds to wait for a free connection
+SQLALCHEMY_POOL_RECYCLE = int(os.getenv("SQLALCHEMY_POOL_RECYCLE", 1800)) # seconds before a connection is replaced
+SQLALCHEMY_POOL_PRE_PING = os.getenv("SQLALCHEMY_POOL_PRE_PING", "true").lower() == "true"
+
+# used when SQLALCHEMY_DATABASE_URL is a sqlite file. see app.database.sqlite.
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)) # milliseconds a writer waits for the write lock
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)) # bytes of the database file memory mapped
+
+# list routes use keyset pagination. the next page's cursor is sent in X-Next-Cursor header.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000 # rows read from the database cursor at a time when exporting
+
+# bulk admin operations change this many rows per transaction.
+BULK_CHUNK_SIZE = 1000
+MAX_BULK_IDS = 10000 # ids accepted in a single bulk request
+# users and api keys with more tasks than this are deleted by a background job in chunks.
+BACKGROUND_DELETION_THRESHOLD = 1000
+
+# finished tasks older than these many days are removed from the tasks table. 0 keeps them forever.
+TASK_RETENTION_DAYS = {
+    "done": int(os.getenv("TASK_RETENTION_DONE_DAYS", 90)),
+    "failed": int(os.getenv("TASK_RETENTION_FAILED_DAYS", 30)),
+    "cancelled": int(os.getenv("TASK_RETENTION_CANCELLED_DAYS", 30)),
+}
+TASK_RETENTION_MODE = os.getenv("TASK_RETENTION_MODE", "archive") # "archive" moves them to tasks_archive, "delete" drops them
+TASK_RETENTION_BATCH_SIZE = 1000 # tasks removed per transaction
+TASK_RETENTION_INTERVAL = 3600 # seconds between retention runs
+
+# task stats of the last few days are rebuilt on each run. older days are final.
+TASK_STATS_INTERVAL = 300 # seconds between rollup runs
+TASK_STATS_RECENT_DAYS = 2
+
+# postgres only. the tasks table is partitioned by month of created_at when this is set before migrating.
+TASK_PARTITIONING = os.getenv("TASK_PARTITIONING", "false").lower() == "true"
+TASK_PARTITIONS_AHEAD = 3 # months of partitions created in advance
 
 CLASSIFY_RATE_LIMIT = 1 # Max 1 request
 CLASSIFY_RATE_TIME_WINDOW = 10  # Per 10 seconds
 
+# classification tasks
+CLASSIFY_SOFT_TIME_LIMIT = 60 # seconds. the task fails with "timeout" after this.
+CLASSIFY_TIME_LIMIT = 90 # seconds. the worker process is killed after this and the reaper fails the task later.
+CLASSIFY_MAX_ATTEMPTS = 3 # including retries after transient errors and re-enqueues by the reaper
+CLASSIFY_RETRY_BACKOFF = 2 # seconds before the first retry. doubled on each retry.
+CLASSIFY_RETRY_BACKOFF_MAX = 60
+STUCK_TASK_TIMEOUT = 300 # seconds a processing task may go without an update before the reaper picks it up
+REAPER_INTERVAL = 60 # seconds between reaper runs
+# when enabled, workers add results to a redis stream and app.utils.result_writer stores them in batches.
+# at least one writer must run then. e.g. python -m app.utils.result_writer
+RESULT_WRITER_ENABLED = os.getenv("RESULT_WRITER_ENABLED", "false").lower() == "true"
+RESULT_STREAM = "task-results"
+RESULT_WRITER_BATCH_SIZE = 500 # max results written per transaction
+RESULT_WRITER_FLUSH_INTERVAL = 200 # milliseconds a result may wait for its batch to fill up
+RESULT_WRITER_CLAIM_IDLE = 60000 # milliseconds after which results read but not written by a dead writer are taken over
+# new tasks are published to the broker by the outbox relay. at least one must run. e.g. python -m app.utils.outbox
+OUTBOX_BATCH_SIZE = 500 # max tasks published per transaction
+OUTBOX_POLL_INTERVAL = 100 # milliseconds the relay waits before checking an empty outbox again
+# Idempotency-Key header of /classify
+IDEMPOTENCY_TTL = 24 * 3600 # seconds a key is remembered
+IDEMPOTENCY_LOCK_TTL = 60 # seconds a key stays claimed if the process handling its first request dies
+IDEMPOTENCY_WAIT = 10 # seconds a request waits for another one with the same key to finish
+IDEMPOTENCY_POLL_INTERVAL = 0.05 # seconds
+# queue position and ETA of tasks. workers record each classified image in redis.
+THROUGHPUT_KEY = "throughput"
+THROUGHPUT_WINDOW = 300 # seconds of classified images the throughput is measured over
+# seconds the status of a task is cached in redis for answering polls. workers, the reaper and
+# cancellation update it right away. bulk admin changes don't. see app.utils.task_cache.
+TASK_CACHE_TTL = 600
+# the change feed leaves out tasks changed in the last few seconds on postgres, since transactions
+# which got a smaller change_seq may not be committed yet.
+CHANGE_FEED_SETTLE = 5 # seconds
+# usage metering. classify requests and classified images are counted in redis per api key and day,
+# and written to the usage table by the flush_usage celery task. see app.utils.usage.
+USAGE_DAILY_QUOTA = int(os.getenv("USAGE_DAILY_QUOTA", 0)) # classify requests per api key per UTC day. 0 for no quota
+USAGE_MONTHLY_QUOTA = int(os.getenv("USAGE_MONTHLY_QUOTA", 0)) # classify requests per api key per UTC month. 0 for no quota
+USAGE_FLUSH_INTERVAL = 60 # seconds between writes of the counters to the usage table
+USAGE_FLUSH_BATCH_SIZE = 500 # counters of an api key's day written per transaction
+USAGE_DAY_TTL = 3 * 24 * 3600 # seconds the counters of a day are kept in redis after they last changed
+USAGE_MONTH_TTL = 32 * 24 * 3600 # seconds the monthly request counters are kept in redis
+MAX_TASK_TIMEOUT = 24 * 3600 # the longest deadline a client may set with the X-Task-Timeout header, in seconds
+
 SUPER_USER_USERNAME = os.getenv("SUPER_USER_USERNAME")
 SUPER_USER_PASSWORD = os.getenv("SUPER_USER_PASSWORD")
 SUPER_USER_EMAIL = os.getenv("SUPER_USER_EMAIL")
@@ -29,6 +123,38 @@ SUPER_USER_EMAIL = os.getenv("SUPER_USER_EMAIL")
 CELERY_BROKER=os.getenv("CELERY_BROKER")
 CELERY_BACKEND=os.getenv("CELERY_BACKEND")
 
+# production api server. run it with python -m app.server. see app.server.
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1)) # processes. each has its own db and redis pools
+SERVER_LOOP = os.getenv("SERVER_LOOP", "uvloop") # "uvloop", "asyncio" or "auto"
+SERVER_HTTP = os.getenv("SERVER_HTTP", "httptools") # "httptools", "h11" or "auto"
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048)) # connections waiting to be accepted
+# seconds an idle keep-alive connection stays open. keep it above the load balancer's idle timeout.
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", 75))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30)) # seconds workers get to finish requests on shutdown
+SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", 60)) # seconds after which an unresponsive worker is restarted
+# the app (and the model) is loaded once before forking, so workers share its memory pages.
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "true").lower() == "true"
+
+# celery workers. used by both python -m app.worker and celery -A app.tasks worker.
+# the cpu time of usage metering is only accurate with prefork and solo. threads share a process, so each
+# task would be billed for the cpu of the tasks classified at the same time too. see app.utils.usage.
+CELERY_WORKER_POOL = os.getenv("CELERY_WORKER_POOL", "prefork") # "prefork", "threads" or "solo"
+CELERY_WORKER_CONCURRENCY = int(os.getenv("CELERY_WORKER_CONCURRENCY", os.cpu_count() or 1)) # processes or threads
+# messages reserved per process. classifying takes long, so more would wait behind busy processes.
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv("CELERY_WORKER_PREFETCH_MULTIPLIER", 1))
+# processes are replaced after this many tasks, which returns leaked memory. 0 never replaces them.
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.getenv("CELERY_WORKER_MAX_TASKS_PER_CHILD", 1000))
+
 REDIS_HOST=os.getenv("REDIS_HOST")
 REDIS_PORT=int(os.getenv("REDIS_PORT"))
-REDIS_DB=int(os.getenv("REDIS_DB"))
\ No newline at end of file
+REDIS_DB=int(os.getenv("REDIS_DB"))
+
+API_KEY_CACHE_TTL = 300 # seconds in redis
+API_KEY_LOCAL_CACHE_TTL = 10 # seconds in each process' memory
+API_KEY_LOCAL_CACHE_SIZE = 10000
+
+USER_CACHE_TTL = 60 # seconds in redis. kept short since tokens are long lived.
+USER_LOCAL_CACHE_TTL = 5 # seconds in each process' memory
+USER_LOCAL_CACHE_SIZE = 10000
\ No newline at end of file
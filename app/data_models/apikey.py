@@ -1,4 +1,5 @@
 from pydantic import BaseModel, ConfigDict
+from .bulk import BulkFilter
 
 from datetime import datetime
 
@@ -13,6 +14,16 @@ class APIKey(BaseModel):
 class APIKeyAdmin(APIKey):
     owner_id: int
 
+class APIKeyPrincipal(BaseModel):
+    """
+    The cached result of API key authentication.
+    """
+    id: int
+    owner_id: int
+    owner_username: str
+    is_active: bool
+    expiration_date: datetime | None = None
+
 class APIKeyUpdate(BaseModel):
     key: str | None = None
     is_active: bool | None = None
@@ -21,4 +32,12 @@ class APIKeyUpdate(BaseModel):
 class APIKeyCreate(BaseModel):
     owner_id: int
     is_active: bool = True
+    expiration_date: datetime
+
+class APIKeyBulkFilter(BulkFilter):
+    owner_id: int | None = None
+    expires_before: datetime | None = None
+
+class APIKeyBulkExtend(BaseModel):
+    filter: APIKeyBulkFilter
     expiration_date: datetime
\ No newline at end of file
@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field, model_validator
+
+from app.config import MAX_BULK_IDS
+
+
+class BulkFilter(BaseModel):
+    """
+    Selects the rows of a bulk operation. Rows matching all of the given criteria are selected.
+    At least one criterion is required, so a request can't change every row by mistake.
+    """
+    ids: list[int] | None = Field(None, max_length=MAX_BULK_IDS)
+
+    @model_validator(mode="after")
+    def check_not_empty(self):
+        if all(value is None for value in self.model_dump().values()):
+            raise ValueError("at least one filter is required")
+        return self
+
+class BulkResult(BaseModel):
+    affected: int
@@ -0,0 +1,14 @@
+from pydantic import BaseModel, ConfigDict
+from ..database import models
+
+from datetime import date
+
+class TaskStat(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    day: date | None = None
+    user_id: int | None = None
+    api_key_id: int | None = None
+    result: int | None = None
+    state: models.Task.StateEnum | None = None
+    count: int
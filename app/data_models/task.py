@@ -1,5 +1,6 @@
 from pydantic import BaseModel, ConfigDict
 from ..database import models
+from .bulk import BulkFilter
 
 from datetime import datetime
 
@@ -8,7 +9,8 @@ class Task(BaseModel):
 
     id: int
     state: models.Task.StateEnum
-    result: int
+    result: int | None = None # null until the task is done
+    error_code: models.Task.ErrorEnum | None = None
     created_at: datetime
     updated_at: datetime
 
@@ -22,13 +24,28 @@ class TaskInline(BaseModel):
 
     id: int
     state: models.Task.StateEnum
-    result: int
+    result: int | None = None
+    error_code: models.Task.ErrorEnum | None = None
 
 class TaskInlineAdmin(TaskInline):
     model_config = ConfigDict(from_attributes=True)
 
     user_id: int
 
+class TaskETA(BaseModel):
+    id: int
+    state: models.Task.StateEnum
+    queue_position: int | None = None # processing tasks queued before this one
+    throughput: float | None = None # images classified per second recently
+    estimated_completion: datetime | None = None
+
 class TaskUpdate(BaseModel):
     state: models.Task.StateEnum | None = None
-    result: int | None = None
\ No newline at end of file
+    result: int | None = None
+
+class TaskBulkFilter(BulkFilter):
+    user_id: int | None = None
+    api_key_id: int | None = None
+    state: models.Task.StateEnum | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
\ No newline at end of file
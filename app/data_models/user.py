@@ -1,5 +1,6 @@
 from pydantic import BaseModel, ConfigDict
 from ..database.models import User as UserModel
+from .bulk import BulkFilter
 
 
 class User(BaseModel):
@@ -12,6 +13,11 @@ class User(BaseModel):
     is_active: bool
     role: UserModel.RoleEnum
 
+class UserPrincipal(User):
+    """
+    The cached result of token authentication.
+    """
+
 class UserUpdateAdmin(BaseModel):
     username: str | None = None
     email: str | None = None
@@ -24,4 +30,7 @@ class UserCreateAdmin(BaseModel):
     email: str
     password: str
     full_name: str | None = ""
-    role: UserModel.RoleEnum = UserModel.RoleEnum.normal
\ No newline at end of file
+    role: UserModel.RoleEnum = UserModel.RoleEnum.normal
+
+class UserBulkFilter(BulkFilter):
+    role: UserModel.RoleEnum | None = None
\ No newline at end of file
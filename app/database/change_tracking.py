@@ -0,0 +1,69 @@
+from sqlalchemy import DDL, Table, event
+
+# every insert and update of a task gives it the next change_seq, so clients can ask for the tasks
+# changed after the last one they've seen. updated_at is set on updates too, unless the update sets it.
+# postgres doesn't apply server_onupdate on its own.
+TASK_CHANGE_SEQUENCE = "tasks_change_seq"
+
+POSTGRES_TASK_CHANGE_DDL = [
+    f"CREATE SEQUENCE IF NOT EXISTS {TASK_CHANGE_SEQUENCE}",
+    f"""
+    CREATE OR REPLACE FUNCTION tasks_track_change() RETURNS trigger AS $$
+    BEGIN
+        NEW.change_seq := nextval('{TASK_CHANGE_SEQUENCE}');
+        IF TG_OP = 'UPDATE' AND NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN
+            NEW.updated_at := now();
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS tasks_track_change ON tasks",
+    """
+    CREATE TRIGGER tasks_track_change BEFORE INSERT OR UPDATE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION tasks_track_change()
+    """,
+]
+
+# sqlite has no sequences. writes are serialized, so the largest change_seq plus one is the next value.
+# it's found with ix_tasks_change_seq. the WHEN clause keeps the triggers from firing each other.
+SQLITE_TASK_CHANGE_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_track_insert AFTER INSERT ON tasks FOR EACH ROW
+    BEGIN
+        UPDATE tasks SET change_seq = (SELECT coalesce(max(change_seq), 0) + 1 FROM tasks) WHERE id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_track_update AFTER UPDATE ON tasks FOR EACH ROW
+    WHEN NEW.change_seq = OLD.change_seq
+    BEGIN
+        UPDATE tasks SET change_seq = (SELECT max(change_seq) + 1 FROM tasks),
+                         updated_at = CASE WHEN NEW.updated_at = OLD.updated_at
+                                           THEN CURRENT_TIMESTAMP ELSE NEW.updated_at END
+        WHERE id = NEW.id;
+    END
+    """,
+]
+
+POSTGRES_TASK_CHANGE_DROP_DDL = [
+    "DROP TRIGGER IF EXISTS tasks_track_change ON tasks",
+    "DROP FUNCTION IF EXISTS tasks_track_change()",
+    f"DROP SEQUENCE IF EXISTS {TASK_CHANGE_SEQUENCE}",
+]
+
+SQLITE_TASK_CHANGE_DROP_DDL = [
+    "DROP TRIGGER IF EXISTS tasks_track_insert",
+    "DROP TRIGGER IF EXISTS tasks_track_update",
+]
+
+
+def track_task_changes(table: Table):
+    """
+    Creates the triggers maintaining change_seq whenever the table is created with create_all.
+    Migrations create them with the same statements.
+    """
+    for statement in POSTGRES_TASK_CHANGE_DDL:
+        event.listen(table, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+    for statement in SQLITE_TASK_CHANGE_DDL:
+        event.listen(table, "after_create", DDL(statement).execute_if(dialect="sqlite"))
@@ -1,16 +1,171 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
-from app.config import SQLALCHEMY_DATABASE_URL
+from app.config import (SQLALCHEMY_DATABASE_URL,
+                        SQLALCHEMY_REPLICA_DATABASE_URL,
+                        SQLALCHEMY_POOL_SIZE,
+                        SQLALCHEMY_MAX_OVERFLOW,
+                        SQLALCHEMY_POOL_TIMEOUT,
+                        SQLALCHEMY_POOL_RECYCLE,
+                        SQLALCHEMY_POOL_PRE_PING)
+from .pool import PoolMetrics, instrumented_pool
+from .sqlite import WRITER_POOL_OPTIONS, is_sqlite_file, tune_sqlite, use_immediate_transactions
+
+from contextlib import contextmanager
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def get_async_url(url: str) -> str:
+    """
+    Converts a database url to the same url using an async driver.
+    asyncpg is used for postgres and aiosqlite for sqlite.
+
+    - **url**: A database url with a sync (or no) driver.
+
+    Returns:
+    str: The database url with the async driver.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    return url.render_as_string(hide_password=False)
+
+def enable_sqlite_foreign_keys(engine):
+    """
+    sqlite ignores foreign keys, including their ON DELETE CASCADE, unless it's enabled on each connection.
+    Does nothing for other databases.
+
+    - **engine**: A sync engine. Pass ""sync_engine"" of async engines.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_foreign_keys_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+class RoutingSession(Session):
+    """
+    A session bound to the primary which sends queries to the replica engine in info["replica"], or to
+    the reader engine in info["reader"] if there is one. Flushes and insert, update and delete statements
+    always go to the primary. After the first write, a transaction stays on the primary so it sees its changes.
+    """
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        reader = self.info.get("replica") or self.info.get("reader")
+        if reader is None or self.info.get("writing"):
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["writing"] = True
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        return reader
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def end_writing(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+def uses_replica(db: Session) -> bool:
+    """
+    Returns whether a session made by a read session factory queries the replica.
+    Works with async sessions too.
+    """
+    return db.info.get("replica") is not None
+
+POOL_OPTIONS = {
+    "pool_size": SQLALCHEMY_POOL_SIZE,
+    "max_overflow": SQLALCHEMY_MAX_OVERFLOW,
+    "pool_timeout": SQLALCHEMY_POOL_TIMEOUT,
+    "pool_recycle": SQLALCHEMY_POOL_RECYCLE,
+    "pool_pre_ping": SQLALCHEMY_POOL_PRE_PING,
+}
+
+SQLITE_PROFILE = is_sqlite_file(SQLALCHEMY_DATABASE_URL)
+# the engines below write through a single connection in the sqlite profile.
+PRIMARY_POOL_OPTIONS = {**POOL_OPTIONS, **WRITER_POOL_OPTIONS} if SQLITE_PROFILE else POOL_OPTIONS
+
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+reader_pool_metrics = PoolMetrics()
+reader_async_pool_metrics = PoolMetrics()
+replica_pool_metrics = PoolMetrics()
+replica_async_pool_metrics = PoolMetrics()
 
 # engine = create_engine(
 #     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 # )
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
+    SQLALCHEMY_DATABASE_URL,
+    poolclass=instrumented_pool(QueuePool, pool_metrics),
+    **PRIMARY_POOL_OPTIONS
 )
+async_engine = create_async_engine(
+    get_async_url(SQLALCHEMY_DATABASE_URL),
+    poolclass=instrumented_pool(AsyncAdaptedQueuePool, async_pool_metrics),
+    **PRIMARY_POOL_OPTIONS
+)
+enable_sqlite_foreign_keys(engine)
+enable_sqlite_foreign_keys(async_engine.sync_engine)
+
+# sqlite profile only. queries of read sessions go to these. see app.database.sqlite.
+reader_engine = None
+reader_async_engine = None
+session_info = {}
+async_session_info = {}
+if SQLITE_PROFILE:
+    for writer in (engine, async_engine.sync_engine):
+        tune_sqlite(writer)
+        use_immediate_transactions(writer)
+    reader_engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        poolclass=instrumented_pool(QueuePool, reader_pool_metrics),
+        **POOL_OPTIONS
+    )
+    reader_async_engine = create_async_engine(
+        get_async_url(SQLALCHEMY_DATABASE_URL),
+        poolclass=instrumented_pool(AsyncAdaptedQueuePool, reader_async_pool_metrics),
+        **POOL_OPTIONS
+    )
+    for reader in (reader_engine, reader_async_engine.sync_engine):
+        tune_sqlite(reader, query_only=True)
+        enable_sqlite_foreign_keys(reader)
+    session_info = {"reader": reader_engine}
+    async_session_info = {"reader": reader_async_engine.sync_engine}
+
+# in the sqlite profile, transactions of these sessions read and write on the writer, so they are serialized.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# objects must stay usable after commit since async sessions can't lazy load them again.
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+replica_engine = None
+replica_async_engine = None
+if SQLALCHEMY_REPLICA_DATABASE_URL:
+    replica_engine = create_engine(
+        SQLALCHEMY_REPLICA_DATABASE_URL,
+        poolclass=instrumented_pool(QueuePool, replica_pool_metrics),
+        **POOL_OPTIONS
+    )
+    replica_async_engine = create_async_engine(
+        get_async_url(SQLALCHEMY_REPLICA_DATABASE_URL),
+        poolclass=instrumented_pool(AsyncAdaptedQueuePool, replica_async_pool_metrics),
+        **POOL_OPTIONS
+    )
+# read-only routes use these. see app.utils.replica for choosing between the primary and the replica.
+# in the sqlite profile their queries go to the readers.
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine,
+                                class_=RoutingSession, info=session_info)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_engine, sync_session_class=RoutingSession, info=async_session_info,
+                                           autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -24,4 +179,57 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """
+    Creates and yields an async database session. Use this in ""async"" path operations
+    so queries don't block the event loop.
+    The session is closed after the caller is done.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def reset_pools_after_fork():
+    """
+    Forked processes must not share the parent's pooled connections.
+    The pools of all engines are replaced without closing the parent's connections.
+    """
+    engines = [engine, async_engine.sync_engine]
+    for extra in (reader_engine, reader_async_engine, replica_engine, replica_async_engine):
+        if extra is not None:
+            engines.append(getattr(extra, "sync_engine", extra))
+    for forked in engines:
+        forked.dispose(close=False)
+
+@contextmanager
+def db_session():
+    """
+    Creates a database session for code that doesn't run in a request. e.g. celery tasks.
+    The session is closed when the with block exits, so its connection goes back to the pool.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_pool_stats() -> dict:
+    """
+    Returns the connection pool statistics of both sync and async engines, and the replica's
+    or the sqlite readers' if there are any.
+
+    Returns:
+    dict: Pool statistics. See PoolMetrics.snapshot for the fields.
+    """
+    stats = {
+        "sync": pool_metrics.snapshot(engine.pool),
+        "async": async_pool_metrics.snapshot(async_engine.pool),
+    }
+    if reader_engine is not None:
+        stats["reader_sync"] = reader_pool_metrics.snapshot(reader_engine.pool)
+        stats["reader_async"] = reader_async_pool_metrics.snapshot(reader_async_engine.pool)
+    if replica_engine is not None:
+        stats["replica_sync"] = replica_pool_metrics.snapshot(replica_engine.pool)
+        stats["replica_async"] = replica_async_pool_metrics.snapshot(replica_async_engine.pool)
+    return stats
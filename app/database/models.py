@@ -1,10 +1,27 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum, DateTime, Boolean
+from sqlalchemy import (Column, BigInteger, Integer, SmallInteger, String, ForeignKey, Enum, Date, DateTime, Boolean,
+                        Index, DDL, event, literal_column)
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, functions
 
 from .db import Base
+from .change_tracking import track_task_changes
 import enum
 
+# sqlite stores server default timestamps (CURRENT_TIMESTAMP) without microseconds. datetime parameters
+# must be stored the same way, otherwise comparing them with these columns compares different string formats.
+TimeStamp = DateTime().with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite")
+
+# the database's clock for comparing with TimeStamp columns in python: func.localtimestamp().
+# now() is a timestamp with time zone on postgres. python can't compare or subtract it with the naive values
+# of these columns, and asyncpg refuses it as their parameter. sqlite only has CURRENT_TIMESTAMP, which is naive.
+@compiles(functions.localtimestamp, "sqlite")
+def _compile_sqlite_localtimestamp(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
 
 class User(Base):
     __tablename__ = 'users'
@@ -22,8 +39,27 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     role = Column(Enum(RoleEnum), default=RoleEnum.normal, nullable=False)
 
-    api_keys = relationship("APIKey", backref="owner", cascade="all, delete-orphan")
-    tasks = relationship("Task", backref="user", cascade="all, delete-orphan")
+    # children are deleted by the database (ON DELETE CASCADE) instead of being loaded and deleted one by one.
+    api_keys = relationship("APIKey", backref="owner", cascade="all, delete-orphan", passive_deletes=True)
+    tasks = relationship("Task", backref="user", cascade="all, delete-orphan", passive_deletes=True)
+
+    # admin user search. see app.utils.search.
+    # the lower() indexes are for prefix searches. text_pattern_ops lets postgres use them for LIKE 'prefix%'.
+    # the trigram indexes are for substring searches on postgres.
+    __table_args__ = (
+        Index("ix_users_username_lower", func.lower(username).label("lower_username"),
+              postgresql_ops={"lower_username": "text_pattern_ops"}),
+        Index("ix_users_email_lower", func.lower(email).label("lower_email"),
+              postgresql_ops={"lower_email": "text_pattern_ops"}),
+        Index("ix_users_username_trgm", func.lower(username).label("lower_username"),
+              postgresql_using="gin", postgresql_ops={"lower_username": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_users_email_trgm", func.lower(email).label("lower_email"),
+              postgresql_using="gin", postgresql_ops={"lower_email": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+
+event.listen(User.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
 
 
 class APIKey(Base):
@@ -33,11 +69,15 @@ class APIKey(Base):
                                                        # otherwise, clients would need to send the whole key as a get
                                                        # argument in every request which would not the most secure design choice.
     key = Column(String, unique=True, nullable=False)
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
     is_active = Column(Boolean, default=True)
     expiration_date = Column(DateTime, nullable=True)
 
-    tasks = relationship("Task", backref="api_key", cascade="all, delete-orphan")
+    tasks = relationship("Task", backref="api_key", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_api_keys_owner_id_is_active", "owner_id", "is_active"),
+    )
 
 
 class Task(Base):
@@ -47,12 +87,132 @@ class Task(Base):
         processing = "processing"
         done = "done"
         failed = "failed"
+        cancelled = "cancelled" # by its owner or an admin, or because its deadline passed
+
+    class ErrorEnum(enum.Enum):
+        invalid_image = "invalid_image" # the file is not an image the classifier can read
+        file_missing = "file_missing"
+        timeout = "timeout" # classification took longer than the soft time limit
+        unavailable = "unavailable" # transient errors persisted through all attempts
+        stuck = "stuck" # the task stopped making progress. e.g. the worker was killed
+        internal_error = "internal_error"
+        deadline_exceeded = "deadline_exceeded" # cancelled without running the model. nobody waits for the result
 
+    # columns are ordered by size, so postgres doesn't pad rows for alignment: 8 byte columns first,
+    # then 4 and 2 byte ones and the variable length ones last. nulls take no space in the row.
+    # grows with every insert and update. set by the database. see app.database.change_tracking.
+    change_seq = Column(BigInteger, server_default="0", nullable=False)
+    created_at = Column(TimeStamp, server_default=func.now(), nullable=False)
+    updated_at = Column(TimeStamp, server_default=func.now(), server_onupdate=func.now(), nullable=False)
+    deadline = Column(TimeStamp, nullable=True) # the client doesn't want the result after this
     id = Column(Integer, primary_key=True, index=True)
-    filename = Column(String, nullable=False)
-    api_key_id = Column(Integer, ForeignKey("api_keys.id"), nullable=False, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
-    state = Column(Enum(StateEnum), default=StateEnum.processing, nullable=False, index=True)
-    created_at = Column(DateTime, server_default=func.now(), nullable=False)
-    updated_at = Column(DateTime, server_default=func.now(), server_onupdate=func.now(), nullable=False)
-    result = Column(Integer, default=-1)
\ No newline at end of file
+    api_key_id = Column(Integer, ForeignKey("api_keys.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    # a native enum on postgres. 4 bytes.
+    state = Column(Enum(StateEnum), default=StateEnum.processing, nullable=False)
+    attempts = Column(SmallInteger, default=0, server_default="0", nullable=False) # times a worker started classifying it
+    result = Column(SmallInteger, nullable=True) # the predicted class. null until the task is done
+    # stored as a plain string so new codes don't need a migration. null unless the task failed or expired.
+    error_code = Column(Enum(ErrorEnum, native_enum=False, length=32), nullable=True)
+    # the uploaded image. cleared when the file is removed, e.g. once the task is done.
+    filename = Column(String, nullable=True)
+
+    # task lists are filtered by these and paginated on (created_at, id).
+    # user_id alone is covered by the second index.
+    __table_args__ = (
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+        Index("ix_tasks_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_tasks_user_id_state_created_at_id", "user_id", "state", "created_at", "id"),
+        Index("ix_tasks_user_id_api_key_id_created_at_id", "user_id", "api_key_id", "created_at", "id"),
+        # the change feed of a user and the next change_seq on sqlite.
+        Index("ix_tasks_user_id_change_seq", "user_id", "change_seq"),
+        Index("ix_tasks_change_seq", "change_seq"),
+    )
+
+
+track_task_changes(Task.__table__)
+
+
+class TaskArchive(Base):
+    """
+    Finished tasks moved out of the tasks table by the retention job.
+    There are no foreign keys, so archived tasks outlive their users and api keys.
+    """
+    __tablename__ = "tasks_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    filename = Column(String, nullable=True) # always null. files are removed when tasks are archived
+    api_key_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    state = Column(Enum(Task.StateEnum), nullable=False)
+    created_at = Column(TimeStamp, nullable=False)
+    updated_at = Column(TimeStamp, nullable=False)
+    result = Column(SmallInteger)
+    error_code = Column(Enum(Task.ErrorEnum, native_enum=False, length=32), nullable=True)
+    archived_at = Column(TimeStamp, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_tasks_archive_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+
+class TaskStat(Base):
+    """
+    Daily task counts. Rebuilt from the tasks of recent days by the rollup job, so stats
+    are read without scanning tasks. Like the archive, rows outlive users, api keys and expired tasks.
+    """
+    __tablename__ = "task_stats"
+
+    day = Column(Date, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    api_key_id = Column(Integer, primary_key=True)
+    result = Column(Integer, primary_key=True) # -1 for tasks without a result
+    state = Column(Enum(Task.StateEnum), primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_task_stats_user_id_day", "user_id", "day"),
+    )
+
+
+class Usage(Base):
+    """
+    Daily usage of API keys for billing. Counted in redis and written here periodically, see app.utils.usage.
+    Like task stats, rows outlive users and api keys.
+    Metrics are requests (accepted classify requests), cpu_ms (time spent classifying)
+    and class_0 to class_9 (images classified as each class).
+    """
+    __tablename__ = "usage"
+
+    day = Column(Date, primary_key=True) # in UTC
+    api_key_id = Column(Integer, primary_key=True)
+    metric = Column(String(16), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    value = Column(BigInteger, nullable=False)
+
+    __table_args__ = (
+        Index("ix_usage_user_id_day", "user_id", "day"),
+    )
+
+
+class TaskOutbox(Base):
+    """
+    Tasks waiting to be published to the broker. A row is added in the same transaction as its task,
+    so every committed task gets published, and requests don't wait for the broker. See app.utils.outbox.
+    """
+    __tablename__ = "task_outbox"
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, nullable=False) # no foreign key, since tasks may be partitioned
+    created_at = Column(TimeStamp, server_default=func.now(), nullable=False)
+
+
+# a literal instead of a bound parameter so query planners can match it to the partial index below.
+# use it for finding processing tasks.
+TASK_IS_PROCESSING = Task.__table__.c.state == literal_column("'processing'")
+
+# only the few processing tasks are indexed, so counting them stays cheap no matter how big the table gets.
+# updated_at is for finding the stuck ones. state makes it a covering index for sqlite's planner.
+Index("ix_tasks_processing", Task.state, Task.updated_at,
+      postgresql_where=TASK_IS_PROCESSING,
+      sqlite_where=TASK_IS_PROCESSING)
@@ -0,0 +1,122 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from datetime import datetime
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# tasks is range partitioned by month of created_at. partitions are named after their month.
+# the rows that existed when the table was partitioned are kept in a single tasks_legacy partition.
+TASKS_TABLE = "tasks"
+LEGACY_PARTITION = "tasks_legacy"
+PARTITION_NAME_FORMAT = "tasks_p%Y_%m"
+
+PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(moment: datetime, months: int = 0) -> datetime:
+    """
+    Returns the first moment of the month of moment, moved by the given number of months.
+    """
+    month = moment.year * 12 + moment.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1)
+
+def is_partitioned(connection: Connection, table: str = TASKS_TABLE) -> bool:
+    """
+    Returns whether a table is partitioned. Always false on databases other than postgres.
+    """
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+                                   "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"),
+                              {"table": table}).scalar()
+
+def task_partition_ddl(start: datetime) -> tuple[str, str]:
+    """
+    Returns the name and the statement creating the partition of tasks for the month starting at start.
+    """
+    end = month_start(start, 1)
+    name = start.strftime(PARTITION_NAME_FORMAT)
+    return name, (f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TASKS_TABLE} "
+                  f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{end.isoformat(' ')}')")
+
+def create_task_partitions(connection: Connection, since: datetime, months: int) -> list[str]:
+    """
+    Creates the monthly partitions of tasks starting from the month of since, if they don't exist.
+
+    - **connection**: A postgres connection.
+    - **since**: A moment in the first month to create.
+    - **months**: Number of months to create.
+
+    Returns:
+    list[str]: Names of the partitions. Including the ones that already existed.
+    """
+    names = []
+    for i in range(months):
+        name, ddl = task_partition_ddl(month_start(since, i))
+        connection.execute(text(ddl))
+        names.append(name)
+    return names
+
+def get_task_partitions(connection: Connection) -> dict[str, datetime | None]:
+    """
+    Returns the partitions of tasks and their upper bounds.
+
+    Returns:
+    dict[str, datetime | None]: Exclusive upper bound of created_at by partition name. None for unbounded.
+    """
+    rows = connection.execute(text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                                   "JOIN pg_class c ON c.oid = i.inhrelid "
+                                   "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"),
+                              {"table": TASKS_TABLE}).all()
+    partitions = {}
+    for name, bound in rows:
+        match = PARTITION_UPPER_BOUND.search(bound or "")
+        partitions[name] = datetime.fromisoformat(match.group(1)) if match else None
+    return partitions
+
+def drop_expired_task_partitions(connection: Connection, before: datetime) -> list[str]:
+    """
+    Drops the partitions of tasks which only hold tasks created before the given time and are empty.
+    Retention empties them batch by batch. Dropping them afterwards keeps the catalog and planning time small.
+
+    - **connection**: A postgres connection.
+    - **before**: Partitions whose upper bound is not later than this may be dropped.
+
+    Returns:
+    list[str]: Names of the dropped partitions.
+    """
+    dropped = []
+    for name, upper_bound in get_task_partitions(connection).items():
+        if upper_bound is None or upper_bound > before:
+            continue
+        # processing tasks are never expired, so old partitions can still have rows.
+        if connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+            continue
+        connection.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    return dropped
+
+def maintain_task_partitions(connection: Connection, now: datetime, months_ahead: int,
+                             retention_cutoff: datetime | None) -> dict[str, list[str]]:
+    """
+    Creates the partitions of the current and the next months and drops expired empty ones.
+    Does nothing if tasks is not partitioned.
+
+    - **connection**: A database connection.
+    - **now**: The current time.
+    - **months_ahead**: Number of months after the current one to create partitions for.
+    - **retention_cutoff**: The earliest creation time tasks of any state are kept for. None to drop nothing.
+
+    Returns:
+    dict[str, list[str]]: Created (or existing) and dropped partitions.
+    """
+    if not is_partitioned(connection):
+        return {"created": [], "dropped": []}
+    created = create_task_partitions(connection, now, months_ahead + 1)
+    dropped = drop_expired_task_partitions(connection, retention_cutoff) if retention_cutoff else []
+    if dropped:
+        logger.info("dropped task partitions: %s", dropped)
+    return {"created": created, "dropped": dropped}
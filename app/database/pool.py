@@ -0,0 +1,80 @@
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from threading import Lock
+from time import perf_counter
+
+
+class PoolMetrics:
+    """
+    Collects connection pool statistics. Checkout wait times are recorded by the pool class
+    made with ""instrumented_pool"". Pool occupancy is read from the pool itself.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def record_wait(self, wait_time: float, timed_out: bool = False):
+        """
+        Records the time a caller waited for a connection.
+
+        - **wait_time**: Wait time in seconds.
+        - **timed_out**: Whether the caller gave up waiting because of pool timeout.
+        """
+        with self._lock:
+            self.waits += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self, pool) -> dict:
+        """
+        Returns the current statistics of a pool.
+
+        - **pool**: The pool the metrics were collected for. e.g. engine.pool
+
+        Returns:
+        dict: Pool size, occupancy and checkout wait times. Wait times are in milliseconds.
+        """
+        with self._lock:
+            stats = {
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "total_wait_ms": self.total_wait_time * 1000,
+                "avg_wait_ms": (self.total_wait_time / self.waits * 1000) if self.waits else 0.0,
+                "max_wait_ms": self.max_wait_time * 1000,
+            }
+        # not every pool class keeps these. e.g. NullPool.
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, name, None)
+            stats[name] = method() if method else None
+        return stats
+
+
+def instrumented_pool(poolclass, metrics: PoolMetrics):
+    """
+    Makes a subclass of a pool class which records the checkout wait times in metrics.
+    The subclass survives engine.dispose() since the pool is recreated using its own class.
+
+    - **poolclass**: A sqlalchemy pool class. e.g. QueuePool
+    - **metrics**: The object to record the wait times in.
+
+    Returns:
+    type: The instrumented pool class.
+    """
+    class InstrumentedPool(poolclass):
+        def _do_get(self):
+            start = perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                metrics.record_wait(perf_counter() - start, timed_out=True)
+                raise
+            metrics.record_wait(perf_counter() - start)
+            return connection
+
+    InstrumentedPool.__name__ = "Instrumented" + poolclass.__name__
+    return InstrumentedPool
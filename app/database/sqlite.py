@@ -0,0 +1,67 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+from app.config import SQLITE_BUSY_TIMEOUT, SQLITE_MMAP_SIZE
+
+# the embedded deployment profile. used when SQLALCHEMY_DATABASE_URL is a sqlite file. in-memory databases
+# aren't shared between connections, so the readers would see an empty database of their own.
+#
+# sqlite allows one writer at a time. each process writes through a single pooled connection per engine,
+# so writers of a process wait in the pool's queue. transactions on it start with BEGIN IMMEDIATE, so writers
+# of different processes (api and celery workers) wait for each other for up to SQLITE_BUSY_TIMEOUT ms.
+# a deferred transaction that read first could fail right away with "database is locked" when it starts writing.
+# the queries of read-only routes go to separate reader connections (see app.database.db.RoutingSession).
+# with WAL they don't block the writer and the writer doesn't block them. other sessions read on the writer,
+# so what a transaction reads can't change before it writes.
+
+WRITER_POOL_OPTIONS = {
+    "pool_size": 1,
+    "max_overflow": 0,
+}
+
+
+def is_sqlite_file(url: str) -> bool:
+    """
+    Returns whether a database url is a sqlite database stored in a file.
+    """
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or not url.database:
+        return False
+    return url.database != ":memory:" and not url.database.startswith("file::memory:") \
+        and url.query.get("mode") != "memory"
+
+def tune_sqlite(engine: Engine, query_only: bool = False):
+    """
+    Applies the pragmas of the embedded profile to every new connection of an engine.
+
+    - **engine**: A sync engine. Pass ""sync_engine"" of async engines.
+    - **query_only**: Makes the connections read only. For reader engines.
+    """
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL is stored in the database file. the other pragmas are per connection.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # commits are durable once the WAL is checkpointed. a power loss may lose the last transactions only.
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+def use_immediate_transactions(engine: Engine):
+    """
+    Starts the transactions of an engine with BEGIN IMMEDIATE, so they take the write lock
+    before running their first statement.
+
+    - **engine**: A sync engine. Pass ""sync_engine"" of async engines.
+    """
+    @event.listens_for(engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        # the driver would start a deferred transaction on its own before the first write.
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin_immediate(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
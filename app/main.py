@@ -1,22 +1,28 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Depends
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
-from .database.db import get_db
+from .database.db import db_session
 from .database import models
 
 from .routes import classify, auth, tasks, apikeys
 from .routes.admin import (tasks as admin_tasks,
                            users as admin_users,
-                           apikeys as admin_apikeys)
+                           apikeys as admin_apikeys,
+                           database as admin_database,
+                           cache as admin_cache,
+                           stats as admin_stats,
+                           jobs as admin_jobs)
 
-from .utils.auth import hash_password
+from .utils.auth import hash_password, api_key_cache, user_cache
+from .utils.replica import mark_writes
 
 from .config import (SUPER_USER_EMAIL,
                      SUPER_USER_PASSWORD,
                      SUPER_USER_USERNAME)
 
 from contextlib import asynccontextmanager
+import asyncio
 
 # Base.metadata.create_all(bind=engine)
 
@@ -36,11 +42,8 @@ Don't worry about he admin operations. You won't be using them.
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    if not (SUPER_USER_PASSWORD and SUPER_USER_PASSWORD and SUPER_USER_EMAIL):
-        yield
-    else:
-        db = next(get_db())
-        try:
+    if SUPER_USER_PASSWORD and SUPER_USER_PASSWORD and SUPER_USER_EMAIL:
+        with db_session() as db:
             admin_count = db.query(models.User).filter(models.User.role == "admin").count()
             if admin_count == 0:
                 admin_user = models.User(username=SUPER_USER_USERNAME,
@@ -49,9 +52,11 @@ async def lifespan(app: FastAPI):
                                 role=models.User.RoleEnum.admin)
                 db.add(admin_user)
                 db.commit()
-        finally:
-            pass
-        yield
+
+    cache_listeners = [asyncio.create_task(cache.listen()) for cache in (api_key_cache, user_cache)]
+    yield
+    for listener in cache_listeners:
+        listener.cancel()
 
 app = FastAPI(
     lifespan=lifespan,
@@ -74,13 +79,20 @@ app = FastAPI(
 # )
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
-app.include_router(classify.router)
+# the routers whose changes are read back from the replica. see app.utils.replica.
+read_your_writes = [Depends(mark_writes)]
+
+app.include_router(classify.router, dependencies=read_your_writes)
 app.include_router(auth.router)
-app.include_router(tasks.router)
-app.include_router(apikeys.router)
-app.include_router(admin_tasks.router)
-app.include_router(admin_users.router)
-app.include_router(admin_apikeys.router)
+app.include_router(tasks.router, dependencies=read_your_writes)
+app.include_router(apikeys.router, dependencies=read_your_writes)
+app.include_router(admin_tasks.router, dependencies=read_your_writes)
+app.include_router(admin_users.router, dependencies=read_your_writes)
+app.include_router(admin_apikeys.router, dependencies=read_your_writes)
+app.include_router(admin_database.router)
+app.include_router(admin_cache.router)
+app.include_router(admin_stats.router)
+app.include_router(admin_jobs.router)
 
 @app.get("/")
 async def root(request: Request):
@@ -90,6 +102,7 @@ async def root(request: Request):
     """
     return templates.TemplateResponse("index.html", {"request": request})
 
+# a single process for development. run python -m app.server in production.
 if __name__ == "__main__":
     import argparse
     
@@ -0,0 +1,67 @@
+"""composite task and api key indexes
+
+Revision ID: 8f3b2c1d4e5a
+Revises: 31c422614920
+Create Date: 2026-10-19 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3b2c1d4e5a'
+down_revision: Union[str, None] = '31c422614920'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TASK_INDEXES = [
+    ('ix_tasks_created_at_id', ['created_at', 'id']),
+    ('ix_tasks_user_id_created_at_id', ['user_id', 'created_at', 'id']),
+    ('ix_tasks_user_id_state_created_at_id', ['user_id', 'state', 'created_at', 'id']),
+    ('ix_tasks_user_id_api_key_id_created_at_id', ['user_id', 'api_key_id', 'created_at', 'id']),
+]
+
+PROCESSING_CONDITION = sa.text("state = 'processing'")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # indexes are built concurrently on postgres so the tables stay writable.
+    # concurrent builds can't run in a transaction.
+    with op.get_context().autocommit_block():
+        for name, columns in TASK_INDEXES:
+            op.create_index(name, 'tasks', columns, unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_tasks_processing', 'tasks', ['id'], unique=False,
+                        postgresql_where=PROCESSING_CONDITION,
+                        sqlite_where=PROCESSING_CONDITION,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_api_keys_owner_id_is_active', 'api_keys', ['owner_id', 'is_active'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        # covered by ix_tasks_user_id_created_at_id
+        op.drop_index('ix_tasks_user_id', table_name='tasks',
+                      postgresql_concurrently=True, if_exists=True)
+        # processing tasks are found with ix_tasks_processing and per user states with
+        # ix_tasks_user_id_state_created_at_id. a plain state index has too few distinct values to help.
+        op.drop_index('ix_tasks_state', table_name='tasks',
+                      postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tasks_state', 'tasks', ['state'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_tasks_user_id', 'tasks', ['user_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_api_keys_owner_id_is_active', table_name='api_keys',
+                      postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_tasks_processing', table_name='tasks',
+                      postgresql_concurrently=True, if_exists=True)
+        for name, _ in reversed(TASK_INDEXES):
+            op.drop_index(name, table_name='tasks',
+                          postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,55 @@
+"""task change sequence
+
+Existing tasks get their id as change_seq. Changes from now on get larger values.
+
+Revision ID: 9a7d4e2c1f35
+Revises: c5e1d9a4f2b6
+Create Date: 2026-10-19 21:18:40.925311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.change_tracking import (TASK_CHANGE_SEQUENCE,
+                                          POSTGRES_TASK_CHANGE_DDL,
+                                          POSTGRES_TASK_CHANGE_DROP_DDL,
+                                          SQLITE_TASK_CHANGE_DDL,
+                                          SQLITE_TASK_CHANGE_DROP_DDL)
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a7d4e2c1f35'
+down_revision: Union[str, None] = 'c5e1d9a4f2b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tasks', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.execute("UPDATE tasks SET change_seq = id")
+    op.create_index('ix_tasks_user_id_change_seq', 'tasks', ['user_id', 'change_seq'], unique=False)
+    op.create_index('ix_tasks_change_seq', 'tasks', ['change_seq'], unique=False)
+
+    if op.get_context().dialect.name == 'postgresql':
+        for statement in POSTGRES_TASK_CHANGE_DDL:
+            op.execute(statement)
+        op.execute(f"SELECT setval('{TASK_CHANGE_SEQUENCE}', (SELECT coalesce(max(id), 0) + 1 FROM tasks), false)")
+    else:
+        for statement in SQLITE_TASK_CHANGE_DDL:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    statements = (POSTGRES_TASK_CHANGE_DROP_DDL if op.get_context().dialect.name == 'postgresql'
+                  else SQLITE_TASK_CHANGE_DROP_DDL)
+    for statement in statements:
+        op.execute(statement)
+
+    op.drop_index('ix_tasks_change_seq', table_name='tasks')
+    op.drop_index('ix_tasks_user_id_change_seq', table_name='tasks')
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('change_seq')
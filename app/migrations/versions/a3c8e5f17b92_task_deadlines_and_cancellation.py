@@ -0,0 +1,41 @@
+"""task deadlines and cancelled state
+
+Revision ID: a3c8e5f17b92
+Revises: f7b3c2a91d40
+Create Date: 2026-10-19 19:12:08.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c8e5f17b92'
+down_revision: Union[str, None] = 'f7b3c2a91d40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_context().dialect.name == 'postgresql':
+        # tasks, tasks_archive and task_stats share the type. sqlite stores enums as plain strings.
+        # older postgres versions can't add enum values inside a transaction.
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TYPE stateenum ADD VALUE IF NOT EXISTS 'cancelled'")
+
+    op.add_column('tasks', sa.Column('deadline', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('deadline')
+
+    # postgres can't drop enum values, so 'cancelled' stays in the type but isn't used anymore.
+    # stats are rebuilt by the rollup job. merging them into the failed rows could break their primary key.
+    op.execute("UPDATE tasks SET state = 'failed' WHERE state = 'cancelled'")
+    op.execute("UPDATE tasks_archive SET state = 'failed' WHERE state = 'cancelled'")
+    op.execute("DELETE FROM task_stats WHERE state = 'cancelled'")
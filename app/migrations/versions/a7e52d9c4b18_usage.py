@@ -0,0 +1,39 @@
+"""usage
+
+Starts empty. Usage is counted from now on, since past requests and cpu time can't be told from tasks.
+
+Revision ID: a7e52d9c4b18
+Revises: f3a1c8d92e47
+Create Date: 2026-10-19 23:26:51.372904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e52d9c4b18'
+down_revision: Union[str, None] = 'f3a1c8d92e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('usage',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('api_key_id', sa.Integer(), nullable=False),
+    sa.Column('metric', sa.String(length=16), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'api_key_id', 'metric')
+    )
+    op.create_index('ix_usage_user_id_day', 'usage', ['user_id', 'day'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_usage_user_id_day', table_name='usage')
+    op.drop_table('usage')
@@ -0,0 +1,44 @@
+"""tasks archive
+
+Revision ID: b4d9e2a7c6f1
+Revises: 8f3b2c1d4e5a
+Create Date: 2026-10-19 13:02:17.540912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d9e2a7c6f1'
+down_revision: Union[str, None] = '8f3b2c1d4e5a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tasks_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('filename', sa.String(), nullable=False),
+    sa.Column('api_key_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    # the type already exists. it was created with the tasks table.
+    sa.Column('state', postgresql.ENUM('processing', 'done', 'failed', name='stateenum', create_type=False)
+              .with_variant(sa.Enum('processing', 'done', 'failed', name='stateenum'), 'sqlite'), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('result', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tasks_archive_user_id_created_at_id', 'tasks_archive', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tasks_archive_user_id_created_at_id', table_name='tasks_archive')
+    op.drop_table('tasks_archive')
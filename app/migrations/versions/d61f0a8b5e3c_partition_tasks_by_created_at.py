@@ -0,0 +1,108 @@
+"""partition tasks by created_at
+
+Only applied on postgres when TASK_PARTITIONING is set. Otherwise this is a no-op.
+
+The existing table is renamed to tasks_legacy and attached as the partition of everything
+created before the current month, so rows aren't copied. Attaching builds the (id, created_at)
+primary key index on it, which locks tasks for writes while it runs. Run it in a maintenance window
+on big tables. Monthly partitions from the current month on are created here and later by
+the maintain_partitions celery task.
+
+Revision ID: d61f0a8b5e3c
+Revises: b4d9e2a7c6f1
+Create Date: 2026-10-19 13:40:52.118735
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.config import TASK_PARTITIONING, TASK_PARTITIONS_AHEAD
+from app.database.partitioning import month_start, is_partitioned, task_partition_ddl
+
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd61f0a8b5e3c'
+down_revision: Union[str, None] = 'b4d9e2a7c6f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# name, columns, where
+TASK_INDEXES = [
+    ('ix_tasks_id', 'id', None),
+    ('ix_tasks_api_key_id', 'api_key_id', None),
+    ('ix_tasks_created_at_id', 'created_at, id', None),
+    ('ix_tasks_user_id_created_at_id', 'user_id, created_at, id', None),
+    ('ix_tasks_user_id_state_created_at_id', 'user_id, state, created_at, id', None),
+    ('ix_tasks_user_id_api_key_id_created_at_id', 'user_id, api_key_id, created_at, id', None),
+    ('ix_tasks_processing', 'id', "state = 'processing'"),
+]
+
+
+def create_task_indexes():
+    for name, columns, where in TASK_INDEXES:
+        op.execute(f"CREATE INDEX {name} ON tasks ({columns})" + (f" WHERE {where}" if where else ""))
+
+def tasks_partitioned() -> bool:
+    # the database can't be inspected when only generating sql.
+    if op.get_context().as_sql:
+        return TASK_PARTITIONING
+    return is_partitioned(op.get_bind())
+
+def add_task_foreign_keys():
+    op.execute("ALTER TABLE tasks ADD CONSTRAINT tasks_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)")
+    op.execute("ALTER TABLE tasks ADD CONSTRAINT tasks_api_key_id_fkey FOREIGN KEY (api_key_id) REFERENCES api_keys (id)")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_context().dialect.name != 'postgresql' or not TASK_PARTITIONING:
+        return
+
+    now = datetime.now()
+    first_partition_start = month_start(now).isoformat(' ')
+
+    op.execute("ALTER TABLE tasks RENAME TO tasks_legacy")
+    for name, _, _ in TASK_INDEXES:
+        op.execute(f"ALTER INDEX {name} RENAME TO {name}_legacy")
+    # the primary key of a partitioned table must include the partition key.
+    op.execute("ALTER TABLE tasks_legacy DROP CONSTRAINT tasks_pkey")
+
+    op.execute("CREATE TABLE tasks (LIKE tasks_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute("ALTER TABLE tasks ADD PRIMARY KEY (id, created_at)")
+    op.execute("ALTER SEQUENCE tasks_id_seq OWNED BY tasks.id")
+    add_task_foreign_keys()
+    # the legacy partition's indexes are matched and attached to these instead of being rebuilt.
+    create_task_indexes()
+
+    # a validated check constraint lets attaching skip scanning the table.
+    op.execute(f"ALTER TABLE tasks_legacy ADD CONSTRAINT tasks_legacy_created_at_check "
+               f"CHECK (created_at < '{first_partition_start}') NOT VALID")
+    op.execute("ALTER TABLE tasks_legacy VALIDATE CONSTRAINT tasks_legacy_created_at_check")
+    op.execute(f"ALTER TABLE tasks ATTACH PARTITION tasks_legacy "
+               f"FOR VALUES FROM (MINVALUE) TO ('{first_partition_start}')")
+    op.execute("ALTER TABLE tasks_legacy DROP CONSTRAINT tasks_legacy_created_at_check")
+
+    for i in range(TASK_PARTITIONS_AHEAD + 1):
+        _, ddl = task_partition_ddl(month_start(now, i))
+        op.execute(ddl)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_context().dialect.name != 'postgresql' or not tasks_partitioned():
+        return
+
+    op.execute("ALTER TABLE tasks RENAME TO tasks_partitioned")
+    op.execute("CREATE TABLE tasks (LIKE tasks_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO tasks SELECT * FROM tasks_partitioned")
+    op.execute("ALTER SEQUENCE tasks_id_seq OWNED BY tasks.id")
+    # drops the partitions and their indexes too, which frees the index names.
+    op.execute("DROP TABLE tasks_partitioned")
+
+    op.execute("ALTER TABLE tasks ADD PRIMARY KEY (id)")
+    add_task_foreign_keys()
+    create_task_indexes()
@@ -0,0 +1,45 @@
+"""task stats
+
+Revision ID: e2a94c7d1b08
+Revises: d61f0a8b5e3c
+Create Date: 2026-10-19 15:21:44.906127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a94c7d1b08'
+down_revision: Union[str, None] = 'd61f0a8b5e3c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('task_stats',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('api_key_id', sa.Integer(), nullable=False),
+    sa.Column('result', sa.Integer(), nullable=False),
+    # the type already exists. it was created with the tasks table.
+    sa.Column('state', postgresql.ENUM('processing', 'done', 'failed', name='stateenum', create_type=False)
+              .with_variant(sa.Enum('processing', 'done', 'failed', name='stateenum'), 'sqlite'), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'user_id', 'api_key_id', 'result', 'state')
+    )
+    op.create_index('ix_task_stats_user_id_day', 'task_stats', ['user_id', 'day'], unique=False)
+    # stats of existing tasks. the rollup job only rebuilds the recent days afterwards.
+    op.execute("INSERT INTO task_stats (day, user_id, api_key_id, result, state, count) "
+               "SELECT date(created_at), user_id, api_key_id, coalesce(result, -1), state, count(*) FROM tasks "
+               "GROUP BY date(created_at), user_id, api_key_id, coalesce(result, -1), state")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_task_stats_user_id_day', table_name='task_stats')
+    op.drop_table('task_stats')
@@ -0,0 +1,101 @@
+"""compact task rows
+
+result and attempts become smallint and results of unfinished tasks become null instead of -1.
+filename becomes nullable and is cleared for done and cancelled tasks, whose files are removed already,
+and for archived tasks. state stays a native enum on postgres.
+
+The change tracking triggers are disabled while rows are changed, so the change feed isn't flooded.
+On postgres the type changes rewrite the table, which locks it. Run it in a maintenance window on big tables.
+Columns can't be reordered in place. Tables created from the models have the aligned column order.
+Existing tables keep theirs until they are rebuilt, e.g. with a dump and restore.
+
+Revision ID: e8c41b7f2a96
+Revises: 9a7d4e2c1f35
+Create Date: 2026-10-19 22:04:17.530846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.database.change_tracking import SQLITE_TASK_CHANGE_DDL, SQLITE_TASK_CHANGE_DROP_DDL
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8c41b7f2a96'
+down_revision: Union[str, None] = '9a7d4e2c1f35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def is_postgres() -> bool:
+    return op.get_context().dialect.name == 'postgresql'
+
+def change_tasks(changes):
+    """
+    Runs changes with the change tracking triggers off.
+    """
+    if is_postgres():
+        op.execute("ALTER TABLE tasks DISABLE TRIGGER tasks_track_change")
+        changes()
+        op.execute("ALTER TABLE tasks ENABLE TRIGGER tasks_track_change")
+        return
+
+    for statement in SQLITE_TASK_CHANGE_DROP_DDL:
+        op.execute(statement)
+    # the table is copied by batch operations. the partial index is created again with its where clause.
+    op.drop_index('ix_tasks_processing', table_name='tasks')
+    changes()
+    op.create_index('ix_tasks_processing', 'tasks', ['state', 'updated_at'], unique=False,
+                    sqlite_where=sa.text("state = 'processing'"))
+    for statement in SQLITE_TASK_CHANGE_DDL:
+        op.execute(statement)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    def changes():
+        with op.batch_alter_table('tasks') as batch_op:
+            batch_op.alter_column('result', existing_type=sa.Integer(), type_=sa.SmallInteger(),
+                                  existing_nullable=True, postgresql_using='nullif(result, -1)::smallint')
+            batch_op.alter_column('attempts', existing_type=sa.Integer(), type_=sa.SmallInteger(),
+                                  existing_nullable=False, existing_server_default='0',
+                                  postgresql_using='attempts::smallint')
+            batch_op.alter_column('filename', existing_type=sa.String(), nullable=True)
+        if not is_postgres():
+            # postgres converted them while rewriting the table.
+            op.execute("UPDATE tasks SET result = NULL WHERE result = -1")
+        op.execute("UPDATE tasks SET filename = NULL WHERE state IN ('done', 'cancelled')")
+    change_tasks(changes)
+
+    with op.batch_alter_table('tasks_archive') as batch_op:
+        batch_op.alter_column('result', existing_type=sa.Integer(), type_=sa.SmallInteger(),
+                              existing_nullable=True, postgresql_using='nullif(result, -1)::smallint')
+        batch_op.alter_column('filename', existing_type=sa.String(), nullable=True)
+    if not is_postgres():
+        op.execute("UPDATE tasks_archive SET result = NULL WHERE result = -1")
+    op.execute("UPDATE tasks_archive SET filename = NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("UPDATE tasks_archive SET filename = '' WHERE filename IS NULL")
+    with op.batch_alter_table('tasks_archive') as batch_op:
+        batch_op.alter_column('filename', existing_type=sa.String(), nullable=False)
+        batch_op.alter_column('result', existing_type=sa.SmallInteger(), type_=sa.Integer(),
+                              existing_nullable=True, postgresql_using='coalesce(result, -1)')
+    if not is_postgres():
+        op.execute("UPDATE tasks_archive SET result = -1 WHERE result IS NULL")
+
+    def changes():
+        op.execute("UPDATE tasks SET filename = '' WHERE filename IS NULL")
+        with op.batch_alter_table('tasks') as batch_op:
+            batch_op.alter_column('filename', existing_type=sa.String(), nullable=False)
+            batch_op.alter_column('attempts', existing_type=sa.SmallInteger(), type_=sa.Integer(),
+                                  existing_nullable=False, existing_server_default='0')
+            batch_op.alter_column('result', existing_type=sa.SmallInteger(), type_=sa.Integer(),
+                                  existing_nullable=True, postgresql_using='coalesce(result, -1)')
+        if not is_postgres():
+            op.execute("UPDATE tasks SET result = -1 WHERE result IS NULL")
+    change_tasks(changes)
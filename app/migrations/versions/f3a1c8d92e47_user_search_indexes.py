@@ -0,0 +1,49 @@
+"""user search indexes
+
+Indexes lower(username) and lower(email) for searching users by prefix. On postgres they use
+text_pattern_ops so LIKE 'prefix%' can use them, and trigram indexes are added for substring searches.
+The pg_trgm extension is created if it isn't there, which needs the privilege to create extensions.
+On postgres the indexes are built concurrently, so users isn't locked for writes while they're built.
+
+Revision ID: f3a1c8d92e47
+Revises: e8c41b7f2a96
+Create Date: 2026-10-19 22:47:03.615290
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a1c8d92e47'
+down_revision: Union[str, None] = 'e8c41b7f2a96'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SEARCHED_COLUMNS = ['username', 'email']
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_context().dialect.name != 'postgresql':
+        for column in SEARCHED_COLUMNS:
+            op.execute(f"CREATE INDEX ix_users_{column}_lower ON users (lower({column}))")
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # concurrent index builds can't run in a transaction.
+    with op.get_context().autocommit_block():
+        for column in SEARCHED_COLUMNS:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_{column}_lower "
+                       f"ON users (lower({column}) text_pattern_ops)")
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_{column}_trgm "
+                       f"ON users USING gin (lower({column}) gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for column in SEARCHED_COLUMNS:
+        op.execute(f"DROP INDEX IF EXISTS ix_users_{column}_lower")
+        op.execute(f"DROP INDEX IF EXISTS ix_users_{column}_trgm")
@@ -0,0 +1,103 @@
+"""cascading foreign keys and task failure columns
+
+Revision ID: f7b3c2a91d40
+Revises: e2a94c7d1b08
+Create Date: 2026-10-19 17:05:31.662410
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.config import TASK_PARTITIONING
+from app.database.partitioning import is_partitioned
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7b3c2a91d40'
+down_revision: Union[str, None] = 'e2a94c7d1b08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# table, column, referred table
+FOREIGN_KEYS = [
+    ('api_keys', 'owner_id', 'users'),
+    ('tasks', 'user_id', 'users'),
+    ('tasks', 'api_key_id', 'api_keys'),
+]
+
+# the foreign keys made by the first migration have no names on sqlite. batch mode names them with this.
+# it's the same as postgres' default names.
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+PROCESSING_CONDITION = sa.text("state = 'processing'")
+
+
+def skip_validation(table: str) -> bool:
+    # the rows were checked by the old constraints, so scanning them again while the tables are locked is skipped.
+    # postgres can't do this for partitioned tables.
+    if op.get_context().dialect.name != 'postgresql':
+        return False
+    if op.get_context().as_sql:
+        return not (table == 'tasks' and TASK_PARTITIONING)
+    return not is_partitioned(op.get_bind(), table)
+
+def replace_foreign_keys(table: str, ondelete: str | None) -> list[str]:
+    names = []
+    with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+        for fk_table, column, referred_table in FOREIGN_KEYS:
+            if fk_table != table:
+                continue
+            name = f"{table}_{column}_fkey"
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred_table, [column], ['id'], ondelete=ondelete,
+                                        postgresql_not_valid=skip_validation(table))
+            names.append(name)
+    return names
+
+def validate_foreign_keys(table: str, names: list[str]):
+    # validating doesn't block writes. it runs after the migration's transaction releases its locks.
+    if not skip_validation(table):
+        return
+    with op.get_context().autocommit_block():
+        for name in names:
+            op.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {name}")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # recreated below on (state, updated_at) for finding stuck tasks.
+    op.drop_index('ix_tasks_processing', table_name='tasks')
+
+    op.add_column('tasks', sa.Column('error_code', sa.String(length=32), nullable=True))
+    op.add_column('tasks', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tasks_archive', sa.Column('error_code', sa.String(length=32), nullable=True))
+
+    api_keys_foreign_keys = replace_foreign_keys('api_keys', ondelete='CASCADE')
+    tasks_foreign_keys = replace_foreign_keys('tasks', ondelete='CASCADE')
+
+    op.create_index('ix_tasks_processing', 'tasks', ['state', 'updated_at'], unique=False,
+                    postgresql_where=PROCESSING_CONDITION,
+                    sqlite_where=PROCESSING_CONDITION)
+
+    validate_foreign_keys('api_keys', api_keys_foreign_keys)
+    validate_foreign_keys('tasks', tasks_foreign_keys)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tasks_processing', table_name='tasks')
+
+    validate_foreign_keys('tasks', replace_foreign_keys('tasks', ondelete=None))
+    validate_foreign_keys('api_keys', replace_foreign_keys('api_keys', ondelete=None))
+
+    op.drop_column('tasks_archive', 'error_code')
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('attempts')
+        batch_op.drop_column('error_code')
+
+    op.create_index('ix_tasks_processing', 'tasks', ['id'], unique=False,
+                    postgresql_where=PROCESSING_CONDITION,
+                    sqlite_where=PROCESSING_CONDITION)
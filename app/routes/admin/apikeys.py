@@ -1,10 +1,26 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import APIKey
-from app.database.db import get_db
+from app.database.models import APIKey, Task
+from app.database.db import get_async_db
+from app.utils.replica import get_async_read_db
+from app.utils.pagination import fetch_page, estimate_count, set_page_headers
+from app.utils.bulk import iterate_chunks
+from app.utils.deletion import tasks_beyond_threshold
+from app.utils.retention import remove_task_files
+from app.utils.task_cache import uncache_tasks
+from app.utils.cache import async_redis_connection
+from app.tasks import delete_api_key_task
+from app.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.data_models import apikey as apikey_dm
-from app.utils.auth import get_current_admin_user, generate_api_key
+from app.data_models.bulk import BulkResult
+from app.utils.auth import (get_current_admin_user,
+                            generate_api_key,
+                            api_key_cache,
+                            api_key_cache_key)
 
 router = APIRouter(prefix="/admin",
                    tags=["admin", "apikeys"],
@@ -12,21 +28,28 @@ router = APIRouter(prefix="/admin",
 
 @router.get("/apikeys", response_model=list[apikey_dm.APIKeyAdmin])
 async def get_apikeys(
-    skip: int = 0, 
-    limit: int = 10, 
+    response: Response,
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = False,
     is_active: bool = None,
     owner_id: int = None,
-    db=Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Gets the list of API keys. The result can be filtered with user ID and activeness and also supports pagination.
 
-    - **skip**: Skips the list of API keys by this amount. Used for pagination.
+    If there are more API keys, the cursor of the next page is sent in X-Next-Cursor header.
+
+    - **cursor**: The cursor of the next page.
+    - **skip**: Skips the list of API keys by this amount. Deprecated, use cursor instead. It gets slower on deeper pages.
     - **limit**: Limits the number of results by this amount.
+    - **include_total**: If set to True, the approximate number of API keys is sent in X-Total-Count header.
     - **owner_id**: If set to a value, only returns the API keys of the specified user.
     - **is_active**: If set to a boolean value, the results will be filtered by key's activeness.
     """
-    query = db.query(APIKey)
+    query = select(APIKey)
     
     if is_active is not None:
         query = query.filter(APIKey.is_active == is_active)
@@ -34,7 +57,10 @@ async def get_apikeys(
     if owner_id is not None:
         query = query.filter(APIKey.owner_id == owner_id)
     
-    apikeys = query.offset(skip).limit(limit).all()
+    # ids increase with creation time, so they are enough as the sort key.
+    apikeys, next_cursor = await fetch_page(db, query.offset(skip), [APIKey.id], cursor, limit)
+    total = await estimate_count(db, query) if include_total else None
+    set_page_headers(response, next_cursor, total)
     if not apikeys:
         raise HTTPException(status_code=404, detail="No API keys found")
     return apikeys
@@ -42,7 +68,7 @@ async def get_apikeys(
 @router.post("/apikeys/new", response_model=apikey_dm.APIKeyAdmin)
 async def create_apikey(
     apikey_data: apikey_dm.APIKeyCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Creates a new API key.
@@ -54,22 +80,79 @@ async def create_apikey(
 
     apikey_instance = APIKey(**apikey_data_dict)
     db.add(apikey_instance)
-    db.commit()
-    db.refresh(apikey_instance)
+    await db.commit()
+    await db.refresh(apikey_instance)
 
     return apikey_instance
 
+def _bulk_query(apikey_filter: apikey_dm.APIKeyBulkFilter):
+    query = select(APIKey.id, APIKey.key)
+
+    if apikey_filter.ids is not None:
+        query = query.filter(APIKey.id.in_(apikey_filter.ids))
+
+    if apikey_filter.owner_id is not None:
+        query = query.filter(APIKey.owner_id == apikey_filter.owner_id)
+
+    if apikey_filter.expires_before is not None:
+        query = query.filter(APIKey.expiration_date < apikey_filter.expires_before)
+
+    return query
+
+async def _bulk_update(db: AsyncSession, query, values: dict) -> int:
+    """
+    Updates the API keys selected by query in chunks, each in its own transaction, and drops them from the cache.
+    """
+    affected = 0
+    async for rows in iterate_chunks(db, query, APIKey.id):
+        result = await db.execute(update(APIKey).filter(APIKey.id.in_([row.id for row in rows]))
+                                  .values(values)
+                                  .execution_options(synchronize_session=False))
+        await db.commit()
+        await api_key_cache.invalidate(*[api_key_cache_key(row.key) for row in rows])
+        affected += result.rowcount
+    return affected
+
+@router.post("/apikeys/bulk-revoke", response_model=BulkResult)
+async def bulk_revoke_apikeys(
+    apikey_filter: apikey_dm.APIKeyBulkFilter,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Deactivates all the active API keys matching the filter.
+    If the request fails midway, the keys revoked so far stay revoked.
+
+    - **apikey_filter**: API key IDs and/or owner ID and expiration time of the keys.
+    """
+    query = _bulk_query(apikey_filter).filter(APIKey.is_active == True)
+    return {"affected": await _bulk_update(db, query, {"is_active": False})}
+
+@router.post("/apikeys/bulk-extend", response_model=BulkResult)
+async def bulk_extend_apikeys(
+    apikey_extend: apikey_dm.APIKeyBulkExtend,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Sets the expiration date of all the API keys matching the filter. Keys which expire later
+    or never are left unchanged, so no key's lifetime is shortened.
+    If the request fails midway, the keys extended so far stay extended.
+
+    - **apikey_extend**: The filter of the keys and their new expiration date.
+    """
+    query = _bulk_query(apikey_extend.filter).filter(APIKey.expiration_date < apikey_extend.expiration_date)
+    return {"affected": await _bulk_update(db, query, {"expiration_date": apikey_extend.expiration_date})}
+
 @router.get("/apikeys/{apikey_id}", response_model=apikey_dm.APIKeyAdmin)
 async def get_apikey(
     apikey_id: int, 
-    db=Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get an API key's information.
 
     - **apikey_id**: API keys's unique identifier.
     """
-    apikey = db.query(APIKey).filter(APIKey.id == apikey_id).first()
+    apikey = await db.get(APIKey, apikey_id)
     if not apikey:
         raise HTTPException(status_code=404, detail="API key not found")
     return apikey
@@ -78,7 +161,7 @@ async def get_apikey(
 async def update_apikey(
     apikey_id: int,
     apikey_update: apikey_dm.APIKeyUpdate,
-    db=Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Updates a API key's informations.
@@ -87,9 +170,12 @@ async def update_apikey(
     - **apikey_update**: API key data.
     """
     update_data = apikey_update.model_dump(exclude_none=True)
-    result = db.query(APIKey).filter(APIKey.id == apikey_id).update(update_data)
-    db.commit()
-    if result > 0:
+    # the key itself may change, so the old one is needed for invalidating the cache.
+    old_key = await db.scalar(select(APIKey.key).filter(APIKey.id == apikey_id))
+    result = await db.execute(update(APIKey).filter(APIKey.id == apikey_id).values(update_data))
+    await db.commit()
+    if result.rowcount > 0:
+        await api_key_cache.invalidate(api_key_cache_key(old_key))
         return {"message": "API key info updated"}
     else:
         raise HTTPException(404, f"API key with id {apikey_id} not found")
@@ -97,16 +183,35 @@ async def update_apikey(
 @router.delete("/apikeys/{apikey_id}", status_code=204)
 async def delete_apikey(
     apikey_id: int,
-    db=Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Deletes an API key. This **does not** ask for confirmation. Use with caution.
 
+    The key's tasks are deleted by the database. Keys with more than BACKGROUND_DELETION_THRESHOLD tasks
+    are deactivated right away and deleted by a background job. The response is then 202 with the job's ID.
+    See /admin/jobs/{job_id}.
+
     - **apikey_id**: API key's unique identifier.
     """
-    apikey = db.query(APIKey).filter(APIKey.id == apikey_id).first()
+    apikey = await db.get(APIKey, apikey_id)
     if not apikey:
         raise HTTPException(status_code=404, detail="API key not found")
-    db.delete(apikey)
-    db.commit()
-    return {"message": f"API key {apikey_id} deleted."}
+
+    if await db.scalar(tasks_beyond_threshold(Task.api_key_id == apikey_id)) is not None:
+        apikey.is_active = False
+        await db.commit()
+        await api_key_cache.invalidate(api_key_cache_key(apikey.key))
+        # publishing to the broker blocks.
+        job = await run_in_threadpool(delete_api_key_task.delay, apikey_id)
+        return JSONResponse(status_code=202,
+                            content={"message": f"API key {apikey_id} deactivated and queued for deletion.",
+                                     "job_id": job.id})
+
+    tasks = (await db.execute(select(Task.id, Task.user_id, Task.filename).filter(Task.api_key_id == apikey_id))).all()
+    await db.delete(apikey)
+    await db.commit()
+    await api_key_cache.invalidate(api_key_cache_key(apikey.key))
+    await uncache_tasks(async_redis_connection, tasks)
+    await run_in_threadpool(remove_task_files, [task.filename for task in tasks])
+    return {"message": f"API key {apikey_id} deleted."}
\ No newline at end of file
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends
+
+from app.utils.auth import get_current_admin_user, api_key_cache, user_cache
+
+router = APIRouter(prefix="/admin",
+                   tags=["admin", "cache"],
+                   dependencies=[Depends(get_current_admin_user)])
+
+@router.get("/cache")
+async def get_cache_stats():
+    """
+    Gets the hit and miss counts of the authentication caches of the API process.
+    Local hits are served from process memory and redis hits from the shared cache.
+    """
+    return {
+        "api_keys": api_key_cache.stats(),
+        "users": user_cache.stats(),
+    }
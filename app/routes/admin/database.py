@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+
+from app.database.db import get_pool_stats
+from app.utils.auth import get_current_admin_user
+
+router = APIRouter(prefix="/admin",
+                   tags=["admin", "database"],
+                   dependencies=[Depends(get_current_admin_user)])
+
+@router.get("/database/pool")
+async def get_database_pool_stats():
+    """
+    Gets the connection pool statistics of the API process for both sync and async engines.
+    Includes pool size, checked out and overflow connections and checkout wait times in milliseconds.
+    """
+    return get_pool_stats()
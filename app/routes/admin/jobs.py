@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from celery.result import AsyncResult
+
+from app.utils.auth import get_current_admin_user
+from app.tasks import app as celery_app
+
+router = APIRouter(prefix="/admin",
+                   tags=["admin", "jobs"],
+                   dependencies=[Depends(get_current_admin_user)])
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Gets the state of a background job. e.g. deleting a user with many tasks.
+    Unknown job IDs are reported as PENDING. The result backend is queried, so this is not an async path operation.
+
+    - **job_id**: The job's ID returned when it was started.
+    """
+    job = AsyncResult(job_id, app=celery_app)
+    result = job.result if job.successful() else str(job.result) if job.failed() else None
+    return {"id": job_id, "state": job.state, "result": result}
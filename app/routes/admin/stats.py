@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.models import Task, TaskStat
+from app.data_models import stats as stats_dm
+from app.utils.auth import get_current_admin_user
+from app.utils.replica import get_async_read_db
+
+from typing import List, Literal
+from datetime import date, timedelta
+
+router = APIRouter(prefix="/admin",
+                   tags=["admin", "stats"],
+                   dependencies=[Depends(get_current_admin_user)])
+
+GROUP_BY_COLUMNS = {
+    "day": TaskStat.day,
+    "user_id": TaskStat.user_id,
+    "api_key_id": TaskStat.api_key_id,
+    "result": TaskStat.result,
+    "state": TaskStat.state,
+}
+
+
+@router.get("/stats", response_model=List[stats_dm.TaskStat], response_model_exclude_none=True)
+async def get_task_stats(
+    group_by: List[Literal["day", "user_id", "api_key_id", "result", "state"]] = Query(["day"]),
+    since: date | None = None,
+    until: date | None = None,
+    user_id: int | None = None,
+    api_key_id: int | None = None,
+    task_state: Task.StateEnum | None = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Gets the number of tasks grouped by the given fields. Counts are read from the daily rollups,
+    so they may lag behind the tasks by a few minutes. See TASK_STATS_INTERVAL.
+    Expired tasks are still counted.
+
+    - **group_by**: Fields to group the counts by. Any of day, user_id, api_key_id, result and state.
+                    result is the predicted class and -1 for unfinished tasks.
+    - **since**: The first day to count. Defaults to 30 days before until.
+    - **until**: The last day to count. Defaults to today.
+    - **user_id**: If set to a value, only counts the tasks of the specified user.
+    - **api_key_id**: If set to a value, only counts the tasks of the specified api key.
+    - **task_state**: If set to a value, only counts the tasks with this state.
+    """
+    until = until or date.today()
+    since = since or until - timedelta(days=30)
+    columns = [GROUP_BY_COLUMNS[field].label(field) for field in dict.fromkeys(group_by)]
+
+    query = (select(*columns, func.sum(TaskStat.count).label("count"))
+             .filter(TaskStat.day >= since, TaskStat.day <= until)
+             .group_by(*columns)
+             .order_by(*columns))
+
+    if user_id is not None:
+        query = query.filter(TaskStat.user_id == user_id)
+
+    if api_key_id is not None:
+        query = query.filter(TaskStat.api_key_id == api_key_id)
+
+    if task_state is not None:
+        query = query.filter(TaskStat.state == task_state)
+
+    rows = (await db.execute(query)).all()
+    return [row._mapping for row in rows if row.count]
@@ -1,35 +1,60 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import Task, User
+from app.database.models import Task
 from app.data_models import task as task_dm
+from app.data_models.bulk import BulkResult
+from app.data_models.user import UserPrincipal
 from app.utils.auth import get_current_admin_user
-from app.database.db import get_db
+from app.database.db import get_async_db
+from app.utils.replica import get_async_read_db
+from app.utils.pagination import fetch_page_rows, estimate_count, set_page_headers
+from app.utils.serialization import model_columns, rows_response
+from app.utils.bulk import iterate_chunks
+from app.utils.cancellation import cancel_task
+from app.utils.retention import remove_task_files
+from app.utils.task_cache import refresh_cached_tasks, uncache_tasks
+from app.utils.cache import async_redis_connection
+from app.tasks import revoke_classify_tasks
+from app.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, EXPORT_BATCH_SIZE
 
-from typing import List
+from typing import List, Literal
 from datetime import datetime
 from fastapi import Query
+import csv
+import io
+import json
 
 router = APIRouter(prefix="/admin", tags=["admin", "tasks"])
 
 
 @router.get("/tasks", response_model=List[task_dm.TaskInlineAdmin])
 async def get_tasks(
+    response: Response,
     user_id: int = None,
     task_state: Task.StateEnum | None = None, 
-    skip: int = 0,
-    limit: int = 10,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = False,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserPrincipal = Depends(get_current_admin_user)
 ):
     """
-    Gets the list of tasks. The result can be filtered with user ID and also supports pagination.
+    Gets the list of tasks, newest first. The result can be filtered with user ID and also supports pagination.
+    If there are more tasks, the cursor of the next page is sent in X-Next-Cursor header.
 
-    - **skip**: Skips the list of tasks by this amount. Used for pagination.
+    - **cursor**: The cursor of the next page.
+    - **skip**: Skips the list of tasks by this amount. Deprecated, use cursor instead. It gets slower on deeper pages.
     - **limit**: Limits the number of results by this amount.
+    - **include_total**: If set to True, the approximate number of tasks is sent in X-Total-Count header.
     - **user_id**: If set to a value, only returns the tasks of the specified user.
     """
-    query = db.query(Task)
+    # created_at is the sort key. it isn't sent.
+    query = select(*model_columns(task_dm.TaskInlineAdmin, Task), Task.created_at)
     
     if user_id is not None:
         query = query.filter(Task.user_id == user_id)
@@ -37,30 +62,175 @@ async def get_tasks(
     if task_state is not None:
         query = query.filter(Task.state == task_state)
     
-    tasks = query.offset(skip).limit(limit).all()
-    return tasks
+    page, next_cursor = await fetch_page_rows(db, query.offset(skip), [Task.created_at, Task.id], cursor, limit,
+                                              descending=True)
+    total = await estimate_count(db, query) if include_total else None
+    set_page_headers(response, next_cursor, total)
+    return rows_response(page, task_dm.TaskInlineAdmin, headers=response.headers)
+
+EXPORT_COLUMNS = [Task.id, Task.user_id, Task.api_key_id, Task.state, Task.result, Task.created_at, Task.updated_at]
+EXPORT_FIELDS = [column.key for column in EXPORT_COLUMNS]
+
+
+def _export_values(row) -> list:
+    return [value.value if isinstance(value, Task.StateEnum)
+            else value.isoformat() if isinstance(value, datetime)
+            else value
+            for value in row]
+
+def _encode_ndjson(rows) -> str:
+    return "".join(json.dumps(dict(zip(EXPORT_FIELDS, _export_values(row)))) + "\n" for row in rows)
+
+def _encode_csv(rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_FIELDS)
+    writer.writerows(_export_values(row) for row in rows)
+    return buffer.getvalue()
+
+async def _stream_export(db: AsyncSession, query, export_format: str):
+    """
+    Reads the rows with a server side cursor in batches and encodes each batch as soon as it's read.
+    Only one batch is held in memory at a time.
+    """
+    try:
+        if export_format == "csv":
+            yield _encode_csv([], header=True)
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield _encode_csv(rows) if export_format == "csv" else _encode_ndjson(rows)
+    finally:
+        # the session dependency is closed before the response is streamed, so the session
+        # is reused here and must be closed again to release the connection.
+        await db.close()
+
+@router.get("/tasks/export")
+async def export_tasks(
+    export_format: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    user_id: int = None,
+    task_state: Task.StateEnum | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserPrincipal = Depends(get_current_admin_user)
+):
+    """
+    Exports tasks as newline delimited json or csv. The result is streamed, so any number of tasks
+    can be exported in one request. Tasks are ordered by ID.
+
+    - **format**: ndjson or csv.
+    - **user_id**: If set to a value, only exports the tasks of the specified user.
+    - **task_state**: If set to a value, only exports the tasks with this state.
+    - **created_after**: If set to a value, only exports the tasks created at or after this time.
+    - **created_before**: If set to a value, only exports the tasks created before this time.
+    """
+    query = select(*EXPORT_COLUMNS).order_by(Task.id)
+
+    if user_id is not None:
+        query = query.filter(Task.user_id == user_id)
+
+    if task_state is not None:
+        query = query.filter(Task.state == task_state)
+
+    if created_after is not None:
+        query = query.filter(Task.created_at >= created_after)
+
+    if created_before is not None:
+        query = query.filter(Task.created_at < created_before)
+
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    return StreamingResponse(_stream_export(db, query, export_format),
+                             media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename=tasks.{export_format}"})
+
+@router.post("/tasks/bulk-delete", response_model=BulkResult)
+async def bulk_delete_tasks(
+    task_filter: task_dm.TaskBulkFilter,
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: UserPrincipal = Depends(get_current_admin_user)
+):
+    """
+    Deletes all the tasks matching the filter. This **does not** ask for confirmation. Use with caution.
+    Tasks are deleted in chunks, each in its own transaction. If the request fails midway, the deleted chunks stay deleted.
+    Queued messages of processing tasks are revoked and the uploaded images are deleted.
+
+    - **task_filter**: Task IDs and/or user ID, API key ID, state and creation time range of the tasks.
+    """
+    query = select(Task.id, Task.user_id, Task.state, Task.filename)
+
+    if task_filter.ids is not None:
+        query = query.filter(Task.id.in_(task_filter.ids))
+
+    if task_filter.user_id is not None:
+        query = query.filter(Task.user_id == task_filter.user_id)
+
+    if task_filter.api_key_id is not None:
+        query = query.filter(Task.api_key_id == task_filter.api_key_id)
+
+    if task_filter.state is not None:
+        query = query.filter(Task.state == task_filter.state)
+
+    if task_filter.created_after is not None:
+        query = query.filter(Task.created_at >= task_filter.created_after)
+
+    if task_filter.created_before is not None:
+        query = query.filter(Task.created_at < task_filter.created_before)
+
+    affected = 0
+    async for rows in iterate_chunks(db, query, Task.id):
+        result = await db.execute(delete(Task).filter(Task.id.in_([row.id for row in rows]))
+                                  .execution_options(synchronize_session=False))
+        await db.commit()
+        await uncache_tasks(async_redis_connection, rows)
+        # both talk to other systems and may block.
+        await run_in_threadpool(revoke_classify_tasks,
+                                [row.id for row in rows if row.state == Task.StateEnum.processing])
+        await run_in_threadpool(remove_task_files, [row.filename for row in rows])
+        affected += result.rowcount
+    return {"affected": affected}
 
 @router.get("/tasks/{task_id}", response_model=task_dm.TaskAdmin)
 async def get_task(
     task_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: UserPrincipal = Depends(get_current_admin_user)
 ):
     """
     Get a task's information.
 
     - **task_id**: Task's unique identifier.
     """
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(404, f"Task with id {task_id} not found")
     
     return task
 
+@router.post("/tasks/{task_id}/cancel", response_model=task_dm.TaskAdmin)
+async def cancel_processing_task(
+    task_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: UserPrincipal = Depends(get_current_admin_user)
+):
+    """
+    Cancels a processing task. Its queued message is revoked and its image is deleted.
+
+    - **task_id**: Task's unique identifier.
+    """
+    task = await db.get(Task, task_id)
+    if not task:
+        raise HTTPException(404, f"Task with id {task_id} not found")
+
+    if not await cancel_task(db, task):
+        raise HTTPException(409, f"Task with id {task_id} is already {task.state.value}")
+
+    return task
+
 @router.patch("/tasks/{task_id}")
 async def update_task(task_id: int, task: task_dm.TaskUpdate,
-                      current_admin: User = Depends(get_current_admin_user),
-                      db: Session = Depends(get_db)):
+                      current_admin: UserPrincipal = Depends(get_current_admin_user),
+                      db: AsyncSession = Depends(get_async_db)):
     """
     Updates a taks' informations.
 
@@ -68,27 +238,29 @@ async def update_task(task_id: int, task: task_dm.TaskUpdate,
     - **task**: Task data.
     """
     update_data = task.model_dump(exclude_none=True)
-    result = db.query(Task).filter(Task.id == task_id).update(update_data)
-    db.commit()
-    if result > 0:
+    result = await db.execute(update(Task).filter(Task.id == task_id).values(update_data))
+    await db.commit()
+    await refresh_cached_tasks(db, async_redis_connection, [task_id])
+    if result.rowcount > 0:
         return {"message": "Task updated"}
     else:
         raise HTTPException(404, f"Task with id {task_id} not found")
     
 @router.delete("/tasks/{task_id}")
 async def delete_task(task_id: int,
-                      current_admin: User = Depends(get_current_admin_user),
-                      db: Session = Depends(get_db)):
+                      current_admin: UserPrincipal = Depends(get_current_admin_user),
+                      db: AsyncSession = Depends(get_async_db)):
     """
     Deletes a task. This **does not** ask for confirmation. Use with caution.
 
     - **task_id**: Task's unique identifier.
     """
-    task = db.query(Task).filter(Task.id == task_id).first()
+    task = await db.get(Task, task_id)
     if not task:
         raise HTTPException(404, f"Task with id {task_id} not found")
     
-    db.delete(task)
-    db.commit()
+    await db.delete(task)
+    await db.commit()
+    await uncache_tasks(async_redis_connection, [task])
     return {"message": f"Task {task_id} deleted."}
     
\ No newline at end of file
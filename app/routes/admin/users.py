@@ -1,10 +1,29 @@
-from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import User
-from app.database.db import get_db
+from app.database.models import User, APIKey, Task
+from app.database.db import get_async_db
+from app.utils.replica import get_async_read_db
+from app.utils.pagination import fetch_page, estimate_count, set_page_headers
+from app.utils.search import search_filter, SearchMode
+from app.utils.bulk import iterate_chunks
+from app.utils.deletion import tasks_beyond_threshold
+from app.utils.retention import remove_task_files
+from app.utils.task_cache import uncache_tasks
+from app.utils.cache import async_redis_connection
+from app.tasks import delete_user_task
+from app.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.data_models import user as user_dm
-from app.utils.auth import get_current_admin_user, hash_password
+from app.data_models.bulk import BulkResult
+from app.utils.auth import (get_current_admin_user,
+                            async_hash_password,
+                            password_route_limiter,
+                            api_key_cache,
+                            user_cache,
+                            get_user_api_key_cache_keys)
 
 router = APIRouter(prefix="/admin",
                    tags=["admin", "users"],
@@ -12,62 +31,111 @@ router = APIRouter(prefix="/admin",
 
 @router.get("/users", response_model=list[user_dm.User])
 async def get_users(
-    skip: int = 0, 
-    limit: int = 10, 
+    response: Response,
+    cursor: str | None = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = False,
     role: User.RoleEnum = None, 
     is_active: bool = None,
-    db: Session = Depends(get_db)
+    search: str | None = Query(None, min_length=1, max_length=254),
+    search_mode: SearchMode = "prefix",
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Gets the list of users. The result can be filtered with user role and account activeness and also supports pagination.
+    Users can be searched by username or email too.
 
-    - **skip**: Skips the list of users by this amount. Used for pagination.
+    If there are more users, the cursor of the next page is sent in X-Next-Cursor header.
+
+    - **cursor**: The cursor of the next page.
+    - **skip**: Skips the list of users by this amount. Deprecated, use cursor instead. It gets slower on deeper pages.
     - **limit**: Limits the number of results by this amount.
+    - **include_total**: If set to True, the approximate number of users is sent in X-Total-Count header.
     - **role**: If set to a value, only returns the users of this role.
     - **is_active**: If set to a boolean value, filters the result by user activeness.
+    - **search**: Only returns the users whose username or email matches it. Case-insensitive.
+    - **search_mode**: "prefix" matches the start of them. "contains" matches anywhere in them on postgres
+                       if search is at least 3 characters long. Otherwise it's the same as "prefix".
     """
-    query = db.query(User)
+    query = select(User)
+    
+    if search:
+        query = query.filter(search_filter([User.username, User.email], search, search_mode, db.bind.dialect.name))
     
     if role:
         query = query.filter(User.role == role)
     if is_active is not None: # it is important this condition be written like this. because False means "only active users" but None means "dont filter by account state."
         query = query.filter(User.is_active == is_active)
     
-    users = query.offset(skip).limit(limit).all()
+    # ids increase with creation time, so they are enough as the sort key.
+    users, next_cursor = await fetch_page(db, query.offset(skip), [User.id], cursor, limit)
+    total = await estimate_count(db, query) if include_total else None
+    set_page_headers(response, next_cursor, total)
     if not users:
         raise HTTPException(status_code=404, detail="No users found")
     return users
 
-@router.post("/users/new", response_model=user_dm.User)
+@router.post("/users/new", response_model=user_dm.User, dependencies=[Depends(password_route_limiter)])
 async def create_user(user_data: user_dm.UserCreateAdmin,
-                      db: Session = Depends(get_db)):
+                      db: AsyncSession = Depends(get_async_db)):
     """
     Creates a new user.
 
     - **user_data**: User data.
     """
     user_data_dict = user_data.model_dump(exclude_none=True)
-    user_data_dict["hashed_password"] = hash_password(user_data_dict["password"])
+    user_data_dict["hashed_password"] = await async_hash_password(user_data_dict["password"])
     del user_data_dict["password"]
 
     user_instance = User(**user_data_dict)
     db.add(user_instance)
-    db.commit()
-    db.refresh(user_instance)
+    await db.commit()
+    await db.refresh(user_instance)
 
     return user_instance
 
+@router.post("/users/bulk-deactivate", response_model=BulkResult)
+async def bulk_deactivate_users(
+    user_filter: user_dm.UserBulkFilter,
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: user_dm.UserPrincipal = Depends(get_current_admin_user)
+):
+    """
+    Deactivates all the active users matching the filter, except the admin sending the request.
+    Users are deactivated in chunks, each in its own transaction. If the request fails midway, the deactivated chunks stay deactivated.
+
+    - **user_filter**: User IDs and/or role of the users.
+    """
+    query = select(User.id, User.username).filter(User.is_active == True, User.id != current_admin.id)
+
+    if user_filter.ids is not None:
+        query = query.filter(User.id.in_(user_filter.ids))
+
+    if user_filter.role is not None:
+        query = query.filter(User.role == user_filter.role)
+
+    affected = 0
+    async for rows in iterate_chunks(db, query, User.id):
+        result = await db.execute(update(User).filter(User.id.in_([row.id for row in rows]))
+                                  .values(is_active=False)
+                                  .execution_options(synchronize_session=False))
+        await db.commit()
+        await user_cache.invalidate(*[row.username for row in rows])
+        affected += result.rowcount
+    return {"affected": affected}
+
 @router.get("/users/{user_id}", response_model=user_dm.User)
 async def get_user(
     user_id: int, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get a user's information.
 
     - **user_id**: User's unique identifier.
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -76,7 +144,7 @@ async def get_user(
 async def update_user(
     user_id: int,
     user_update: user_dm.UserUpdateAdmin,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Updates a user informations.
@@ -85,9 +153,14 @@ async def update_user(
     - **user_data**: User data.
     """
     update_data = user_update.model_dump(exclude_none=True)
-    result = db.query(User).filter(User.id == user_id).update(update_data)
-    db.commit()
-    if result > 0:
+    # users are cached by username which may change too.
+    old_username = await db.scalar(select(User.username).filter(User.id == user_id))
+    result = await db.execute(update(User).filter(User.id == user_id).values(update_data))
+    await db.commit()
+    if result.rowcount > 0:
+        await user_cache.invalidate(old_username)
+        if "username" in update_data: # cached keys hold the owner's username.
+            await api_key_cache.invalidate(*await get_user_api_key_cache_keys(db, user_id))
         return {"message": "User info updated"}
     else:
         raise HTTPException(404, f"User with id {user_id} not found")
@@ -95,16 +168,40 @@ async def update_user(
 @router.delete("/users/{user_id}", status_code=204)
 async def delete_user(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Deletes a user. This **does not** ask for confirmation. Use with caution.
 
+    The user's API keys and tasks are deleted by the database. Users with more than BACKGROUND_DELETION_THRESHOLD tasks
+    are deactivated right away and deleted by a background job. The response is then 202 with the job's ID.
+    See /admin/jobs/{job_id}.
+
     - **user_id**: User's unique identifier.
     """
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(user)
-    db.commit()
+    # the keys are deleted with the user so they must be gone from the cache too.
+    cache_keys = await get_user_api_key_cache_keys(db, user_id)
+
+    if await db.scalar(tasks_beyond_threshold(Task.user_id == user_id)) is not None:
+        await db.execute(update(User).filter(User.id == user_id).values(is_active=False))
+        await db.execute(update(APIKey).filter(APIKey.owner_id == user_id).values(is_active=False))
+        await db.commit()
+        await api_key_cache.invalidate(*cache_keys)
+        await user_cache.invalidate(user.username)
+        # publishing to the broker blocks.
+        job = await run_in_threadpool(delete_user_task.delay, user_id)
+        return JSONResponse(status_code=202,
+                            content={"message": f"User {user_id} deactivated and queued for deletion.",
+                                     "job_id": job.id})
+
+    tasks = (await db.execute(select(Task.id, Task.user_id, Task.filename).filter(Task.user_id == user_id))).all()
+    await db.delete(user)
+    await db.commit()
+    await api_key_cache.invalidate(*cache_keys)
+    await user_cache.invalidate(user.username)
+    await uncache_tasks(async_redis_connection, tasks)
+    await run_in_threadpool(remove_task_files, [task.filename for task in tasks])
     return {"message": f"User {user_id} deleted."}
\ No newline at end of file
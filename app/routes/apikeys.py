@@ -1,13 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 
 from ..utils.auth import (get_current_user,
-                          generate_api_key)
+                          generate_api_key,
+                          api_key_cache,
+                          api_key_cache_key)
 from ..database.db import get_db
-from ..database.models import User, APIKey
+from ..utils.replica import get_read_db
+from ..database.models import APIKey, Task
 
 from ..data_models import apikey as apikey_dm
+from ..data_models.user import UserPrincipal
+from ..utils.pagination import paginate_query, page_result, set_page_headers
+from ..utils.deletion import tasks_beyond_threshold
+from ..utils.retention import remove_task_files
+from ..utils.task_cache import uncache_tasks_sync
+from ..utils.cache import redis_connection
+from ..tasks import delete_api_key_task
+
+from app.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 from typing import Annotated, List
 from datetime import timedelta, datetime
@@ -15,7 +29,7 @@ from datetime import timedelta, datetime
 router = APIRouter()
 
 @router.post("/api-keys/new", response_model=apikey_dm.APIKey)
-def get_new_api_key(current_user: Annotated[User, Depends(get_current_user)],
+def get_new_api_key(current_user: Annotated[UserPrincipal, Depends(get_current_user)],
                     db: Annotated[Session, Depends(get_db)]):
     """
     Request a new API key. This is currently limited to only 5 keys per user for demonstration purposes.
@@ -38,26 +52,37 @@ def get_new_api_key(current_user: Annotated[User, Depends(get_current_user)],
 
 
 @router.get("/my-api-keys", response_model=List[apikey_dm.APIKey])
-def get_current_user_api_keys(current_user: Annotated[User, Depends(get_current_user)],
-                            db: Annotated[Session, Depends(get_db)],
-                            active_only: bool = False):
+def get_current_user_api_keys(current_user: Annotated[UserPrincipal, Depends(get_current_user)],
+                            db: Annotated[Session, Depends(get_read_db)],
+                            response: Response,
+                            active_only: bool = False,
+                            cursor: str | None = None,
+                            limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)):
     """
     Gets the list of API keys of the current user.
+    If there are more keys, the cursor of the next page is sent in X-Next-Cursor header.
 
     - **active_only**: if set to True, filters the results to active keys only.
+    - **cursor**: The cursor of the next page.
+    - **limit**: Page size.
     """
-    result = db.query(APIKey).filter(APIKey.owner_id == current_user.id)
+    query = select(APIKey).filter(APIKey.owner_id == current_user.id)
     if active_only:
-        result = result.filter(APIKey.is_active == True)
+        query = query.filter(APIKey.is_active == True)
 
-    return result.all()
+    result = db.execute(paginate_query(query, [APIKey.id], cursor, limit))
+    api_keys, next_cursor = page_result(result.scalars().all(), [APIKey.id], limit)
+    set_page_headers(response, next_cursor)
+    return api_keys
 
 @router.delete("/my-api-keys/{key_id}", response_model=apikey_dm.APIKey)
 def delete_api_key(key_id: int,
-                   current_user: Annotated[User, Depends(get_current_user)],
+                   current_user: Annotated[UserPrincipal, Depends(get_current_user)],
                    db: Annotated[Session, Depends(get_db)]):
     """
     Deletes an API key. This **does not** ask for confirmation. Use with caution.
+    The key's tasks are deleted too. If it has many tasks, the key is deactivated right away
+    and deleted in the background. The response is then 202 with the ID of the deletion job.
 
     - **key_id**: API key's unique identifier.
     """
@@ -67,7 +92,20 @@ def delete_api_key(key_id: int,
             status_code=404,
             detail="API key not found or does not belong to the current user",
         )
-    
+
+    if db.scalar(tasks_beyond_threshold(Task.api_key_id == key_id)) is not None:
+        api_key.is_active = False
+        db.commit()
+        api_key_cache.invalidate_sync(api_key_cache_key(api_key.key))
+        job = delete_api_key_task.delay(key_id)
+        return JSONResponse(status_code=202,
+                            content={"message": f"API key {key_id} deactivated and queued for deletion.",
+                                     "job_id": job.id})
+
+    tasks = db.execute(select(Task.id, Task.user_id, Task.filename).filter(Task.api_key_id == key_id)).all()
     db.delete(api_key)
     db.commit()
+    api_key_cache.invalidate_sync(api_key_cache_key(api_key.key))
+    uncache_tasks_sync(redis_connection, tasks)
+    remove_task_files([task.filename for task in tasks])
     return api_key
@@ -1,13 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
-from ..utils.auth import (hash_password,
-                          authenticate_user,
+from ..utils.auth import (async_hash_password,
+                          async_authenticate_user,
+                          password_route_limiter,
                           create_access_token,
-                          get_current_active_user)
-from ..database.db import get_db
+                          get_current_active_user,
+                          get_user_scopes)
+from ..database.db import get_async_db
 from ..database.models import User
 
 from ..data_models import user as user_dm
@@ -21,42 +24,44 @@ router = APIRouter()
 async def status():
     return {"message": "Auth router is working!"}
 
-@router.post("/signup", response_model=user_dm.User)
-async def user_signup(username: str, password: str, email: str, db: Annotated[Session, Depends(get_db)]):
+@router.post("/signup", response_model=user_dm.User, dependencies=[Depends(password_route_limiter)])
+async def user_signup(username: str, password: str, email: str, db: Annotated[AsyncSession, Depends(get_async_db)]):
     """
     Standard user sign up. Both username and email must unique.
+    Password hashing runs in a separate thread pool and concurrent sign ups are limited.
 
     - **username**: Username.
     - **password**: Password.
     - **email**: Email.
     """
 
-    username_check = db.query(User).filter(User.username == username or User.email == email).first()
+    username_check = await db.scalar(select(User.id).filter(or_(User.username == username, User.email == email)))
     if username_check:
         raise HTTPException(
             status_code=401,
             detail="Username/email is already taken. Use a different one."
         )
-    new_user = User(username=username, email=email, hashed_password=hash_password(password))
+    new_user = User(username=username, email=email, hashed_password=await async_hash_password(password))
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
 
 
-@router.post("/token", tags=["authorization"])
-def login_for_access_token(
+@router.post("/token", tags=["authorization"], dependencies=[Depends(password_route_limiter)])
+async def login_for_access_token(
         form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_async_db)]
     ):
     """
     Request a new token providing user data.
+    Password checking runs in a separate thread pool and concurrent logins are limited.
 
     - **form_data**: Authorization form data.
     """
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await async_authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=401,
@@ -64,9 +69,7 @@ def login_for_access_token(
             headers={'WWW-Authenticate': "Bearer"},
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    scopes = []
-    if user.role == User.RoleEnum.admin:
-        scopes = ["admin"]
+    scopes = get_user_scopes(user)
     access_token = create_access_token(
         data={"sub": user.username, "scopes": scopes},
         expires_delta=access_token_expires
@@ -75,7 +78,7 @@ def login_for_access_token(
 
 @router.get("/users/me/", response_model=user_dm.User, tags=["users"])
 def get_current_logged_in_user(
-        current_user: Annotated[User, Depends(get_current_active_user)]
+        current_user: Annotated[user_dm.UserPrincipal, Depends(get_current_active_user)]
     ):
     """
     Returns the information of current logged in user.
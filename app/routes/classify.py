@@ -5,29 +5,33 @@ from fastapi import (APIRouter,
                      File,
                      Security,
                      Depends,
+                     Header,
                      Request)
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database.models import APIKey, Task
-from ..database.db import get_db
+from ..database.models import Task, TaskOutbox, TASK_IS_PROCESSING
+from ..database.db import get_async_db
+from ..data_models.apikey import APIKeyPrincipal
 from ..utils.auth import get_api_key
+from ..utils.cache import redis_connection, async_redis_connection
+from ..utils.idempotency import (idempotency_redis_key,
+                                 begin_idempotent_request,
+                                 finish_idempotent_request,
+                                 release_idempotency_key)
+from ..utils.usage import count_request, uncount_request
 
 from app.config import (CLASSIFY_RATE_LIMIT,
                         CLASSIFY_RATE_TIME_WINDOW,
-                        TEMP_FILES_DIR,
-                        REDIS_DB,
-                        REDIS_HOST,
-                        REDIS_PORT)
-
-from app.tasks import classify_task
+                        MAX_TASK_TIMEOUT,
+                        TEMP_FILES_DIR)
 
+from datetime import timedelta
+from typing import Optional
 import os
 import uuid
 from time import time
 
-import redis
-
-redis_connection = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
 # request_counts_by_ip = {}
 # request_counts_by_api_key = {}
 # RATE_LIMIT = 1 # Max 1 request
@@ -61,7 +65,7 @@ async def ip_rate_limiter(request: Request):
     # Add current request timestamp
     redis_connection.lpush(redis_key, current_time)
 
-async def api_key_rate_limiter(api_key: APIKey = Security(get_api_key)):
+async def api_key_rate_limiter(api_key: APIKeyPrincipal = Security(get_api_key)):
     """
     A simple memory based rate limiter which limits the requests per minute per api key.
     This is meant to be used as dependency not as a middleware since not all path operations 
@@ -106,8 +110,12 @@ def _prepare_file(dir_path, file):
 async def classify(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-    api_key: APIKey = Security(get_api_key)
+    db: AsyncSession = Depends(get_async_db),
+    api_key: APIKeyPrincipal = Security(get_api_key),
+    x_task_timeout: Optional[float] = Header(None, gt=0, le=MAX_TASK_TIMEOUT,
+                                             description="Seconds to wait for the result at most"),
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255,
+                                            description="A unique value per upload for retrying it safely")
 ):
     """
     Classify an image of clothing. The classes are limited to Fashion-MNIST classes.
@@ -115,26 +123,70 @@ async def classify(
     For example, if the color of a shirt is black, the background must be a bright color, preferably white.
 
     - **file**: The image file. Images must be less than 512 KB in size.
+    - **X-Task-Timeout**: Optional header. If the task isn't started within this many seconds,
+      it's cancelled without being classified.
+    - **Idempotency-Key**: Optional header. Requests with a key used before (with the same API key) in the last
+      24 hours get the ID of the first request's task and nothing else is done. Requests whose key is used by
+      a request in progress wait for it.
+
+    Requests are refused with 429 once the daily or monthly quota of the API key is used up.
+    Retries answered with an earlier task don't count.
     """
     if file.size > 512 * 1024:  # 512 KB
         raise HTTPException(
             status_code=413,
             detail="File size exceeds 512 KB limit"
         )
-    
+
+    if not idempotency_key:
+        task_id = await _create_task(file, db, api_key, x_task_timeout)
+        return {"message": f"Request queued with id {task_id}! Check your tasks for the result."}
+
+    redis_key = idempotency_redis_key(api_key.id, idempotency_key)
+    task_id = await begin_idempotent_request(async_redis_connection, redis_key)
+    if task_id is None:
+        try:
+            task_id = await _create_task(file, db, api_key, x_task_timeout)
+        except BaseException:
+            # e.g. the queue is full. retries must be able to try again.
+            await release_idempotency_key(async_redis_connection, redis_key)
+            raise
+        await finish_idempotent_request(async_redis_connection, redis_key, task_id)
+    return {"message": f"Request queued with id {task_id}! Check your tasks for the result."}
+
+async def _create_task(file: UploadFile, db: AsyncSession, api_key: APIKeyPrincipal,
+                       x_task_timeout: float | None) -> int:
+    # counted in redis, so the quota is checked without querying the database.
+    await count_request(async_redis_connection, api_key.id, api_key.owner_id)
+    try:
+        return await _insert_task(file, db, api_key, x_task_timeout)
+    except BaseException:
+        await uncount_request(async_redis_connection, api_key.id)
+        raise
+
+async def _insert_task(file: UploadFile, db: AsyncSession, api_key: APIKeyPrincipal,
+                       x_task_timeout: float | None) -> int:
     # for performance reasons only one running task is allowed.
-    number_of_running_tasks = db.query(Task).filter(Task.state == Task.StateEnum.processing).count()
-    if number_of_running_tasks > 0:
+    # the first one is enough to know. it's found in the partial index of processing tasks without counting them.
+    running_task_id = await db.scalar(select(Task.id).filter(TASK_IS_PROCESSING).limit(1))
+    if running_task_id is not None:
         raise HTTPException(503, "Task queue is full. Try another time.")
     
-    dir_path = TEMP_FILES_DIR / api_key.owner.username
+    dir_path = TEMP_FILES_DIR / api_key.owner_username
 
     file_path = _prepare_file(dir_path, file.file)
 
-    task_instance = Task(user_id=api_key.owner.id, api_key_id=api_key.id, filename=str(file_path))
+    deadline = None
+    if x_task_timeout:
+        # workers compare it with the database's clock.
+        deadline = await db.scalar(select(func.localtimestamp())) + timedelta(seconds=x_task_timeout)
+
+    task_instance = Task(user_id=api_key.owner_id, api_key_id=api_key.id, filename=str(file_path), deadline=deadline)
     db.add(task_instance)
-    db.commit()
-    db.refresh(task_instance)
+    await db.flush()
+    # published to the broker by the outbox relay. committing both together means
+    # no task is left unpublished and the request doesn't wait for the broker.
+    db.add(TaskOutbox(task_id=task_instance.id))
+    await db.commit()
     # background_tasks.add_task(start_task, task_instance, db)
-    classify_task.delay(task_instance.id)
-    return {"message": f"Request queued with id {task_instance.id}! Check your tasks for the result."}
\ No newline at end of file
+    return task_instance.id
\ No newline at end of file
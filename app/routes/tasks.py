@@ -1,26 +1,51 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, false
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database.models import Task, User, APIKey
-from ..database.db import get_db
+from ..database.models import Task, APIKey, TASK_IS_PROCESSING
+from ..database.db import get_async_db, uses_replica
 from ..utils.auth import get_current_user
+from ..utils.replica import get_async_read_db
 from ..data_models import task as task_dm
+from ..data_models.user import UserPrincipal
+from ..utils.pagination import fetch_page_rows, estimate_count, set_page_headers, encode_cursor, decode_cursor
+from ..utils.serialization import model_columns, rows_response
+from ..utils.cancellation import cancel_task
+from ..utils.cache import async_redis_connection
+from ..utils.throughput import get_throughput
+from ..utils.etag import task_etag, task_list_etag, etag_matches
+from ..utils.task_cache import get_cached_task, cache_task
+
+from app.config import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, CHANGE_FEED_SETTLE
+
+from datetime import timedelta
+import math
 
 router = APIRouter()
 
 @router.get("/my-tasks", response_model=List[task_dm.TaskInline])
 async def get_user_tasks(
+    request: Request,
+    response: Response,
     api_key_id: Optional[int] = Query(None, description="Filter by API key ID"),
     state: Optional[Task.StateEnum] = Query(None, description="Filter by task state"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="Cursor of the next page from X-Next-Cursor header"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    include_total: bool = Query(False, description="Set X-Total-Count header to the approximate number of tasks"),
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Get the list of tasks of the current user, optionally filtered by API key and state.
+    Newest tasks come first. If there are more tasks, the cursor of the next page is sent in X-Next-Cursor header.
+    The page's ETag is sent too. If it's sent back in If-None-Match header and nothing changed, the response is 304.
 
     - **api_key_id**: The unique identifier for the APIKey. This is not the same as API key itself.
     - **state**: State of the task. Is it processing or is it done?
+    - **cursor**: The cursor of the next page.
+    - **limit**: Page size.
+    - **include_total**: If set to True, the approximate number of tasks is sent in X-Total-Count header.
     """
     # db_api_key = None
     # if api_key:
@@ -31,30 +56,162 @@ async def get_user_tasks(
     #             detail="Api key not found. It either does not exist or it is not yours."
     #         )
 
-    tasks = db.query(Task).filter(Task.user_id==current_user.id)
+    # created_at is the sort key. updated_at is for the etag. they aren't sent.
+    tasks = (select(*model_columns(task_dm.TaskInline, Task), Task.created_at, Task.updated_at)
+             .filter(Task.user_id==current_user.id))
     if api_key_id:
         tasks = tasks.filter(Task.api_key_id == api_key_id)
     
     if state:
         tasks = tasks.filter(Task.state == state)
 
-    return tasks.all()
+    page, next_cursor = await fetch_page_rows(db, tasks, [Task.created_at, Task.id], cursor, limit, descending=True)
+    total = await estimate_count(db, tasks) if include_total else None
+    set_page_headers(response, next_cursor, total)
+    response.headers["ETag"] = task_list_etag(page, next_cursor)
+    if etag_matches(request, response.headers["ETag"]):
+        return Response(status_code=304, headers=response.headers)
+    return rows_response(page, task_dm.TaskInline, headers=response.headers)
+
+@router.get("/my-tasks/changes", response_model=List[task_dm.Task])
+async def get_task_changes(
+    response: Response,
+    since: Optional[str] = Query(None, description="Cursor from X-Next-Cursor header of the previous request"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Get the tasks of the current user created or changed since the previous request, in the order they changed.
+    The cursor to continue from is always sent in X-Next-Cursor header. Send it as since in the next request.
+    A task changed again shows up again. Deleted tasks don't show up.
+
+    - **since**: The cursor. Without it, all the tasks are sent, page by page.
+    - **limit**: Page size.
+    """
+    last_seq = decode_cursor(since, [Task.change_seq])[0] if since else 0
+
+    settling = false()
+    if db.bind.dialect.name == "postgresql":
+        # sequence values are taken before commit. a transaction that took a smaller one may still commit.
+        # compared by the database, since now() of postgres has a time zone and updated_at doesn't.
+        settling = Task.updated_at > func.localtimestamp() - timedelta(seconds=CHANGE_FEED_SETTLE)
+
+    # uses ix_tasks_user_id_change_seq.
+    query = (select(Task, settling).filter(Task.user_id == current_user.id, Task.change_seq > last_seq)
+             .order_by(Task.change_seq).limit(limit))
+    rows = (await db.execute(query)).all()
+
+    changes = []
+    for task, is_settling in rows:
+        if is_settling:
+            # the rest is sent once this one settles.
+            break
+        changes.append(task)
+        last_seq = task.change_seq
+
+    set_page_headers(response, encode_cursor([last_seq]))
+    return changes
 
 @router.get("/my-tasks/{task_id}", response_model=task_dm.Task)
 async def get_task(
     task_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)):
+    request: Request,
+    response: Response,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)):
     """
-    Retrieve a task by its ID.
+    Retrieve a task by its ID. Tasks are cached, so changes made by admins in bulk may show up late.
+    The task's ETag is sent too. Send it back in If-None-Match header when polling the task.
+    The response is 304 until the task changes.
 
     - **task_id**: The unique identifier for the task.
     """
-    task = db.query(Task).filter(Task.user_id == current_user.id, Task.id == task_id).first()
+    # most polls are answered from the cache without a database query.
+    task = await get_cached_task(async_redis_connection, current_user.id, task_id)
+    if task:
+        etag = task_etag(task)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        return task
+
+    result = await db.execute(select(Task).filter(Task.user_id == current_user.id, Task.id == task_id))
+    task = result.scalars().first()
     if not task:
         raise HTTPException(
             status_code=404,
             detail="Task not found."
         )
 
+    if not uses_replica(db):
+        # the replica may be behind the cache. a stale task isn't cached over a newer one.
+        await cache_task(async_redis_connection, task, if_missing=True)
+    etag = task_etag(task)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return task
+
+@router.get("/my-tasks/{task_id}/eta", response_model=task_dm.TaskETA)
+async def get_task_eta(
+    task_id: int,
+    response: Response,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_read_db)):
+    """
+    Estimate when a processing task is done. Tasks are classified in the order they were queued.
+    The estimate is based on the number of images classified in the last few minutes.
+    If there is an estimate, the seconds until then are sent in Retry-After header, so clients can
+    check the task once at that time instead of polling it.
+
+    - **task_id**: The unique identifier for the task.
+    """
+    task = await db.scalar(select(Task).filter(Task.user_id == current_user.id, Task.id == task_id))
+    if not task:
+        raise HTTPException(
+            status_code=404,
+            detail="Task not found."
+        )
+
+    eta = task_dm.TaskETA(id=task.id, state=task.state)
+    if task.state != Task.StateEnum.processing:
+        return eta
+
+    # ids are given in the order tasks are queued. the partial index of processing tasks keeps this cheap.
+    position, now = (await db.execute(select(func.count(Task.id), func.now())
+                                      .filter(TASK_IS_PROCESSING, Task.id < task.id))).one()
+    eta.queue_position = position
+    eta.throughput = await get_throughput(async_redis_connection)
+    if eta.throughput:
+        # the task itself must be classified too.
+        seconds = math.ceil((position + 1) / eta.throughput)
+        eta.estimated_completion = now + timedelta(seconds=seconds)
+        response.headers["Retry-After"] = str(seconds)
+    return eta
+
+@router.post("/my-tasks/{task_id}/cancel", response_model=task_dm.Task)
+async def cancel_user_task(
+    task_id: int,
+    current_user: UserPrincipal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)):
+    """
+    Cancel a task which is still processing. It won't be classified and its image is deleted.
+    Tasks set a deadline with X-Task-Timeout header are cancelled on their own when it passes.
+
+    - **task_id**: The unique identifier for the task.
+    """
+    task = await db.scalar(select(Task).filter(Task.user_id == current_user.id, Task.id == task_id))
+    if not task:
+        raise HTTPException(
+            status_code=404,
+            detail="Task not found."
+        )
+
+    if not await cancel_task(db, task):
+        raise HTTPException(
+            status_code=409,
+            detail=f"Task is already {task.state.value}."
+        )
+
     return task
@@ -0,0 +1,95 @@
+"""
+Runs the api in production. Gunicorn manages the worker processes and each one serves requests
+with uvicorn, using uvloop and httptools by default.
+
+The app is imported once before forking (preload), so the workers share the pages of the loaded code
+and the model until they write to them. Garbage collection is frozen before forking, so collecting
+the preloaded objects doesn't copy their pages into every worker.
+Database pools are created empty, and replaced after forking anyway. See app.database.db.reset_pools_after_fork.
+
+Run it with python -m app.server. The options default to the SERVER_* settings of app.config.
+"""
+from gunicorn.app.base import BaseApplication
+from uvicorn_worker import UvicornWorker
+
+from app.config import (SERVER_HOST,
+                        SERVER_PORT,
+                        SERVER_WORKERS,
+                        SERVER_LOOP,
+                        SERVER_HTTP,
+                        SERVER_BACKLOG,
+                        SERVER_KEEPALIVE,
+                        SERVER_GRACEFUL_TIMEOUT,
+                        SERVER_TIMEOUT,
+                        SERVER_PRELOAD)
+
+import argparse
+import gc
+
+
+def worker_class(loop: str, http: str, graceful_timeout: int) -> type[UvicornWorker]:
+    """
+    Returns a uvicorn worker class using the given event loop and http parser.
+    Keep-alive and the other socket options come from gunicorn's settings.
+    """
+    return type("AppWorker", (UvicornWorker,), {"CONFIG_KWARGS": {
+        "loop": loop,
+        "http": http,
+        # open connections are closed after this, before gunicorn kills the worker.
+        "timeout_graceful_shutdown": graceful_timeout,
+    }})
+
+def when_ready(server):
+    # the objects loaded so far are left alone by the collector from now on.
+    gc.freeze()
+
+def post_fork(server, worker):
+    from app.database.db import reset_pools_after_fork
+    reset_pools_after_fork()
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # in the arbiter before forking if preload_app is set. in each worker otherwise.
+        from app.main import app
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the api with multiple worker processes.")
+    parser.add_argument("--host", default=SERVER_HOST, help="Host to bind the server to")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Port to bind the server to")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Number of worker processes")
+    parser.add_argument("--loop", default=SERVER_LOOP, choices=["uvloop", "asyncio", "auto"], help="Event loop")
+    parser.add_argument("--http", default=SERVER_HTTP, choices=["httptools", "h11", "auto"], help="HTTP parser")
+    parser.add_argument("--backlog", type=int, default=SERVER_BACKLOG, help="Connections waiting to be accepted")
+    parser.add_argument("--keepalive", type=int, default=SERVER_KEEPALIVE,
+                        help="Seconds an idle keep-alive connection stays open")
+    parser.add_argument("--graceful-timeout", type=int, default=SERVER_GRACEFUL_TIMEOUT,
+                        help="Seconds workers get to finish their requests on shutdown or restart")
+    parser.add_argument("--timeout", type=int, default=SERVER_TIMEOUT,
+                        help="Seconds after which an unresponsive worker is restarted")
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=SERVER_PRELOAD,
+                        help="Load the app before forking the workers")
+    args = parser.parse_args()
+
+    Server({
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "worker_class": worker_class(args.loop, args.http, args.graceful_timeout),
+        "backlog": args.backlog,
+        "keepalive": args.keepalive,
+        "graceful_timeout": args.graceful_timeout,
+        "timeout": args.timeout,
+        "preload_app": args.preload,
+        "when_ready": when_ready,
+        "post_fork": post_fork,
+    }).run()
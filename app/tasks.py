@@ -1,32 +1,298 @@
-from app.database.db import get_db
+from app.database.db import db_session, engine, reset_pools_after_fork
 from app.database.models import Task
+from app.database.partitioning import maintain_task_partitions
 from celery import Celery
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_process_init
+from celery.utils.time import get_exponential_backoff_interval
+from sqlalchemy import select, update, func
+from sqlalchemy.exc import OperationalError
+from redis.exceptions import ConnectionError as RedisConnectionError
 
-from app.utils.classifier import classify_image, FAHION_MNIST_CLASS_NAMES
+from app.utils.classifier import classify_image, InvalidImageError, FAHION_MNIST_CLASS_NAMES
+from app.utils.retention import apply_task_retention, get_retention_cutoffs, remove_task_files
+from app.utils.stats import refresh_task_stats
+from app.utils.reaper import reap_stuck_tasks
+from app.utils.deletion import delete_user_data, delete_api_key_data
+from app.utils.result_writer import push_result, write_results, get_pending_results
+from app.utils.throughput import record_completion
+from app.utils.task_cache import refresh_cached_tasks_sync
+from app.utils.usage import count_completion, flush_usage
+from app.utils.cache import redis_connection
 
-from app.config import CELERY_BACKEND, CELERY_BROKER
+from app.config import (CELERY_BACKEND,
+                        CELERY_BROKER,
+                        CELERY_WORKER_POOL,
+                        CELERY_WORKER_CONCURRENCY,
+                        CELERY_WORKER_PREFETCH_MULTIPLIER,
+                        CELERY_WORKER_MAX_TASKS_PER_CHILD,
+                        CLASSIFY_SOFT_TIME_LIMIT,
+                        CLASSIFY_TIME_LIMIT,
+                        CLASSIFY_MAX_ATTEMPTS,
+                        CLASSIFY_RETRY_BACKOFF,
+                        CLASSIFY_RETRY_BACKOFF_MAX,
+                        REAPER_INTERVAL,
+                        RESULT_WRITER_ENABLED,
+                        TASK_RETENTION_INTERVAL,
+                        TASK_PARTITIONS_AHEAD,
+                        TASK_STATS_INTERVAL,
+                        TASK_STATS_RECENT_DAYS,
+                        USAGE_FLUSH_INTERVAL)
 
-import os
+from datetime import date, datetime, timedelta
+from time import perf_counter, process_time
+import logging
+
+logger = logging.getLogger(__name__)
 
 app = Celery('tasks', broker=CELERY_BROKER, backend=CELERY_BACKEND)
+# see app.worker. command line options of celery worker override these.
+app.conf.update(
+    worker_pool=CELERY_WORKER_POOL,
+    worker_concurrency=CELERY_WORKER_CONCURRENCY,
+    worker_prefetch_multiplier=CELERY_WORKER_PREFETCH_MULTIPLIER,
+    worker_max_tasks_per_child=CELERY_WORKER_MAX_TASKS_PER_CHILD or None,
+)
 
+# errors which may not happen again on a retry. e.g. the database restarting or a memory spike.
+TRANSIENT_ERRORS = (OperationalError, MemoryError, RedisConnectionError)
 
-@app.task
-def classify_task(task_id: int):
+# run with celery beat. e.g. celery -A app.tasks beat
+app.conf.beat_schedule = {
+    "reap-stuck-tasks": {
+        "task": "app.tasks.reap_tasks",
+        "schedule": REAPER_INTERVAL,
+    },
+    "expire-tasks": {
+        "task": "app.tasks.expire_tasks",
+        "schedule": TASK_RETENTION_INTERVAL,
+    },
+    "rollup-task-stats": {
+        "task": "app.tasks.rollup_task_stats",
+        "schedule": TASK_STATS_INTERVAL,
+    },
+    "flush-usage": {
+        "task": "app.tasks.flush_usage_counters",
+        "schedule": USAGE_FLUSH_INTERVAL,
+    },
+    "maintain-task-partitions": {
+        "task": "app.tasks.maintain_partitions",
+        "schedule": 24 * 3600,
+    },
+}
+
+
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    """
+    Forked worker processes must not share the parent's pooled connections.
+    The pools are replaced without closing the parent's connections.
+    """
+    reset_pools_after_fork()
+
+
+def classify_task_id(task_id: int) -> str:
+    """
+    Returns the Celery task ID used for classifying a Task. It's derived from the Task's ID,
+    so the queued message can be revoked without storing its ID.
+    """
+    return f"classify-{task_id}"
+
+def enqueue_classify_task(task_id: int, timeout: float | None = None, producer=None):
+    """
+    Queues the classification of a Task.
+
+    - **task_id**: ID of the Task instance.
+    - **timeout**: Seconds until the Task's deadline, if it has one. Workers drop the message after this.
+    - **producer**: Broker producer to publish with. One is taken from the pool by default.
+    """
+    classify_task.apply_async(args=[task_id], task_id=classify_task_id(task_id), expires=timeout, producer=producer)
+
+def publish_classify_tasks(messages: list[tuple[int, float | None]]):
+    """
+    Queues the classification of many Tasks over a single pooled broker connection.
+
+    - **messages**: The ID of each Task and the seconds until its deadline, or None.
+    """
+    with app.producer_or_acquire() as producer:
+        for task_id, timeout in messages:
+            enqueue_classify_task(task_id, timeout, producer=producer)
+
+def revoke_classify_task(task_id: int):
+    """
+    Tells the workers to drop the queued classification of a Task. A running one isn't interrupted.
+    """
+    app.control.revoke(classify_task_id(task_id))
+
+def revoke_classify_tasks(task_ids: list[int]):
+    """
+    Same as ""revoke_classify_task"" for many Tasks, with a single message to the workers.
+    """
+    if task_ids:
+        app.control.revoke([classify_task_id(task_id) for task_id in task_ids])
+
+
+@app.task(bind=True, soft_time_limit=CLASSIFY_SOFT_TIME_LIMIT, time_limit=CLASSIFY_TIME_LIMIT, max_retries=None)
+def classify_task(self, task_id: int):
     """
     starts the background task of classifying images.
+    Transient errors are retried with exponential backoff until the task has been attempted
+    CLASSIFY_MAX_ATTEMPTS times. Other errors fail the task right away with an error code.
+    Tasks past their deadline are cancelled without running the model.
+    The result is written by a result writer if RESULT_WRITER_ENABLED is set. See app.utils.result_writer.
+    If the worker is killed (e.g. hard time limit or out of memory), the reaper handles the task later.
+
+    - **task_id**: ID of the Task instance created when the request was received.
+    """
+    attempts = self.request.retries + 1
+    filename = None
+    try:
+        with db_session() as db:
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if not task or task.state != Task.StateEnum.processing:
+                return
+            if task.deadline is not None and task.deadline <= db.scalar(select(func.localtimestamp())):
+                task.state = Task.StateEnum.cancelled
+                task.error_code = Task.ErrorEnum.deadline_exceeded
+                filename, task.filename = task.filename, None
+                task.updated_at = func.now()
+                db.commit()
+                refresh_cached_tasks_sync(db, redis_connection, [task_id])
+                remove_task_files([filename])
+                return
+            task.attempts += 1
+            task.updated_at = func.now()
+            db.commit()
+            filename, attempts = task.filename, task.attempts
+            api_key_id, user_id = task.api_key_id, task.user_id
+
+        print(f"Processing file in the background: {filename}")
+        # no database connection is held while classifying.
+        started, cpu_started = perf_counter(), process_time()
+        result = classify_image(filename)
+        duration_ms = (perf_counter() - started) * 1000
+        # cpu time of all the threads of the process, e.g. the model's. with the threads pool
+        # it includes the other tasks classified meanwhile. see CELERY_WORKER_POOL.
+        cpu_ms = (process_time() - cpu_started) * 1000
+
+        if RESULT_WRITER_ENABLED:
+            # a result writer commits it together with other workers' results and removes the file after.
+            push_result(redis_connection, task_id, result, duration_ms, filename)
+        else:
+            with db_session() as db:
+                write_results(db, {task_id: result})
+                refresh_cached_tasks_sync(db, redis_connection, [task_id])
+    except SoftTimeLimitExceeded:
+        fail_task(task_id, Task.ErrorEnum.timeout)
+    except InvalidImageError:
+        fail_task(task_id, Task.ErrorEnum.invalid_image)
+    except FileNotFoundError:
+        fail_task(task_id, Task.ErrorEnum.file_missing)
+    except TRANSIENT_ERRORS as e:
+        if attempts < CLASSIFY_MAX_ATTEMPTS:
+            countdown = get_exponential_backoff_interval(CLASSIFY_RETRY_BACKOFF, self.request.retries,
+                                                         CLASSIFY_RETRY_BACKOFF_MAX, full_jitter=True)
+            raise self.retry(exc=e, countdown=countdown)
+        fail_task(task_id, Task.ErrorEnum.unavailable)
+    except Exception:
+        logger.exception("classifying task %s failed", task_id)
+        fail_task(task_id, Task.ErrorEnum.internal_error)
+    else:
+        print(f"Classification arg: {result}, ({FAHION_MNIST_CLASS_NAMES[result]})")
+        # counted once the result is stored. a retry of a failed write classifies the image again.
+        # used for estimating when queued tasks are done.
+        record_completion(redis_connection, task_id)
+        count_completion(redis_connection, api_key_id, user_id, result, cpu_ms)
+        if not RESULT_WRITER_ENABLED:
+            remove_task_files([filename])
+
+
+def fail_task(task_id: int, error_code: Task.ErrorEnum):
+    """
+    Marks a processing task as failed.
+
+    - **task_id**: Task's unique identifier.
+    - **error_code**: Why it failed.
+    """
+    with db_session() as db:
+        db.execute(update(Task)
+                   .filter(Task.id == task_id, Task.state == Task.StateEnum.processing)
+                   .values(state=Task.StateEnum.failed, error_code=error_code, updated_at=func.now()))
+        db.commit()
+        refresh_cached_tasks_sync(db, redis_connection, [task_id])
+
 
-    - **task**: The Task instance creating when the request was received.
-    - **db**: A database session for updating the instance.
-    """
-    db = next(get_db())
-    task = db.query(Task).filter(Task.id == task_id).first()
-    if not task:
-        return
-    print(f"Processing file in the background: {task.filename}")
-    result = classify_image(task.filename)
-    task.result = result
-    task.state = Task.StateEnum.done
-    db.commit()
-    print(f"Classification arg: {result}, ({FAHION_MNIST_CLASS_NAMES[result]})")
-    os.remove(task.filename)
\ No newline at end of file
+@app.task
+def expire_tasks():
+    """
+    Archives or deletes finished tasks older than their retention period. See app.utils.retention.
+    """
+    with db_session() as db:
+        return apply_task_retention(db)
+
+
+@app.task
+def maintain_partitions():
+    """
+    Creates upcoming monthly partitions of tasks and drops the expired empty ones.
+    Does nothing unless tasks is partitioned.
+    """
+    now = datetime.now()
+    cutoffs = get_retention_cutoffs(now)
+    with engine.begin() as connection:
+        result = maintain_task_partitions(connection, now, TASK_PARTITIONS_AHEAD,
+                                          min(cutoffs.values()) if cutoffs else None)
+    return result
+
+
+@app.task
+def rollup_task_stats():
+    """
+    Rebuilds the task stats of the recent days. See app.utils.stats.
+    """
+    with db_session() as db:
+        return refresh_task_stats(db, since=date.today() - timedelta(days=TASK_STATS_RECENT_DAYS - 1))
+
+
+@app.task
+def flush_usage_counters():
+    """
+    Writes the usage counters of API keys from redis to the usage table. See app.utils.usage.
+    """
+    with db_session() as db:
+        return flush_usage(db, redis_connection)
+
+
+@app.task
+def reap_tasks():
+    """
+    Requeues or fails the tasks stuck in processing. See app.utils.reaper.
+    """
+    with db_session() as db:
+        # results waiting in the stream haven't updated their tasks yet.
+        pending = get_pending_results(redis_connection) if RESULT_WRITER_ENABLED else ()
+        result = reap_stuck_tasks(db, requeue=enqueue_classify_task, pending=pending)
+        refresh_cached_tasks_sync(db, redis_connection, result["requeued"] + result["failed"] + result["expired"])
+    return result
+
+
+@app.task
+def delete_user_task(user_id: int):
+    """
+    Deletes a user with many tasks in the background. The tasks and their files are deleted in chunks.
+
+    - **user_id**: User's unique identifier.
+    """
+    with db_session() as db:
+        return delete_user_data(db, user_id)
+
+
+@app.task
+def delete_api_key_task(api_key_id: int):
+    """
+    Deletes an API key with many tasks in the background. The tasks and their files are deleted in chunks.
+
+    - **api_key_id**: API key's unique identifier.
+    """
+    with db_session() as db:
+        return delete_api_key_data(db, api_key_id)
@@ -3,7 +3,7 @@ from app.routes.admin.apikeys import router
 from app.database.models import User, APIKey
 from fastapi import FastAPI
 
-from app.utils.auth import hash_password, authenticate_user, create_access_token
+from app.utils.auth import hash_password, authenticate_user, create_access_token, api_key_cache, api_key_cache_key
 from app.utils.testing.testcase import MyTestCase
 from app.utils.testing.database import get_test_db
 
@@ -84,6 +84,20 @@ class UsersAdminDetailsUpdateDeleteTests(MyTestCase):
         self.assertEqual(response.status_code, 200, response.json())
         api_key = self.db.query(APIKey).filter(APIKey.id == 2).first()
         self.assertEqual(api_key.key, "brand_new_key")
+
+    def test_admin_update_apikey_route_invalidates_cache(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        api_key_cache.local.set(api_key_cache_key("test_key_2"), "cached")
+
+        response = client.patch("/admin/apikeys/2",
+                                json={
+                                    "is_active": False
+                                },
+                                headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertIsNone(api_key_cache.local.get(api_key_cache_key("test_key_2")))
         
     def test_admin_update_apikey_route_works_only_loggedin(self):
         response = client.patch("/admin/apikeys/2",
@@ -126,4 +140,48 @@ class UsersAdminDetailsUpdateDeleteTests(MyTestCase):
         
         self.assertEqual(response.status_code, 401)
         apikeys_count = self.db.query(APIKey).count()
-        self.assertEqual(apikeys_count, 2)
\ No newline at end of file
+        self.assertEqual(apikeys_count, 2)
+    def test_admin_bulk_revoke_apikeys_route_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        api_key_cache.local.set(api_key_cache_key("test_key"), "cached")
+
+        response = client.post("/admin/apikeys/bulk-revoke",
+                               json={"owner_id": 1},
+                               headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json(), {"affected": 2})
+        self.assertEqual([api_key.id for api_key in self.db.query(APIKey).filter(APIKey.is_active == True)], [3])
+        self.assertIsNone(api_key_cache.local.get(api_key_cache_key("test_key")))
+
+    def test_admin_bulk_extend_apikeys_route_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        new_expiration_date = datetime.now() + timedelta(days=30)
+        client.patch("/admin/apikeys/3",
+                     json={"expiration_date": (new_expiration_date + timedelta(days=1)).isoformat()},
+                     headers=headers)
+
+        # key 3 already expires later, so it isn't shortened.
+        response = client.post("/admin/apikeys/bulk-extend",
+                               json={
+                                   "filter": {"ids": [1, 3]},
+                                   "expiration_date": new_expiration_date.isoformat()
+                               },
+                               headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json(), {"affected": 1})
+        self.assertEqual(self.db.get(APIKey, 1).expiration_date, new_expiration_date)
+        self.assertGreater(self.db.get(APIKey, 3).expiration_date, new_expiration_date)
+        self.assertLess(self.db.get(APIKey, 2).expiration_date, new_expiration_date)
+
+    def test_admin_bulk_apikeys_routes_need_a_filter(self):
+        token = self.login_user(username="user1", password="user1")
+        response = client.post("/admin/apikeys/bulk-revoke",
+                               json={},
+                               headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 422, response.json())
+        self.assertEqual(self.db.query(APIKey).filter(APIKey.is_active == True).count(), 3)
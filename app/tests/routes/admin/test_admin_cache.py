@@ -0,0 +1,69 @@
+from fastapi.testclient import TestClient
+from app.routes.admin.cache import router
+from app.database.models import User
+from fastapi import FastAPI
+
+from app.utils.auth import hash_password, authenticate_user, create_access_token
+from app.utils.testing.testcase import MyTestCase
+from app.utils.testing.database import get_test_db
+
+from datetime import timedelta
+
+
+app = FastAPI()
+app.include_router(router)
+
+
+client = TestClient(app)
+
+
+class CacheAdminTests(MyTestCase):
+    @classmethod
+    def setTestData(cls):
+        db = next(get_test_db())
+    
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"),
+                role=User.RoleEnum.admin)
+        
+        user2 = User(username="user2",
+                email="mail2@mail.com",
+                hashed_password=hash_password("user2"))
+        
+        db.add_all([user, user2])
+        db.commit()
+        cls.app = app
+
+    def login_user(self, username, password):
+        user = authenticate_user(self.db, username, password)
+        if user:
+            scopes = ["admin"] if user.role == User.RoleEnum.admin else []
+            return create_access_token(
+                data={"sub": username, "scopes": scopes},
+                expires_delta=timedelta(minutes=30)
+                )
+        
+        return ""
+
+    def test_cache_stats_route_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        client.get("/admin/cache", headers=headers)
+        response = client.get("/admin/cache", headers=headers)
+        
+        self.assertEqual(response.status_code, 200, response.json())
+        stats = response.json()["users"]
+        self.assertGreaterEqual(stats["local_hits"], 1, "The second request must be served from the cache.")
+        self.assertIn("hit_rate", response.json()["api_keys"])
+
+    def test_cache_stats_route_works_only_with_admin_users(self):
+        token = self.login_user(username="user2", password="user2")
+        response = client.get("/admin/cache",
+                    headers={"Authorization": f"Bearer {token}"})
+        
+        self.assertEqual(response.status_code, 401, response.json())
+
+        response = client.get("/admin/cache")
+        
+        self.assertEqual(response.status_code, 401, "This shouldn't work it not logged in.")
@@ -0,0 +1,124 @@
+from fastapi.testclient import TestClient
+from app.routes.admin.stats import router
+from app.database.models import User, APIKey, Task
+from fastapi import FastAPI
+
+from app.utils.auth import hash_password, authenticate_user, create_access_token
+from app.utils.stats import refresh_task_stats
+from app.utils.testing.testcase import MyTestCase
+from app.utils.testing.database import get_test_db
+
+from datetime import date, datetime, timedelta
+
+
+app = FastAPI()
+app.include_router(router)
+
+
+client = TestClient(app)
+
+
+class StatsAdminTests(MyTestCase):
+    @classmethod
+    def setTestData(cls):
+        db = next(get_test_db())
+    
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"),
+                role=User.RoleEnum.admin)
+        
+        user2 = User(username="user2",
+                email="mail2@mail.com",
+                hashed_password=hash_password("user2"))
+        
+        db.add_all([user, user2])
+        db.commit()
+
+        expiration_date = datetime.now() + timedelta(days=5)
+        test_api_key = APIKey(key="test_key", expiration_date=expiration_date, owner_id=user.id)
+        test_api_key_2 = APIKey(key="test_key_2", expiration_date=expiration_date, owner_id=user2.id)
+        db.add_all([test_api_key, test_api_key_2])
+        db.commit()
+
+        today = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=1)
+        yesterday = today - timedelta(days=1)
+
+        def task(api_key, created_at, state=Task.StateEnum.done, result=None):
+            return Task(api_key_id=api_key.id, user_id=api_key.owner_id, filename="none",
+                        created_at=created_at, updated_at=created_at, state=state, result=result)
+
+        db.add_all([
+            task(test_api_key, yesterday, result=1),
+            task(test_api_key, yesterday, result=1),
+            task(test_api_key, today, result=3),
+            task(test_api_key, today, state=Task.StateEnum.processing),
+            task(test_api_key_2, today, result=3),
+            task(test_api_key_2, today, state=Task.StateEnum.failed),
+        ])
+        db.commit()
+        refresh_task_stats(db, since=date.today() - timedelta(days=1))
+        cls.app = app
+
+    def login_user(self, username, password):
+        user = authenticate_user(self.db, username, password)
+        if user:
+            scopes = ["admin"] if user.role == User.RoleEnum.admin else []
+            return create_access_token(
+                data={"sub": username, "scopes": scopes},
+                expires_delta=timedelta(minutes=30)
+                )
+        
+        return ""
+
+    def get_stats(self, **params):
+        token = self.login_user(username="user1", password="user1")
+        response = client.get("/admin/stats", params=params,
+                    headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 200, response.json())
+        return response.json()
+
+    def test_stats_route_groups_by_day(self):
+        today = date.today()
+        yesterday = today - timedelta(days=1)
+        self.assertEqual(self.get_stats(), [{"day": yesterday.isoformat(), "count": 2},
+                                            {"day": today.isoformat(), "count": 4}])
+
+    def test_stats_route_groups_by_several_fields(self):
+        stats = self.get_stats(group_by=["state", "result"])
+        self.assertEqual(stats, [{"state": "done", "result": 1, "count": 2},
+                                 {"state": "done", "result": 3, "count": 2},
+                                 {"state": "failed", "result": -1, "count": 1},
+                                 {"state": "processing", "result": -1, "count": 1}])
+
+    def test_stats_route_filters(self):
+        user2 = self.db.query(User).filter(User.username == "user2").first()
+        self.assertEqual(self.get_stats(group_by=["user_id"], user_id=user2.id),
+                         [{"user_id": user2.id, "count": 2}])
+        self.assertEqual(self.get_stats(group_by=["state"], task_state="done"),
+                         [{"state": "done", "count": 4}])
+        self.assertEqual(self.get_stats(since=date.today().isoformat()),
+                         [{"day": date.today().isoformat(), "count": 4}])
+
+    def test_stats_route_reads_rollups(self):
+        db = next(get_test_db())
+        api_key = db.query(APIKey).first()
+        db.add(Task(api_key_id=api_key.id, user_id=api_key.owner_id, filename="none",
+                    created_at=datetime.now(), updated_at=datetime.now()))
+        db.commit()
+
+        # new tasks are counted after the next rollup.
+        self.assertEqual(sum(row["count"] for row in self.get_stats()), 6)
+        refresh_task_stats(db, since=date.today())
+        self.assertEqual(sum(row["count"] for row in self.get_stats()), 7)
+
+    def test_stats_route_works_only_with_admin_users(self):
+        token = self.login_user(username="user2", password="user2")
+        response = client.get("/admin/stats",
+                    headers={"Authorization": f"Bearer {token}"})
+        
+        self.assertEqual(response.status_code, 401, response.json())
+
+        response = client.get("/admin/stats")
+        
+        self.assertEqual(response.status_code, 401, "This shouldn't work it not logged in.")
@@ -8,6 +8,9 @@ from app.utils.testing.testcase import MyTestCase
 from app.utils.testing.database import get_test_db
 
 from datetime import datetime, timedelta
+import csv
+import io
+import json
 
 app = FastAPI()
 app.include_router(router)
@@ -133,6 +136,56 @@ class UsersAdminListAndDetailsTests(MyTestCase):
         self.assertEqual(response.status_code, 200, response.json())
         self.assertEqual(len(response.json()), 0)
 
+    def test_tasks_list_route_cursor_pagination_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        seen_ids = []
+        cursor = None
+        for _ in range(3):
+            params = {"limit": 1}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/admin/tasks",
+                        params=params,
+                        headers=headers)
+            
+            self.assertEqual(response.status_code, 200, response.json())
+            self.assertEqual(len(response.json()), 1)
+            seen_ids.append(response.json()[0]["id"])
+            cursor = response.headers.get("X-Next-Cursor")
+
+        self.assertEqual(sorted(seen_ids), [1, 2, 3])
+        self.assertIsNone(cursor, "This is the last page.")
+
+    def test_tasks_export_route_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.get("/admin/tasks/export",
+                    headers=headers)
+        
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3])
+        self.assertEqual(rows[1]["state"], "done")
+
+        response = client.get("/admin/tasks/export",
+                    params={"format": "csv", "user_id": 1, "task_state": "processing"},
+                    headers=headers)
+        
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["id"], "1")
+
+    def test_tasks_export_route_works_only_with_admin_users(self):
+        token = self.login_user(username="user2", password="user2")
+        response = client.get("/admin/tasks/export",
+                    headers={"Authorization": f"Bearer {token}"})
+        
+        self.assertEqual(response.status_code, 401)
+
     def test_admin_get_task_details_route_works(self):
         token = self.login_user(username="user1", password="user1")
         headers = {"Authorization": f"Bearer {token}"}
@@ -1,4 +1,5 @@
 from fastapi.testclient import TestClient
+from unittest.mock import patch
 from app.routes.admin.tasks import router
 from app.database.models import User, Task, APIKey
 from fastapi import FastAPI
@@ -119,4 +120,69 @@ class UsersAdminDetailsUpdateDeleteTests(MyTestCase):
         
         self.assertEqual(response.status_code, 401)
         tasks_count = self.db.query(Task).count()
-        self.assertEqual(tasks_count, 2)
\ No newline at end of file
+        self.assertEqual(tasks_count, 2)
+
+    @patch("app.utils.cancellation.revoke_classify_task")
+    def test_admin_cancel_task_route_works(self, revoke_classify_task):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.post("/admin/tasks/3/cancel", headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json()["state"], "cancelled")
+        revoke_classify_task.assert_called_once_with(3)
+
+        response = client.post("/admin/tasks/3/cancel", headers=headers)
+        self.assertEqual(response.status_code, 409, response.json())
+
+        token = self.login_user(username="user2", password="user2")
+        response = client.post("/admin/tasks/1/cancel", headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 401, response.json())
+    @patch("app.routes.admin.tasks.remove_task_files")
+    @patch("app.routes.admin.tasks.revoke_classify_tasks")
+    def test_admin_bulk_delete_tasks_route_works(self, revoke_classify_tasks, remove_task_files):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        db = next(get_test_db())
+        db.query(Task).filter(Task.id == 2).update({"state": Task.StateEnum.done, "filename": None})
+        db.commit()
+        db.close()
+
+        response = client.post("/admin/tasks/bulk-delete",
+                                json={"user_id": 1},
+                                headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json(), {"affected": 2})
+        self.assertEqual([task.id for task in self.db.query(Task).all()], [3])
+        # only processing tasks have queued messages.
+        revoke_classify_tasks.assert_called_once_with([1])
+        remove_task_files.assert_called_once_with(["none", None])
+
+        response = client.post("/admin/tasks/bulk-delete",
+                                json={"ids": [1, 3], "api_key_id": 3},
+                                headers=headers)
+
+        self.assertEqual(response.json(), {"affected": 1})
+        self.assertEqual(self.db.query(Task).count(), 0)
+
+    def test_admin_bulk_delete_tasks_route_needs_a_filter(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.post("/admin/tasks/bulk-delete",
+                                json={},
+                                headers=headers)
+
+        self.assertEqual(response.status_code, 422, response.json())
+        self.assertEqual(self.db.query(Task).count(), 3)
+
+    def test_admin_bulk_delete_tasks_route_works_only_with_admin_users(self):
+        token = self.login_user(username="user2", password="user2")
+        response = client.post("/admin/tasks/bulk-delete",
+                                json={"user_id": 2},
+                                headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 401, response.json())
+        self.assertEqual(self.db.query(Task).count(), 3)
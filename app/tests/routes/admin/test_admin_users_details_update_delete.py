@@ -1,13 +1,14 @@
 from fastapi.testclient import TestClient
+from unittest.mock import patch
 from app.routes.admin.users import router
-from app.database.models import User
+from app.database.models import User, APIKey, Task
 from fastapi import FastAPI
 
-from app.utils.auth import hash_password, authenticate_user, create_access_token
+from app.utils.auth import hash_password, authenticate_user, create_access_token, user_cache
 from app.utils.testing.testcase import MyTestCase
 from app.utils.testing.database import get_test_db
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 
 
@@ -42,6 +43,12 @@ class UsersAdminDetailsUpdateDeleteTests(MyTestCase):
         db.refresh(user)
         db.refresh(user2)
 
+        api_key = APIKey(key="test_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user2.id)
+        db.add(api_key)
+        db.commit()
+        db.add_all([Task(api_key_id=api_key.id, user_id=user2.id, filename="none") for _ in range(3)])
+        db.commit()
+
         cls.app = app
 
     def login_user(self, username, password):
@@ -82,6 +89,26 @@ class UsersAdminDetailsUpdateDeleteTests(MyTestCase):
         user2 = self.db.query(User).filter(User.id == 2).first()
         self.assertEqual(user2.full_name, "john smith")
         
+    def test_admin_update_user_route_revokes_admin_scope_of_demoted_users(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.get("/admin/users/1",
+                              headers=headers)
+        self.assertEqual(response.status_code, 200, response.json())
+
+        response = client.patch("/admin/users/1",
+                                json={
+                                    "role": "normal"
+                                },
+                                headers=headers)
+        self.assertEqual(response.status_code, 200, response.json())
+
+        response = client.get("/admin/users/1",
+                              headers=headers)
+        self.assertEqual(response.status_code, 401,
+                         "The token's admin scope must not work after the user is demoted.")
+        
     def test_admin_update_user_route_works_only_loggedin(self):
         response = client.patch("/admin/users/2",
                                 json={
@@ -123,4 +150,54 @@ class UsersAdminDetailsUpdateDeleteTests(MyTestCase):
         
         self.assertEqual(response.status_code, 401)
         users_count = self.db.query(User).count()
-        self.assertEqual(users_count, 2)
\ No newline at end of file
+        self.assertEqual(users_count, 2)
+
+    def test_admin_delete_user_route_deletes_api_keys_and_tasks(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.delete("/admin/users/2", headers=headers)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.db.query(APIKey).count(), 0)
+        self.assertEqual(self.db.query(Task).count(), 0)
+
+    @patch("app.utils.deletion.BACKGROUND_DELETION_THRESHOLD", 2)
+    @patch("app.routes.admin.users.delete_user_task")
+    def test_admin_delete_user_route_deletes_big_users_in_background(self, delete_user_task):
+        delete_user_task.delay.return_value.id = "job-id"
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.delete("/admin/users/2", headers=headers)
+
+        self.assertEqual(response.status_code, 202, response.json())
+        self.assertEqual(response.json()["job_id"], "job-id")
+        delete_user_task.delay.assert_called_once_with(2)
+        # the user is deactivated until the job deletes it.
+        self.assertFalse(self.db.get(User, 2).is_active)
+        self.assertFalse(self.db.query(APIKey).one().is_active)
+        self.assertEqual(self.db.query(Task).count(), 3)
+    def test_admin_bulk_deactivate_users_route_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        user_cache.local.set("user2", "cached")
+
+        # the admin sending the request and the already inactive user are left out.
+        response = client.post("/admin/users/bulk-deactivate",
+                               json={"ids": [1, 2, 3]},
+                               headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json(), {"affected": 1})
+        self.assertEqual([user.username for user in self.db.query(User).filter(User.is_active == True)],
+                         ["user1"])
+        self.assertIsNone(user_cache.local.get("user2"))
+
+    def test_admin_bulk_deactivate_users_route_works_only_with_admin_users(self):
+        token = self.login_user(username="user2", password="user2")
+        response = client.post("/admin/users/bulk-deactivate",
+                               json={"role": "admin"},
+                               headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 401, response.json())
@@ -89,6 +89,35 @@ class UsersAdminListAndNewTests(MyTestCase):
         self.assertEqual(len(response.json()), 1)
 
 
+    def test_users_list_route_search_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+
+        for search, usernames in (("user", ["user1", "user2", "user3"]),
+                                  ("USER2", ["user2"]), # case-insensitive
+                                  ("mail3@", ["user3"])): # emails are searched too
+            response = client.get("/admin/users", params={"search": search}, headers=headers)
+            self.assertEqual(response.status_code, 200, response.json())
+            self.assertEqual([user["username"] for user in response.json()], usernames)
+
+        # sqlite searches by prefix only.
+        response = client.get("/admin/users", params={"search": "ail2", "search_mode": "contains"}, headers=headers)
+        self.assertEqual(response.status_code, 404, response.json())
+
+    def test_users_list_route_search_works_with_non_ascii_names(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        db = next(get_test_db())
+        db.add(User(username="Ömer", email="omer@mail.com", hashed_password=hash_password("user4")))
+        db.commit()
+        db.close()
+
+        # sqlite's lower() only changes ascii letters.
+        for search in ("Öm", "ÖMER"):
+            response = client.get("/admin/users", params={"search": search}, headers=headers)
+            self.assertEqual(response.status_code, 200, response.json())
+            self.assertEqual([user["username"] for user in response.json()], ["Ömer"])
+
     def test_users_list_route_pagination_works(self):
         token = self.login_user(username="user1", password="user1")
         headers = {"Authorization": f"Bearer {token}"}
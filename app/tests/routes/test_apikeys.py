@@ -1,6 +1,7 @@
 from fastapi.testclient import TestClient
+from unittest.mock import patch
 from app.routes.apikeys import router
-from app.database.models import APIKey, User
+from app.database.models import APIKey, User, Task
 from fastapi import FastAPI
 
 from app.utils.auth import hash_password, authenticate_user, create_access_token
@@ -34,6 +35,8 @@ class APIKeysTests(MyTestCase):
         db.add(test_api_key)
         db.commit()
         db.refresh(test_api_key)
+        db.add_all([Task(api_key_id=test_api_key.id, user_id=user.id, filename="none") for _ in range(2)])
+        db.commit()
 
         cls.app = app
 
@@ -106,6 +109,21 @@ class APIKeysTests(MyTestCase):
         self.assertEqual(response.status_code, 200)
         apikey_count = self.db.query(APIKey).filter(APIKey.owner_id == 1).count()
         self.assertEqual(apikey_count, 0)
+        self.assertEqual(self.db.query(Task).count(), 0)
+
+    @patch("app.utils.deletion.BACKGROUND_DELETION_THRESHOLD", 1)
+    @patch("app.routes.apikeys.delete_api_key_task")
+    def test_delete_api_key_route_deletes_big_keys_in_background(self, delete_api_key_task):
+        delete_api_key_task.delay.return_value.id = "job-id"
+        token = self.login_user(username="user1", password="user1")
+        response = client.delete("/my-api-keys/1",
+                    headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 202, response.json())
+        self.assertEqual(response.json()["job_id"], "job-id")
+        delete_api_key_task.delay.assert_called_once_with(1)
+        self.assertFalse(self.db.get(APIKey, 1).is_active)
+        self.assertEqual(self.db.query(Task).count(), 2)
 
     def test_delete_api_key_route_works_only_loggedin(self):
         response = client.delete("/my-api-keys/1")
@@ -0,0 +1,94 @@
+from fastapi.testclient import TestClient
+from app.routes.auth import router
+from app.database.models import User
+from fastapi import FastAPI
+
+from app.config import BCRYPT_ROUNDS
+from app.utils.auth import hash_password, password_needs_rehash, password_route_limiter
+from app.utils.testing.testcase import MyTestCase
+from app.utils.testing.database import get_test_db
+
+import bcrypt
+
+
+app = FastAPI()
+app.include_router(router)
+
+
+client = TestClient(app)
+
+class AuthTests(MyTestCase):
+    @classmethod
+    def setTestData(cls):
+        db = next(get_test_db())
+    
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"))
+        
+        # hashed with an outdated cost
+        user2 = User(username="user2",
+                email="mail2@mail.com",
+                hashed_password=bcrypt.hashpw(b"user2", bcrypt.gensalt(rounds=4)).decode("utf-8"))
+        
+        db.add_all([user, user2])
+        db.commit()
+        cls.app = app
+
+    def test_signup_works(self):
+        response = client.post("/signup",
+                               params={"username": "user3",
+                                       "password": "user3",
+                                       "email": "mail3@mail.com"})
+        
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json()["username"], "user3")
+        users_count = self.db.query(User).count()
+        self.assertEqual(users_count, 3)
+
+    def test_signup_fails_with_taken_username_or_email(self):
+        response = client.post("/signup",
+                               params={"username": "user1",
+                                       "password": "user3",
+                                       "email": "mail3@mail.com"})
+        
+        self.assertEqual(response.status_code, 401, response.json())
+
+        response = client.post("/signup",
+                               params={"username": "user3",
+                                       "password": "user3",
+                                       "email": "mail@mail.com"})
+        
+        self.assertEqual(response.status_code, 401, response.json())
+
+    def test_token_route_works(self):
+        response = client.post("/token",
+                               data={"username": "user1", "password": "user1"})
+        
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertIn("access_token", response.json())
+
+        response = client.post("/token",
+                               data={"username": "user1", "password": "wrong_password"})
+        
+        self.assertEqual(response.status_code, 401, response.json())
+
+    def test_token_route_rehashes_outdated_passwords(self):
+        response = client.post("/token",
+                               data={"username": "user2", "password": "user2"})
+        
+        self.assertEqual(response.status_code, 200, response.json())
+        user2 = self.db.query(User).filter(User.username == "user2").first()
+        self.assertFalse(password_needs_rehash(user2.hashed_password),
+                         f"Password must be rehashed with cost {BCRYPT_ROUNDS}.")
+        self.assertTrue(bcrypt.checkpw(b"user2", user2.hashed_password.encode("utf-8")))
+
+    def test_password_routes_are_concurrency_limited(self):
+        password_route_limiter.active = password_route_limiter.limit
+        try:
+            response = client.post("/token",
+                                   data={"username": "user1", "password": "user1"})
+        finally:
+            password_route_limiter.active = 0
+        
+        self.assertEqual(response.status_code, 503, response.json())
@@ -1,15 +1,17 @@
 from fastapi.testclient import TestClient
 from app.routes.classify import router
-from app.database.models import Task, APIKey, User
+from app.database.models import Task, TaskOutbox, APIKey, User
 from unittest.mock import patch
 from fastapi import FastAPI, Response
 
 from app.utils.auth import API_KEY_NAME, hash_password
 from app.utils.testing.testcase import MyTestCase
 from app.utils.testing.database import get_test_db
+from app.utils.testing.redis import FakeAsyncRedis
 
 from datetime import datetime, timedelta
 
+
 app = FastAPI()
 app.include_router(router)
 
@@ -29,15 +31,15 @@ class ClassifierTests(MyTestCase):
         db.refresh(user)
 
         test_api_key = APIKey(key="test_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user.id)
-        db.add(test_api_key)
+        inactive_api_key = APIKey(key="inactive_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user.id, is_active=False)
+        db.add_all([test_api_key, inactive_api_key])
         db.commit()
         db.refresh(test_api_key)
 
         cls.app = app
 
     @patch('app.routes.classify._prepare_file')
-    @patch('app.routes.classify.classify_task')
-    def test_classify_works_with_valid_data(self, classify_task, _prepare_file):
+    def test_classify_works_with_valid_data(self, _prepare_file):
         with open("app/tst.png", "rb") as f:
             response: Response = client.post("/classify",
                             files={"file": ("test_image.png", f.read())},
@@ -47,10 +49,11 @@ class ClassifierTests(MyTestCase):
         self.assertEqual(response.json(), {"message": "Request queued with id 1! Check your tasks for the result."})
         tasks_count = self.db.query(Task).count()
         self.assertEqual(tasks_count, 1)
+        # the outbox relay publishes it.
+        self.assertEqual([row.task_id for row in self.db.query(TaskOutbox)], [1])
 
     @patch('app.routes.classify._prepare_file')
-    @patch('app.routes.classify.classify_task')
-    def test_classify_fails_without_valid_api_key(self, classify_task, _prepare_file):
+    def test_classify_fails_without_valid_api_key(self, _prepare_file):
         with open("app/tst.png", "rb") as f:
             response: Response = client.post("/classify",
                             files={"file": ("test_image.png", f.read())},
@@ -60,3 +63,80 @@ class ClassifierTests(MyTestCase):
         tasks_count = self.db.query(Task).count()
         self.assertEqual(tasks_count, 0)
 
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_fails_with_inactive_api_key(self, _prepare_file):
+        with open("app/tst.png", "rb") as f:
+            response: Response = client.post("/classify",
+                            files={"file": ("test_image.png", f.read())},
+                            headers={API_KEY_NAME: "inactive_key"})
+    
+        self.assertEqual(response.status_code, 403)
+        tasks_count = self.db.query(Task).count()
+        self.assertEqual(tasks_count, 0)
+
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_sets_deadline_from_timeout_header(self, _prepare_file):
+        with open("app/tst.png", "rb") as f:
+            response: Response = client.post("/classify",
+                            files={"file": ("test_image.png", f.read())},
+                            headers={API_KEY_NAME: "test_key", "X-Task-Timeout": "30"})
+
+        self.assertEqual(response.status_code, 200, response.json())
+        task = self.db.query(Task).one()
+        self.assertAlmostEqual((task.deadline - task.created_at).total_seconds(), 30, delta=2)
+
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_fails_with_invalid_timeout_header(self, _prepare_file):
+        with open("app/tst.png", "rb") as f:
+            response: Response = client.post("/classify",
+                            files={"file": ("test_image.png", f.read())},
+                            headers={API_KEY_NAME: "test_key", "X-Task-Timeout": "0"})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.db.query(TaskOutbox).count(), 0)
+
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_with_idempotency_key_runs_once(self, _prepare_file):
+        redis = FakeAsyncRedis()
+        with patch('app.routes.classify.async_redis_connection', redis):
+            responses = [client.post("/classify",
+                                     files={"file": ("test_image.png", b"image")},
+                                     headers={API_KEY_NAME: "test_key", "Idempotency-Key": "upload-1"})
+                         for _ in range(2)]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(responses[0].json(), responses[1].json())
+        self.assertEqual(self.db.query(Task).count(), 1)
+        _prepare_file.assert_called_once()
+        # keys are scoped per API key.
+        self.assertEqual(redis.data, {"idempotency:1:upload-1": b"1"})
+
+    @patch('app.utils.idempotency.IDEMPOTENCY_WAIT', 0.1)
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_with_idempotency_key_in_progress(self, _prepare_file):
+        redis = FakeAsyncRedis()
+        redis.data["idempotency:1:upload-1"] = b"in-progress"
+        with patch('app.routes.classify.async_redis_connection', redis):
+            response = client.post("/classify",
+                                   files={"file": ("test_image.png", b"image")},
+                                   headers={API_KEY_NAME: "test_key", "Idempotency-Key": "upload-1"})
+
+        self.assertEqual(response.status_code, 409, response.json())
+        self.assertEqual(self.db.query(Task).count(), 0)
+        _prepare_file.assert_not_called()
+
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_with_idempotency_key_releases_it_on_failure(self, _prepare_file):
+        db = next(get_test_db())
+        db.add(Task(user_id=1, api_key_id=1, filename="none"))
+        db.commit()
+        db.close()
+
+        redis = FakeAsyncRedis()
+        with patch('app.routes.classify.async_redis_connection', redis):
+            response = client.post("/classify",
+                                   files={"file": ("test_image.png", b"image")},
+                                   headers={API_KEY_NAME: "test_key", "Idempotency-Key": "upload-1"})
+
+        self.assertEqual(response.status_code, 503, response.json())
+        self.assertEqual(redis.data, {})
@@ -1,4 +1,5 @@
 from fastapi.testclient import TestClient
+from unittest.mock import patch, AsyncMock
 from app.routes.tasks import router
 from app.database.models import Task, APIKey, User
 from fastapi import FastAPI
@@ -6,6 +7,9 @@ from fastapi import FastAPI
 from app.utils.auth import hash_password, authenticate_user, create_access_token
 from app.utils.testing.testcase import MyTestCase
 from app.utils.testing.database import get_test_db
+from app.utils.testing.redis import FakeAsyncRedis, FakeRedis
+from app.utils.retention import expire_tasks_batch
+from app.utils.deletion import delete_api_key_data
 
 from datetime import datetime, timedelta
 
@@ -69,6 +73,13 @@ class TasksTests(MyTestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    def test_tasks_list_sends_response_model_fields(self):
+        token = self.login_user(username="user1", password="user1")
+        response = client.get("/my-tasks",
+                    headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.json()[0], {"id": 2, "state": "processing", "result": None, "error_code": None})
+
     def test_tasks_list_doesnt_work_if_not_loggedin(self):
         response = client.get("/my-tasks")
 
@@ -96,6 +107,35 @@ class TasksTests(MyTestCase):
         self.assertEqual(len(response.json()), 0)
 
 
+    def test_tasks_list_cursor_pagination_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.get("/my-tasks",
+                              params={"limit": 1, "include_total": True},
+                              headers=headers)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(response.headers["X-Total-Count"], "2")
+        first_page_id = response.json()[0]["id"]
+
+        response = client.get("/my-tasks",
+                              params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]},
+                              headers=headers)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        self.assertNotEqual(response.json()[0]["id"], first_page_id)
+        self.assertNotIn("X-Next-Cursor", response.headers, "This is the last page.")
+
+    def test_tasks_list_fails_with_invalid_cursor(self):
+        token = self.login_user(username="user1", password="user1")
+        response = client.get("/my-tasks",
+                              params={"cursor": "not a cursor"},
+                              headers={"Authorization": f"Bearer {token}"})
+        
+        self.assertEqual(response.status_code, 400)
+
     def test_task_details_route_work(self):
         token = self.login_user(username="user1", password="user1")
         response = client.get("/my-tasks/1",
@@ -114,3 +154,170 @@ class TasksTests(MyTestCase):
         response = client.get("/my-tasks/1")
         
         self.assertEqual(response.status_code, 401)
+
+    @patch("app.utils.cancellation.revoke_classify_task")
+    def test_cancel_task_route_works(self, revoke_classify_task):
+        token = self.login_user(username="user1", password="user1")
+        response = client.post("/my-tasks/1/cancel",
+                               headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json()["state"], "cancelled")
+        revoke_classify_task.assert_called_once_with(1)
+
+        # only processing tasks can be cancelled.
+        response = client.post("/my-tasks/1/cancel",
+                               headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 409, response.json())
+
+    @patch("app.utils.cancellation.revoke_classify_task")
+    def test_cancel_task_route_only_cancels_current_users_tasks(self, revoke_classify_task):
+        token = self.login_user(username="user1", password="user1")
+        response = client.post("/my-tasks/3/cancel",
+                               headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 404)
+        revoke_classify_task.assert_not_called()
+        self.assertEqual(self.db.get(Task, 3).state, Task.StateEnum.processing)
+
+    @patch("app.routes.tasks.get_throughput", new_callable=AsyncMock, return_value=0.5)
+    def test_task_eta_route_works(self, get_throughput):
+        token = self.login_user(username="user1", password="user1")
+        response = client.get("/my-tasks/2/eta",
+                              headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json()["queue_position"], 1)
+        self.assertIsNotNone(response.json()["estimated_completion"])
+        # task 1 and then task 2 are classified at 0.5 images per second.
+        self.assertEqual(response.headers["Retry-After"], "4")
+
+    @patch("app.routes.tasks.get_throughput", new_callable=AsyncMock, return_value=None)
+    def test_task_eta_route_without_throughput(self, get_throughput):
+        token = self.login_user(username="user1", password="user1")
+        response = client.get("/my-tasks/1/eta",
+                              headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual(response.json()["queue_position"], 0)
+        self.assertIsNone(response.json()["estimated_completion"])
+        self.assertNotIn("Retry-After", response.headers)
+
+        response = client.get("/my-tasks/3/eta",
+                              headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_task_details_route_answers_matching_etag_with_304(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        redis = FakeAsyncRedis()
+        with patch("app.routes.tasks.async_redis_connection", redis):
+            response = client.get("/my-tasks/1", headers=headers)
+            etag = response.headers["ETag"]
+
+            with patch("app.routes.tasks.select") as select:
+                response = client.get("/my-tasks/1", headers={**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], etag)
+            select.assert_not_called() # answered from the cache
+
+            # other users don't get the cached task.
+            token = self.login_user(username="user2", password="user2")
+            response = client.get("/my-tasks/1",
+                                  headers={"Authorization": f"Bearer {token}", "If-None-Match": etag})
+            self.assertEqual(response.status_code, 404)
+
+            # the etag changes with the task.
+            redis.data.clear()
+            db = next(get_test_db())
+            db.query(Task).filter(Task.id == 1).update({"state": Task.StateEnum.done, "result": 3})
+            db.commit()
+            db.close()
+            response = client.get("/my-tasks/1", headers={**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_task_details_route_keeps_newer_cached_task(self):
+        token = self.login_user(username="user1", password="user1")
+        redis = FakeAsyncRedis()
+        # a worker finishes the task and caches it after the route missed the cache and read the task.
+        async def cached_by_worker(connection, user_id, task_id):
+            await redis.set(f"task:{user_id}:{task_id}", "done")
+        with (patch("app.routes.tasks.async_redis_connection", redis),
+              patch("app.routes.tasks.get_cached_task", side_effect=cached_by_worker)):
+            response = client.get("/my-tasks/1", headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(redis.data["task:1:1"], b"done")
+
+    def test_task_details_route_misses_tasks_removed_by_retention_or_key_deletion(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        redis, sync_redis = FakeAsyncRedis(), FakeRedis()
+        sync_redis.data = redis.data
+        with (patch("app.routes.tasks.async_redis_connection", redis),
+              patch("app.utils.retention.redis_connection", sync_redis),
+              patch("app.utils.deletion.redis_connection", sync_redis)):
+            for task_id in (1, 2):
+                self.assertEqual(client.get(f"/my-tasks/{task_id}", headers=headers).status_code, 200)
+            self.assertEqual(len(redis.data), 2)
+
+            db = next(get_test_db())
+            api_key_id = db.get(Task, 2).api_key_id
+            # the oldest one, task 1.
+            expire_tasks_batch(db, db.get(Task, 1).state, datetime.now() + timedelta(days=1),
+                               mode="delete", batch_size=1)
+            delete_api_key_data(db, api_key_id)
+            db.close()
+
+            self.assertEqual(redis.data, {})
+            for task_id in (1, 2):
+                self.assertEqual(client.get(f"/my-tasks/{task_id}", headers=headers).status_code, 404)
+
+    def test_tasks_list_answers_matching_etag_with_304(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.get("/my-tasks", headers=headers)
+        etag = response.headers["ETag"]
+
+        response = client.get("/my-tasks", headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = client.get("/my-tasks", params={"limit": 1}, headers={**headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_task_changes_route_works(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.get("/my-tasks/changes", headers=headers)
+
+        self.assertEqual(response.status_code, 200, response.json())
+        self.assertEqual([task["id"] for task in response.json()], [1, 2])
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = client.get("/my-tasks/changes", params={"since": cursor}, headers=headers)
+        self.assertEqual(response.json(), [])
+        self.assertEqual(response.headers["X-Next-Cursor"], cursor)
+
+        # updated_at isn't set by the update. the database sets it.
+        db = next(get_test_db())
+        db.query(Task).filter(Task.id == 1).update({"state": Task.StateEnum.done, "result": 3})
+        db.commit()
+        db.close()
+        response = client.get("/my-tasks/changes", params={"since": cursor}, headers=headers)
+        self.assertEqual([(task["id"], task["state"]) for task in response.json()], [(1, "done")])
+        self.assertNotEqual(response.headers["X-Next-Cursor"], cursor)
+
+    def test_task_changes_route_pages(self):
+        token = self.login_user(username="user1", password="user1")
+        headers = {"Authorization": f"Bearer {token}"}
+        response = client.get("/my-tasks/changes", params={"limit": 1}, headers=headers)
+        self.assertEqual([task["id"] for task in response.json()], [1])
+
+        response = client.get("/my-tasks/changes",
+                              params={"limit": 1, "since": response.headers["X-Next-Cursor"]},
+                              headers=headers)
+        self.assertEqual([task["id"] for task in response.json()], [2])
+
+        response = client.get("/my-tasks/changes", params={"since": "not a cursor"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
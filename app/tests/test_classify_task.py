@@ -0,0 +1,257 @@
+from unittest import TestCase
+from unittest.mock import patch
+from celery.exceptions import SoftTimeLimitExceeded
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
+
+from app.database.db import Base
+from app.database.models import User, APIKey, Task
+from app.tasks import classify_task
+from app.utils.auth import hash_password
+from app.utils.classifier import InvalidImageError
+from app.utils.reaper import reap_stuck_tasks
+from app.utils.result_writer import write_results
+from app.utils.usage import usage_day, usage_redis_key
+from app.utils.testing.database import engine, SessionLocal, postgres_now
+from app.utils.testing.redis import FakeRedis
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import tempfile
+import os
+
+
+@contextmanager
+def _db_session():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class TaskTestCase(TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+
+        with _db_session() as db:
+            user = User(username="user1",
+                    email="mail@mail.com",
+                    hashed_password=hash_password("user1"))
+            db.add(user)
+            db.commit()
+            api_key = APIKey(key="test_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user.id)
+            db.add(api_key)
+            db.commit()
+            self.user_id, self.api_key_id = user.id, api_key.id
+
+        db_session_patcher = patch("app.tasks.db_session", _db_session)
+        db_session_patcher.start()
+        self.addCleanup(db_session_patcher.stop)
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+
+    def add_task(self, **kwargs) -> int:
+        with _db_session() as db:
+            task = Task(api_key_id=self.api_key_id, user_id=self.user_id, **kwargs)
+            db.add(task)
+            db.commit()
+            return task.id
+
+    def get_task(self, task_id: int) -> Task:
+        with _db_session() as db:
+            return db.get(Task, task_id)
+
+
+class ClassifyTaskTests(TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        self.filename = tempfile.NamedTemporaryFile(delete=False).name
+        self.task_id = self.add_task(filename=self.filename)
+
+    def tearDown(self):
+        super().tearDown()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def assertFailed(self, error_code):
+        task = self.get_task(self.task_id)
+        self.assertEqual(task.state, Task.StateEnum.failed)
+        self.assertEqual(task.error_code, error_code)
+
+    @patch("app.tasks.classify_image", return_value=3)
+    def test_classify_task_works(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+
+        task = self.get_task(self.task_id)
+        self.assertEqual(task.state, Task.StateEnum.done)
+        self.assertEqual(task.result, 3)
+        self.assertEqual(task.attempts, 1)
+        self.assertIsNone(task.filename)
+        self.assertFalse(os.path.exists(self.filename))
+
+    @patch("app.tasks.RESULT_WRITER_ENABLED", True)
+    @patch("app.tasks.push_result")
+    @patch("app.tasks.classify_image", return_value=3)
+    def test_classify_task_pushes_results_to_result_writer(self, classify_image, push_result):
+        classify_task.apply(args=[self.task_id])
+
+        push_result.assert_called_once()
+        self.assertEqual(push_result.call_args.args[1:3], (self.task_id, 3))
+        self.assertEqual(push_result.call_args.args[4], self.filename)
+        # the result writer finishes it and removes the file.
+        self.assertEqual(self.get_task(self.task_id).state, Task.StateEnum.processing)
+        self.assertTrue(os.path.exists(self.filename))
+
+    @patch("app.tasks.classify_image", side_effect=InvalidImageError("not an image"))
+    def test_classify_task_fails_on_invalid_images(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+        self.assertFailed(Task.ErrorEnum.invalid_image)
+
+    @patch("app.tasks.classify_image", side_effect=FileNotFoundError())
+    def test_classify_task_fails_on_missing_files(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+        self.assertFailed(Task.ErrorEnum.file_missing)
+
+    @patch("app.tasks.classify_image", side_effect=SoftTimeLimitExceeded())
+    def test_classify_task_fails_on_timeout(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+        self.assertFailed(Task.ErrorEnum.timeout)
+
+    @patch("app.tasks.classify_image", side_effect=RuntimeError("unexpected"))
+    def test_classify_task_fails_on_unexpected_errors(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+        self.assertFailed(Task.ErrorEnum.internal_error)
+
+    @patch("app.tasks.classify_image", side_effect=[MemoryError(), 5])
+    def test_classify_task_retries_transient_errors(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+
+        task = self.get_task(self.task_id)
+        self.assertEqual(task.state, Task.StateEnum.done)
+        self.assertEqual(task.result, 5)
+        self.assertEqual(task.attempts, 2)
+
+    @patch("app.tasks.refresh_cached_tasks_sync")
+    @patch("app.tasks.record_completion")
+    @patch("app.tasks.classify_image", return_value=5)
+    def test_classify_task_counts_usage_once_when_storing_is_retried(self, classify_image, record_completion,
+                                                                     refresh_cached_tasks_sync):
+        redis = FakeRedis()
+        failures = [OperationalError("UPDATE", {}, Exception("database restarting"))]
+        def write_results_failing_once(db, results):
+            if failures:
+                raise failures.pop()
+            return write_results(db, results)
+
+        with (patch("app.tasks.redis_connection", redis),
+              patch("app.tasks.write_results", side_effect=write_results_failing_once)):
+            classify_task.apply(args=[self.task_id])
+
+        self.assertEqual(classify_image.call_count, 2)
+        self.assertEqual(self.get_task(self.task_id).state, Task.StateEnum.done)
+        self.assertEqual(redis.hashes[usage_redis_key(self.api_key_id, usage_day())]["class_5"], 1)
+        record_completion.assert_called_once()
+
+    @patch("app.tasks.classify_image", side_effect=MemoryError())
+    def test_classify_task_fails_after_max_attempts(self, classify_image):
+        classify_task.apply(args=[self.task_id])
+
+        self.assertFailed(Task.ErrorEnum.unavailable)
+        self.assertEqual(classify_image.call_count, 3)
+        self.assertEqual(self.get_task(self.task_id).attempts, 3)
+
+    @patch("app.tasks.classify_image")
+    def test_classify_task_drops_tasks_past_deadline(self, classify_image):
+        with _db_session() as db:
+            past_deadline = db.scalar(select(func.localtimestamp())) - timedelta(seconds=1)
+            db.get(Task, self.task_id).deadline = past_deadline
+            db.commit()
+
+        classify_task.apply(args=[self.task_id])
+
+        classify_image.assert_not_called()
+        task = self.get_task(self.task_id)
+        self.assertEqual(task.state, Task.StateEnum.cancelled)
+        self.assertEqual(task.error_code, Task.ErrorEnum.deadline_exceeded)
+        self.assertEqual(task.attempts, 0)
+        self.assertFalse(os.path.exists(self.filename))
+
+    @patch("app.tasks.classify_image")
+    def test_classify_task_skips_finished_tasks(self, classify_image):
+        done_task_id = self.add_task(filename="none", state=Task.StateEnum.done)
+        classify_task.apply(args=[done_task_id])
+        classify_image.assert_not_called()
+
+
+class ReaperTests(TaskTestCase):
+    def test_reaper_requeues_or_fails_stuck_tasks(self):
+        with _db_session() as db:
+            now = db.scalar(select(func.localtimestamp()))
+        long_ago = now - timedelta(hours=1)
+        lost_task_id = self.add_task(filename="none", updated_at=long_ago)
+        crashing_task_id = self.add_task(filename="none", updated_at=long_ago, attempts=3)
+        expired_task_id = self.add_task(filename="none", deadline=now - timedelta(minutes=1)) # not stuck yet
+        self.add_task(filename="none", deadline=now + timedelta(hours=1)) # recently updated
+        self.add_task(filename="none", updated_at=long_ago, state=Task.StateEnum.done)
+
+        requeued = []
+        with _db_session() as db:
+            reaped = reap_stuck_tasks(db, requeue=requeued.append)
+
+        self.assertEqual(reaped, {"requeued": [lost_task_id], "failed": [crashing_task_id],
+                                  "expired": [expired_task_id]})
+        self.assertEqual(requeued, [lost_task_id])
+        self.assertEqual(self.get_task(lost_task_id).state, Task.StateEnum.processing)
+        self.assertEqual(self.get_task(crashing_task_id).state, Task.StateEnum.failed)
+        self.assertEqual(self.get_task(crashing_task_id).error_code, Task.ErrorEnum.stuck)
+        self.assertEqual(self.get_task(expired_task_id).state, Task.StateEnum.cancelled)
+
+        # requeued tasks get a new timeout.
+        with _db_session() as db:
+            self.assertEqual(reap_stuck_tasks(db, requeue=requeued.append), {"requeued": [], "failed": [], "expired": []})
+
+
+    def test_reaper_leaves_tasks_with_pending_results(self):
+        with _db_session() as db:
+            long_ago = db.scalar(select(func.localtimestamp())) - timedelta(hours=1)
+        task_id = self.add_task(filename="none", updated_at=long_ago)
+
+        with _db_session() as db:
+            reaped = reap_stuck_tasks(db, requeue=lambda task_id: None, pending={task_id})
+
+        self.assertEqual(reaped, {"requeued": [], "failed": [], "expired": []})
+
+
+class PostgresClockTests(TaskTestCase):
+    """
+    now() has a time zone on postgres, unlike the task timestamps.
+    """
+    @postgres_now()
+    @patch("app.tasks.classify_image", return_value=3)
+    def test_classify_task_checks_deadlines(self, classify_image):
+        with _db_session() as db:
+            now = db.scalar(select(func.localtimestamp()))
+        task_id = self.add_task(filename="none", deadline=now + timedelta(hours=1))
+        expired_task_id = self.add_task(filename="none", deadline=now - timedelta(minutes=1))
+
+        classify_task.apply(args=[task_id])
+        classify_task.apply(args=[expired_task_id])
+
+        self.assertEqual(self.get_task(task_id).state, Task.StateEnum.done)
+        self.assertEqual(self.get_task(expired_task_id).state, Task.StateEnum.cancelled)
+        classify_image.assert_called_once()
+
+    @postgres_now()
+    def test_reaper_checks_deadlines(self):
+        with _db_session() as db:
+            now = db.scalar(select(func.localtimestamp()))
+        expired_task_id = self.add_task(filename="none", deadline=now - timedelta(minutes=1))
+        self.add_task(filename="none", deadline=now + timedelta(hours=1))
+
+        with _db_session() as db:
+            reaped = reap_stuck_tasks(db, requeue=lambda task_id: None)
+
+        self.assertEqual(reaped["expired"], [expired_task_id])
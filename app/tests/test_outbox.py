@@ -0,0 +1,85 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from sqlalchemy import select, func
+
+from app.database.db import Base
+from app.database.models import User, APIKey, Task, TaskOutbox
+from app.utils.auth import hash_password
+from app.utils.outbox import relay_outbox
+from app.utils.testing.database import engine, get_test_db, postgres_now
+
+from datetime import datetime, timedelta
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        self.db = next(get_test_db())
+
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"))
+        self.db.add(user)
+        self.db.commit()
+        api_key = APIKey(key="test_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user.id)
+        self.db.add(api_key)
+        self.db.commit()
+
+        now = self.db.scalar(select(func.localtimestamp()))
+        self.db.add_all([
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none"),
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none", deadline=now + timedelta(minutes=1)),
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none", deadline=now - timedelta(minutes=1)),
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none", state=Task.StateEnum.cancelled),
+        ])
+        self.db.commit()
+        # the last one's task was deleted.
+        self.db.add_all([TaskOutbox(task_id=task_id) for task_id in (1, 2, 3, 4, 5)])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_relay_outbox(self):
+        publish = MagicMock()
+
+        relayed = relay_outbox(self.db, publish)
+
+        # tasks past their deadline, finished or deleted ones aren't published.
+        self.assertEqual(relayed, 5)
+        publish.assert_called_once()
+        messages = publish.call_args.args[0]
+        self.assertEqual([task_id for task_id, _ in messages], [1, 2])
+        self.assertIsNone(messages[0][1])
+        self.assertAlmostEqual(messages[1][1], 60, delta=2)
+        self.assertEqual(self.db.query(TaskOutbox).count(), 0)
+
+        self.assertEqual(relay_outbox(self.db, publish), 0)
+        publish.assert_called_once()
+
+    def test_relay_outbox_in_batches(self):
+        publish = MagicMock()
+
+        self.assertEqual(relay_outbox(self.db, publish, batch_size=1), 1)
+        self.assertEqual(publish.call_args.args[0], [(1, None)])
+        self.assertEqual([row.task_id for row in self.db.query(TaskOutbox)], [2, 3, 4, 5])
+
+    def test_relay_outbox_keeps_tasks_when_publishing_fails(self):
+        publish = MagicMock(side_effect=ConnectionError("broker is down"))
+
+        with self.assertRaises(ConnectionError):
+            relay_outbox(self.db, publish)
+        self.db.rollback()
+        self.assertEqual(self.db.query(TaskOutbox).count(), 5)
+
+    @postgres_now()
+    def test_relay_outbox_with_postgres_clock(self):
+        publish = MagicMock()
+
+        relay_outbox(self.db, publish)
+
+        messages = publish.call_args.args[0]
+        self.assertEqual([task_id for task_id, _ in messages], [1, 2])
+        self.assertAlmostEqual(messages[1][1], 60, delta=2)
@@ -0,0 +1,109 @@
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+from unittest.mock import patch
+
+from app.routes import classify, tasks, apikeys
+from app.routes.admin import tasks as admin_tasks, users as admin_users
+from app.database.models import User, APIKey, Task
+
+from app.utils.auth import API_KEY_NAME, hash_password, create_access_token
+from app.utils.testing.testcase import MyTestCase
+from app.utils.testing.database import get_test_db, engine, async_engine
+from app.utils.testing.queryplan import capture_statements, explain_query_plan
+
+from datetime import datetime, timedelta
+
+app = FastAPI()
+app.include_router(classify.router)
+app.include_router(tasks.router)
+app.include_router(apikeys.router)
+app.include_router(admin_tasks.router)
+app.include_router(admin_users.router)
+
+
+client = TestClient(app)
+
+
+class QueryPlanTests(MyTestCase):
+    """
+    Checks that the queries of hot routes use the indexes made for them.
+    The statements are captured while the routes run and explained on the test database.
+    """
+    @classmethod
+    def setTestData(cls):
+        db = next(get_test_db())
+    
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"),
+                role=User.RoleEnum.admin)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+
+        expiration_date = datetime.now() + timedelta(days=5)
+        test_api_key = APIKey(key="test_key", expiration_date=expiration_date, owner_id=user.id)
+        db.add(test_api_key)
+        db.commit()
+        db.refresh(test_api_key)
+
+        db.add_all([Task(api_key_id=test_api_key.id, filename="none", user_id=user.id, state=Task.StateEnum.done)
+                    for _ in range(5)])
+        db.commit()
+        cls.app = app
+
+    def setUp(self):
+        super().setUp()
+        token = create_access_token(data={"sub": "user1", "scopes": ["admin"]},
+                                    expires_delta=timedelta(minutes=30))
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def assertRouteUsesIndex(self, index_name, table, method, url, **kwargs):
+        with capture_statements(engine, async_engine) as statements:
+            response = client.request(method, url, **kwargs)
+        self.assertLess(response.status_code, 400, response.text)
+
+        plans = [explain_query_plan(self.connection, statement, parameters)
+                 for statement, parameters in statements
+                 if statement.startswith("SELECT") and f"FROM {table}" in statement]
+        self.assertTrue(plans, f"{method} {url} didn't query {table}")
+        self.assertTrue(any(f"INDEX {index_name}" in plan for plan in plans),
+                        f"{method} {url} doesn't use {index_name}:\n" + "\n".join(plans))
+
+    def test_tasks_list_uses_user_index(self):
+        self.assertRouteUsesIndex("ix_tasks_user_id_created_at_id", "tasks",
+                                  "GET", "/my-tasks", headers=self.headers)
+
+    def test_tasks_list_filtered_by_state_uses_user_state_index(self):
+        self.assertRouteUsesIndex("ix_tasks_user_id_state_created_at_id", "tasks",
+                                  "GET", "/my-tasks", params={"state": "done"}, headers=self.headers)
+
+    def test_tasks_list_filtered_by_api_key_uses_user_api_key_index(self):
+        self.assertRouteUsesIndex("ix_tasks_user_id_api_key_id_created_at_id", "tasks",
+                                  "GET", "/my-tasks", params={"api_key_id": 1}, headers=self.headers)
+
+    def test_task_changes_use_user_change_seq_index(self):
+        self.assertRouteUsesIndex("ix_tasks_user_id_change_seq", "tasks",
+                                  "GET", "/my-tasks/changes", params={"since": "WzJd"}, headers=self.headers)
+
+    def test_admin_tasks_list_uses_created_at_index(self):
+        self.assertRouteUsesIndex("ix_tasks_created_at_id", "tasks",
+                                  "GET", "/admin/tasks", headers=self.headers)
+
+    def test_admin_users_search_uses_lower_indexes(self):
+        self.assertRouteUsesIndex("ix_users_username_lower", "users",
+                                  "GET", "/admin/users", params={"search": "user"}, headers=self.headers)
+        self.assertRouteUsesIndex("ix_users_email_lower", "users",
+                                  "GET", "/admin/users", params={"search": "user"}, headers=self.headers)
+
+    def test_api_keys_list_uses_owner_index(self):
+        self.assertRouteUsesIndex("ix_api_keys_owner_id_is_active", "api_keys",
+                                  "GET", "/my-api-keys", params={"active_only": True}, headers=self.headers)
+
+    @patch('app.routes.classify._prepare_file')
+    def test_classify_admission_check_uses_processing_index(self, _prepare_file):
+        with open("app/tst.png", "rb") as f:
+            self.assertRouteUsesIndex("ix_tasks_processing", "tasks",
+                                      "POST", "/classify",
+                                      files={"file": ("test_image.png", f.read())},
+                                      headers={API_KEY_NAME: "test_key"})
@@ -0,0 +1,103 @@
+from unittest import TestCase
+from unittest.mock import patch, AsyncMock
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.database.db import Base, RoutingSession, uses_replica
+from app.database.models import User
+from app.data_models.user import UserPrincipal
+from app.utils.replica import get_read_db, mark_writes
+from app.utils.testing.database import engine, replica_engine
+
+
+class ReplicaRoutingTests(TestCase):
+    """
+    Uses two databases. The same user has a different name in each, so it's clear which one was queried.
+    """
+    def setUp(self):
+        for database, username in ((engine, "primary"), (replica_engine, "replica")):
+            Base.metadata.drop_all(bind=database)
+            Base.metadata.create_all(bind=database)
+            with Session(database) as db:
+                db.add(User(id=1, username=username, email="mail@mail.com", hashed_password="none"))
+                db.commit()
+        self.user = UserPrincipal(id=1, username="user1", email="mail@mail.com",
+                                  is_active=True, role=User.RoleEnum.normal)
+
+        session_patcher = patch("app.database.db.ReadSessionLocal",
+                                sessionmaker(autoflush=False, bind=engine, class_=RoutingSession))
+        session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+        replica_patcher = patch("app.database.db.replica_engine", replica_engine)
+        replica_patcher.start()
+        self.addCleanup(replica_patcher.stop)
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.drop_all(bind=replica_engine)
+
+    def read_username(self, db: Session) -> str:
+        return db.scalar(select(User.username).filter(User.id == 1))
+
+    @patch("app.utils.replica.has_recent_write_sync", return_value=False)
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self, has_recent_write_sync):
+        db = next(get_read_db(self.user))
+        self.assertTrue(uses_replica(db))
+        self.assertEqual(self.read_username(db), "replica")
+
+        db.execute(update(User).filter(User.id == 1).values(full_name="statement"))
+        db.get(User, 1).email = "flushed@mail.com"
+        db.commit()
+        db.close()
+
+        with Session(engine) as primary:
+            user = primary.get(User, 1)
+            self.assertEqual((user.full_name, user.email), ("statement", "flushed@mail.com"))
+        with Session(replica_engine) as replica:
+            user = replica.get(User, 1)
+            self.assertEqual((user.full_name, user.email), (None, "mail@mail.com"))
+
+    @patch("app.utils.replica.has_recent_write_sync", return_value=True)
+    def test_recent_writers_read_from_the_primary(self, has_recent_write_sync):
+        db = next(get_read_db(self.user))
+        self.assertFalse(uses_replica(db))
+        self.assertEqual(self.read_username(db), "primary")
+        has_recent_write_sync.assert_called_once_with(1)
+        db.close()
+
+    def test_reads_go_to_the_primary_without_a_replica(self):
+        with patch("app.database.db.replica_engine", None):
+            db = next(get_read_db(self.user))
+        self.assertEqual(self.read_username(db), "primary")
+        db.close()
+
+
+def _authenticate(request: Request):
+    request.state.user_id = 1
+
+marked_router = APIRouter(dependencies=[Depends(_authenticate)])
+
+@marked_router.get("/items")
+@marked_router.post("/items")
+def _change_items(fail: bool = False):
+    if fail:
+        raise HTTPException(400)
+    return {}
+
+marked_app = FastAPI()
+marked_app.include_router(marked_router, dependencies=[Depends(mark_writes)])
+
+
+class MarkWritesTests(TestCase):
+    @patch("app.utils.replica.mark_recent_write", new_callable=AsyncMock)
+    def test_successful_writes_mark_the_user(self, mark_recent_write):
+        client = TestClient(marked_app)
+
+        client.get("/items")
+        client.post("/items", params={"fail": True})
+        mark_recent_write.assert_not_called()
+
+        client.post("/items")
+        mark_recent_write.assert_awaited_once_with(1)
@@ -0,0 +1,137 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from app.database.db import Base
+from app.database.models import User, APIKey, Task
+from app.utils.auth import hash_password
+from app.utils.result_writer import (write_results,
+                                     read_results,
+                                     flush_results,
+                                     RESULT_STREAM,
+                                     RESULT_WRITER_GROUP,
+                                     PENDING_RESULTS_KEY)
+from app.utils.testing.database import engine, get_test_db
+
+from datetime import datetime, timedelta
+from itertools import chain, repeat
+import os
+import tempfile
+
+
+def entry(entry_id, task_id, result, filename=""):
+    return (entry_id, {b"task_id": str(task_id).encode(), b"result": str(result).encode(), b"duration_ms": b"12.5",
+                       b"filename": filename.encode()})
+
+
+class ResultWriterTests(TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        self.db = next(get_test_db())
+
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"))
+        self.db.add(user)
+        self.db.commit()
+        api_key = APIKey(key="test_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user.id)
+        self.db.add(api_key)
+        self.db.commit()
+
+        self.db.add_all([
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none"),
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none"),
+            Task(api_key_id=api_key.id, user_id=user.id, filename="none", state=Task.StateEnum.cancelled),
+        ])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def states(self):
+        self.db.expire_all()
+        return [(task.state, task.result) for task in self.db.query(Task).order_by(Task.id)]
+
+    def test_write_results(self):
+        updated = write_results(self.db, {1: 4, 2: 7, 3: 1})
+
+        # cancelled tasks keep their state.
+        self.assertEqual(updated, 2)
+        self.assertEqual(self.states(), [(Task.StateEnum.done, 4),
+                                         (Task.StateEnum.done, 7),
+                                         (Task.StateEnum.cancelled, None)])
+
+    def test_flush_results_acknowledges_after_writing(self):
+        redis = MagicMock()
+        # at least once delivery may repeat a result.
+        entries = [entry(b"1-0", 1, 4), entry(b"1-1", 1, 4), entry(b"2-0", 2, 7)]
+
+        updated = flush_results(redis, self.db, entries)
+
+        self.assertEqual(updated, 2)
+        self.assertEqual(self.states()[:2], [(Task.StateEnum.done, 4), (Task.StateEnum.done, 7)])
+        redis.xack.assert_called_once_with(RESULT_STREAM, RESULT_WRITER_GROUP, b"1-0", b"1-1", b"2-0")
+        redis.srem.assert_called_once_with(PENDING_RESULTS_KEY, 1, 2)
+
+    def test_flush_results_removes_files_after_writing(self):
+        filename = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(lambda: os.path.exists(filename) and os.remove(filename))
+
+        flush_results(MagicMock(), self.db, [entry(b"1-0", 1, 4, filename)])
+
+        self.assertFalse(os.path.exists(filename))
+
+    def test_flush_results_doesnt_acknowledge_on_errors(self):
+        redis = MagicMock()
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+        filename = tempfile.NamedTemporaryFile(delete=False).name
+        self.addCleanup(os.remove, filename)
+
+        with self.assertRaises(Exception):
+            flush_results(redis, self.db, [entry(b"1-0", 1, 4, filename)])
+        redis.xack.assert_not_called()
+        # the task may run again.
+        self.assertTrue(os.path.exists(filename))
+
+    def test_flush_results_drops_bad_entries(self):
+        redis = MagicMock()
+        entries = [entry(b"1-0", 1, 4), entry(b"2-0", 2, "not a result"), entry(b"3-0", 2, 2 ** 70)]
+
+        updated = flush_results(redis, self.db, entries)
+
+        # the rest of the batch is written.
+        self.assertEqual(updated, 1)
+        self.assertEqual(self.states()[:2], [(Task.StateEnum.done, 4), (Task.StateEnum.processing, None)])
+        acknowledged = [entry_id for call in redis.xack.call_args_list for entry_id in call.args[2:]]
+        self.assertCountEqual(acknowledged, [b"1-0", b"2-0", b"3-0"])
+        removed = [task_id for call in redis.srem.call_args_list for task_id in call.args[1:]]
+        self.assertCountEqual(removed, [1, 2, 2])
+
+    def test_read_results_waits_for_batch(self):
+        redis = MagicMock()
+        redis.xreadgroup.side_effect = [[[RESULT_STREAM, [entry(b"1-0", 1, 4)]]],
+                                        [[RESULT_STREAM, [entry(b"2-0", 2, 7), entry(b"3-0", 3, 1)]]],
+                                        [[RESULT_STREAM, [entry(b"4-0", 3, 1)]]]]
+
+        entries = read_results(redis, "writer", batch_size=3, flush_interval=1000)
+
+        self.assertEqual([entry_id for entry_id, _ in entries], [b"1-0", b"2-0", b"3-0"])
+        self.assertEqual(redis.xreadgroup.call_args_list[1].kwargs["count"], 2)
+
+    def test_read_results_flushes_after_interval(self):
+        redis = MagicMock()
+        redis.xreadgroup.side_effect = chain([[[RESULT_STREAM, [entry(b"1-0", 1, 4)]]]], repeat([]))
+
+        entries = read_results(redis, "writer", batch_size=10, flush_interval=1)
+
+        self.assertEqual(len(entries), 1)
+
+    def test_read_results_returns_nothing_when_idle(self):
+        redis = MagicMock()
+        redis.xreadgroup.return_value = []
+
+        self.assertEqual(read_results(redis, "writer", batch_size=10, flush_interval=10), [])
+        self.assertEqual(redis.xreadgroup.call_count, 1)
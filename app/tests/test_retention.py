@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+from app.database.db import Base
+from app.database.models import User, APIKey, Task, TaskArchive
+from app.utils.auth import hash_password
+from app.utils.retention import apply_task_retention
+from app.utils.testing.database import engine, get_test_db
+
+from datetime import datetime, timedelta
+import tempfile
+import os
+
+
+class TaskRetentionTests(TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        self.db = next(get_test_db())
+
+        user = User(username="user1",
+                email="mail@mail.com",
+                hashed_password=hash_password("user1"))
+        self.db.add(user)
+        self.db.commit()
+        api_key = APIKey(key="test_key", expiration_date=datetime.now() + timedelta(days=5), owner_id=user.id)
+        self.db.add(api_key)
+        self.db.commit()
+
+        self.now = datetime.now()
+        self.leftover_file = tempfile.NamedTemporaryFile(delete=False).name
+
+        def task(state, age_days, filename="none"):
+            created_at = self.now - timedelta(days=age_days)
+            return Task(api_key_id=api_key.id, user_id=user.id, filename=filename, state=state,
+                        created_at=created_at, updated_at=created_at)
+
+        self.db.add_all([
+            task(Task.StateEnum.done, 100),
+            task(Task.StateEnum.done, 95),
+            task(Task.StateEnum.done, 10),
+            task(Task.StateEnum.failed, 40, filename=self.leftover_file),
+            task(Task.StateEnum.failed, 10),
+            task(Task.StateEnum.processing, 200),
+        ])
+        self.db.commit()
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+        if os.path.exists(self.leftover_file):
+            os.remove(self.leftover_file)
+
+    def remaining(self):
+        return sorted((task.state.value, (self.now - task.created_at).days)
+                      for task in self.db.query(Task).all())
+
+    def test_archive(self):
+        expired = apply_task_retention(self.db, now=self.now, mode="archive")
+
+        self.assertEqual(expired, {"done": 2, "failed": 1, "cancelled": 0})
+        self.assertEqual(self.remaining(), [("done", 10), ("failed", 10), ("processing", 200)])
+        archived = self.db.query(TaskArchive).all()
+        self.assertEqual(sorted(task.state.value for task in archived), ["done", "done", "failed"])
+        self.assertTrue(all(task.archived_at for task in archived))
+        self.assertTrue(all(task.filename is None for task in archived))
+        self.assertFalse(os.path.exists(self.leftover_file))
+
+    def test_delete(self):
+        expired = apply_task_retention(self.db, now=self.now, mode="delete")
+
+        self.assertEqual(expired, {"done": 2, "failed": 1, "cancelled": 0})
+        self.assertEqual(self.remaining(), [("done", 10), ("failed", 10), ("processing", 200)])
+        self.assertEqual(self.db.query(TaskArchive).count(), 0)
+
+    def test_batches(self):
+        expired = apply_task_retention(self.db, now=self.now, batch_size=1, max_batches=1)
+
+        # the oldest task of each state is expired first.
+        self.assertEqual(expired, {"done": 1, "failed": 1, "cancelled": 0})
+        self.assertEqual(self.remaining(), [("done", 10), ("done", 95), ("failed", 10), ("processing", 200)])
+
+        expired = apply_task_retention(self.db, now=self.now, batch_size=1)
+        self.assertEqual(expired, {"done": 1, "failed": 0, "cancelled": 0})
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            apply_task_retention(self.db, now=self.now, mode="truncate")
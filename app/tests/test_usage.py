@@ -0,0 +1,82 @@
+from unittest import TestCase
+from unittest.mock import patch
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.database.db import Base
+from app.database.models import Usage
+from app.utils.usage import (count_request,
+                             count_completion,
+                             flush_usage,
+                             usage_day,
+                             usage_redis_key,
+                             USAGE_DIRTY_KEY,
+                             USAGE_FLUSHING_KEY)
+from app.utils.testing.database import engine, SessionLocal
+from app.utils.testing.redis import FakeAsyncRedis, FakeRedis
+
+import asyncio
+
+
+class QuotaTests(TestCase):
+    @patch("app.utils.usage.USAGE_DAILY_QUOTA", 2)
+    def test_requests_over_the_daily_quota_are_refused(self):
+        redis = FakeAsyncRedis()
+        for _ in range(2):
+            asyncio.run(count_request(redis, 1, 1))
+        with self.assertRaises(HTTPException) as context:
+            asyncio.run(count_request(redis, 1, 1))
+        self.assertEqual(context.exception.status_code, 429)
+
+        # the refused request isn't counted. other keys have their own quota.
+        self.assertEqual(redis.hashes[usage_redis_key(1, usage_day())]["requests"], 2)
+        asyncio.run(count_request(redis, 2, 1))
+
+    @patch("app.utils.usage.USAGE_MONTHLY_QUOTA", 1)
+    def test_requests_over_the_monthly_quota_are_refused(self):
+        redis = FakeAsyncRedis()
+        asyncio.run(count_request(redis, 1, 1))
+        with self.assertRaises(HTTPException) as context:
+            asyncio.run(count_request(redis, 1, 1))
+        self.assertEqual(context.exception.status_code, 429)
+
+
+class FlushUsageTests(TestCase):
+    def setUp(self):
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        self.db = SessionLocal()
+        self.redis = FakeRedis()
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def usage(self) -> dict[tuple[int, str], int]:
+        return {(row.api_key_id, row.metric): row.value for row in self.db.scalars(select(Usage))}
+
+    def test_counters_are_written_and_replaced(self):
+        count_completion(self.redis, 1, 10, 3, 12.4)
+        count_completion(self.redis, 1, 10, 3, 20)
+        count_completion(self.redis, 2, 20, 5, 7)
+
+        self.assertEqual(flush_usage(self.db, self.redis, batch_size=1), 2)
+        self.assertEqual(self.usage(), {(1, "class_3"): 2, (1, "cpu_ms"): 32, (2, "class_5"): 1, (2, "cpu_ms"): 7})
+        self.assertFalse(self.redis.exists(USAGE_DIRTY_KEY, USAGE_FLUSHING_KEY))
+
+        # only changed counters are written. the row gets the counter's value.
+        count_completion(self.redis, 1, 10, 3, 8)
+        self.assertEqual(flush_usage(self.db, self.redis), 1)
+        self.assertEqual(self.usage()[(1, "class_3")], 3)
+        self.assertEqual(self.usage()[(1, "cpu_ms")], 40)
+
+        self.assertEqual(flush_usage(self.db, self.redis), 0)
+
+    def test_leftovers_of_a_failed_flush_are_written(self):
+        count_completion(self.redis, 1, 10, 3, 10)
+        self.redis.rename(USAGE_DIRTY_KEY, USAGE_FLUSHING_KEY) # renamed by a flush which died
+        count_completion(self.redis, 2, 20, 5, 10)
+
+        self.assertEqual(flush_usage(self.db, self.redis), 1)
+        self.assertEqual(flush_usage(self.db, self.redis), 1)
+        self.assertEqual(set(self.usage()), {(1, "class_3"), (1, "cpu_ms"), (2, "class_5"), (2, "cpu_ms")})
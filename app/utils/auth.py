@@ -1,19 +1,37 @@
-from fastapi import Security, HTTPException, status, Depends
+from fastapi import Security, HTTPException, Request, status, Depends
 from fastapi.security import APIKeyHeader, OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import ValidationError, BaseModel
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime, timezone
+import asyncio
+import hashlib
 import secrets
 import jwt
 import bcrypt
 from typing import Annotated
 
-from ..database.db import get_db
+from ..database.db import get_async_db
 from ..database.models import APIKey, User
+from ..data_models.apikey import APIKeyPrincipal
+from ..data_models.user import UserPrincipal
+from .cache import TwoTierCache
+from .limiter import ConcurrencyLimiter
 from app.config import (API_KEY_NAME,
                         ALGORITHM,
-                        SECRET_KEY)
+                        SECRET_KEY,
+                        BCRYPT_ROUNDS,
+                        PASSWORD_HASHING_WORKERS,
+                        PASSWORD_ROUTES_MAX_CONCURRENCY,
+                        API_KEY_CACHE_TTL,
+                        API_KEY_LOCAL_CACHE_TTL,
+                        API_KEY_LOCAL_CACHE_SIZE,
+                        USER_CACHE_TTL,
+                        USER_LOCAL_CACHE_TTL,
+                        USER_LOCAL_CACHE_SIZE)
 
 class TokenData(BaseModel):
     username: str | None = None
@@ -25,36 +43,108 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl='token',
     scopes={"admin": "permission to perform administrator action"},)
 
-async def get_api_key(api_key_header: str = Depends(api_key_header),
-                      db: Session = Depends(get_db)) -> APIKey:
+api_key_cache = TwoTierCache("apikey",
+                             APIKeyPrincipal,
+                             ttl=API_KEY_CACHE_TTL,
+                             local_ttl=API_KEY_LOCAL_CACHE_TTL,
+                             local_maxsize=API_KEY_LOCAL_CACHE_SIZE)
+
+# bcrypt releases the GIL, so a few threads are enough to keep hashing off the event loop.
+# the pool is bounded so logins can't take over every cpu core.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASHING_WORKERS,
+                                       thread_name_prefix="password-hashing")
+
+# shared by the path operations which hash or check passwords.
+password_route_limiter = ConcurrencyLimiter(PASSWORD_ROUTES_MAX_CONCURRENCY)
+
+user_cache = TwoTierCache("user",
+                          UserPrincipal,
+                          ttl=USER_CACHE_TTL,
+                          local_ttl=USER_LOCAL_CACHE_TTL,
+                          local_maxsize=USER_LOCAL_CACHE_SIZE)
+
+def api_key_cache_key(key: str) -> str:
+    """
+    Returns the cache key of an API key. Keys are hashed so they are not stored in redis as plain text.
+    """
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+async def get_user_api_key_cache_keys(db: AsyncSession, user_id: int) -> list[str]:
+    """
+    Returns the cache keys of every API key of a user. Used for invalidating them
+    after changes to the user that affect their keys, e.g. deletion.
+
+    - **db**: A database session.
+    - **user_id**: User's unique identifier.
+
+    Returns:
+    list[str]: cache keys.
+    """
+    keys = await db.scalars(select(APIKey.key).filter(APIKey.owner_id == user_id))
+    return [api_key_cache_key(key) for key in keys]
+
+async def get_api_key(request: Request,
+                      api_key_header: str = Depends(api_key_header),
+                      db: AsyncSession = Depends(get_async_db)) -> APIKeyPrincipal:
     """
     This dependency is used to get api key from a header provided by user.
-    If the key has expired, Raises an HTTP exception.
+    Keys are looked up in the API key cache first and only on a miss in the database.
+    If the key is inactive or has expired, Raises an HTTP exception.
 
 
     Returns:
-    APIKey: An object which is an instance of APIKey model.
+    APIKeyPrincipal: The key's id and state along with its owner's id and username.
     """
     if api_key_header is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="API Key header is missing"
         )
-    api_key = db.query(APIKey).filter(APIKey.key == api_key_header).first()
-    if not api_key:
+    cache_key = api_key_cache_key(api_key_header)
+    api_key = await api_key_cache.get(cache_key)
+    if api_key is None:
+        result = await db.execute(select(APIKey.id,
+                                         APIKey.owner_id,
+                                         User.username,
+                                         APIKey.is_active,
+                                         APIKey.expiration_date)
+                                  .join(User, APIKey.owner_id == User.id)
+                                  .filter(APIKey.key == api_key_header))
+        row = result.first()
+        # the route may use another session. in the sqlite profile this one would keep the write lock.
+        await db.commit()
+        if not row:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Invalid API Key"
+            )
+        api_key = APIKeyPrincipal(id=row.id,
+                                  owner_id=row.owner_id,
+                                  owner_username=row.username,
+                                  is_active=bool(row.is_active),
+                                  expiration_date=row.expiration_date)
+        ttl = None
+        if api_key.expiration_date:
+            ttl = int((api_key.expiration_date - datetime.now()).total_seconds())
+        await api_key_cache.set(cache_key, api_key, ttl)
+
+    if not api_key.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail="Invalid API Key"
+            detail="API Key is not active"
         )
-    
+
     if api_key.expiration_date and api_key.expiration_date < datetime.now():
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="API Key has expired!"
         )
+    # for read-your-writes. see app.utils.replica.
+    request.state.user_id = api_key.owner_id
     return api_key
 
-async def get_current_user_by_api_key(api_key: APIKey = Security(get_api_key)) -> User:
+async def get_current_user_by_api_key(api_key: APIKeyPrincipal = Security(get_api_key),
+                                      db: AsyncSession = Depends(get_async_db)) -> User:
     # Fetch user data based on the API key from the database
     """
     This dependency fetchs user data based on the API key from the database.
@@ -63,8 +153,9 @@ async def get_current_user_by_api_key(api_key: APIKey = Security(get_api_key)) -
     Returns:
     User: An object which is an instance of User model.
     """
-    if api_key.user:
-        return api_key.user
+    user = await db.get(User, api_key.owner_id)
+    if user:
+        return user
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
         detail="User not found"
@@ -81,7 +172,7 @@ def hash_password(password) -> bytes:
     bytes: hashed password.
     """
     password_as_bytes = bytes(password, "utf-8")
-    return bcrypt.hashpw(password_as_bytes, bcrypt.gensalt()).decode("utf-8")
+    return bcrypt.hashpw(password_as_bytes, bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
 
 def check_password(password, hashed_password) -> bool:
     """
@@ -95,6 +186,31 @@ def check_password(password, hashed_password) -> bool:
     return bcrypt.checkpw(password_as_bytes, 
                           hashed_password_as_bytes)
 
+def password_needs_rehash(hashed_password) -> bool:
+    """
+    Checks if a hash was made with a bcrypt cost other than the configured one.
+
+    - **hashed_password**: The hashed password as string in utf-8 encoding.
+    """
+    # bcrypt hashes look like $2b$<cost>$<salt and hash>
+    return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+
+async def async_hash_password(password) -> str:
+    """
+    Same as ""hash_password"" but runs in the password hashing thread pool
+    so it doesn't block the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, hash_password, password)
+
+async def async_check_password(password, hashed_password) -> bool:
+    """
+    Same as ""check_password"" but runs in the password hashing thread pool
+    so it doesn't block the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, check_password, password, hashed_password)
+
 def authenticate_user(db: Session, username: str, password: str) -> User | bool:
     """
     Authenticates a user with username and password. If successfull returns an instance
@@ -114,6 +230,43 @@ def authenticate_user(db: Session, username: str, password: str) -> User | bool:
         return False
     return user
 
+async def async_authenticate_user(db: AsyncSession, username: str, password: str) -> User | bool:
+    """
+    Same as ""authenticate_user"" for async sessions. The password is checked in the password
+    hashing thread pool. If the password was hashed with an outdated bcrypt cost, it is rehashed
+    and the new hash is committed.
+
+    - **db**: An async database session.
+    - **username**: Username.
+    - **password**: The password as string in utf-8 encoding.
+
+    Returns:
+    User | False: If successful, An object which is an instance of User model. Returns false otherwise.
+    """
+    result = await db.execute(select(User).filter(User.username == username))
+    user = result.scalars().first()
+    if not user:
+        return False
+    if not await async_check_password(password, user.hashed_password):
+        return False
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await async_hash_password(password)
+        await db.commit()
+    return user
+
+def get_user_scopes(user: User | UserPrincipal) -> list[str]:
+    """
+    Returns the scopes a user is currently allowed to have.
+
+    - **user**: A user or a cached user principal.
+
+    Returns:
+    list[str]: scopes.
+    """
+    if user.role == User.RoleEnum.admin:
+        return ["admin"]
+    return []
+
 def create_access_token(data: dict,
                         expires_delta: timedelta | None = None) -> str:
     """
@@ -134,15 +287,18 @@ def create_access_token(data: dict,
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(
+async def get_current_user(
+        request: Request,
         security_scopes: SecurityScopes,
         token: Annotated[str, Depends(oauth2_scheme)], 
-        db: Annotated[Session, Depends(get_db)]) -> User:
+        db: Annotated[AsyncSession, Depends(get_async_db)]) -> UserPrincipal:
     """
     A dependency for authenticating user using password scheme.
+    Users are looked up in the user cache first and only on a miss in the database.
+    A scope is granted only if the token has it and the user is still allowed to have it.
 
     Returns:
-    User: Current user.
+    UserPrincipal: Current user.
     """
     if security_scopes.scopes:
         authenticate_value = f"Bearer scopes=\"{security_scopes.scope_str}\""
@@ -162,37 +318,47 @@ def get_current_user(
         token_data = TokenData(username=username, scopes=token_scopes)
     except (jwt.exceptions.InvalidTokenError, ValidationError):
         raise credintials_exception
-    user = db.query(User).filter(User.username == username).first()
+    user = await user_cache.get(username)
     if user is None:
-        raise credintials_exception
+        result = await db.execute(select(User).filter(User.username == username))
+        db_user = result.scalars().first()
+        # the route may use another session. in the sqlite profile this one would keep the write lock.
+        await db.commit()
+        if db_user is None:
+            raise credintials_exception
+        user = UserPrincipal.model_validate(db_user)
+        await user_cache.set(username, user)
+    user_scopes = get_user_scopes(user)
     for scope in security_scopes.scopes:
-        if scope not in token_data.scopes:
+        if scope not in token_data.scopes or scope not in user_scopes:
                         raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="You don't have the premission to use this feature.",
                 headers={"WWW-Authenticate": authenticate_value},
             )
+    # for read-your-writes. see app.utils.replica.
+    request.state.user_id = user.id
     return user
 
-def get_current_admin_user(
-        current_user: Annotated[User, Security(get_current_user, scopes=["admin"])]
-        ) -> User:
+async def get_current_admin_user(
+        current_user: Annotated[UserPrincipal, Security(get_current_user, scopes=["admin"])]
+        ) -> UserPrincipal:
     """
     A shorthand dependency for authenticating ""admin"" users using password scheme.
 
     Returns:
-    User: Current user.
+    UserPrincipal: Current user.
     """
     return current_user
 
-def get_current_active_user(
-        current_user: Annotated[User, Security(get_current_user)]
-        ) -> User:
+async def get_current_active_user(
+        current_user: Annotated[UserPrincipal, Security(get_current_user)]
+        ) -> UserPrincipal:
     """
     A shorthand dependency for authenticating ""active"" users using password scheme.
 
     Returns:
-    User: Current user.
+    UserPrincipal: Current user.
     """
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
@@ -0,0 +1,35 @@
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import BULK_CHUNK_SIZE
+
+from typing import AsyncIterator
+
+
+async def iterate_chunks(db: AsyncSession, query: Select, id_column,
+                         chunk_size: int = BULK_CHUNK_SIZE) -> AsyncIterator[list]:
+    """
+    Yields the rows of a query in chunks, ordered by id. Each chunk is read after the previous one is
+    handled, starting after its last id, so the caller can update or delete the rows and commit in between.
+    Only the selected columns of one chunk are held in memory.
+
+    - **db**: Database session.
+    - **query**: The query. Its first column must be id_column and it must not be ordered or limited.
+    - **id_column**: A unique column increasing with each row. e.g. Task.id
+    - **chunk_size**: Max number of rows in each chunk.
+
+    Returns:
+    AsyncIterator[list]: Chunks of rows.
+    """
+    last_id = None
+    while True:
+        chunk_query = query.order_by(id_column).limit(chunk_size)
+        if last_id is not None:
+            chunk_query = chunk_query.filter(id_column > last_id)
+        rows = (await db.execute(chunk_query)).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
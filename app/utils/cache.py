@@ -0,0 +1,190 @@
+from pydantic import BaseModel
+import redis
+import redis.asyncio
+
+from app.config import (REDIS_DB,
+                        REDIS_HOST,
+                        REDIS_PORT)
+
+import asyncio
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+import logging
+
+logger = logging.getLogger(__name__)
+
+redis_connection = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+async_redis_connection = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+
+
+class TTLCache:
+    """
+    A small in-process LRU cache whose entries expire after a fixed time.
+    It is thread safe so sync path operations running in the threadpool can use it too.
+    """
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """
+        Returns the value stored for key or None if there isn't any or it has expired.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache:
+    """
+    Caches pydantic models in process memory and in redis. Lookups check the local cache first,
+    then redis. Redis failures are treated as cache misses so the callers fall back to the database.
+
+    Invalidations delete the redis entry and are published on a redis channel, so the local caches
+    of other processes drop the entry too. Each process must run ""listen"" for this to work.
+    Local entries expire after a short time anyway in case an invalidation message is missed.
+    """
+    def __init__(self, name: str, model: type[BaseModel], ttl: int, local_ttl: float, local_maxsize: int):
+        """
+        - **name**: A unique name used as prefix for redis keys.
+        - **model**: The pydantic model of the cached values.
+        - **ttl**: Time to live of redis entries in seconds.
+        - **local_ttl**: Time to live of in-process entries in seconds.
+        - **local_maxsize**: Max number of in-process entries.
+        """
+        self.name = name
+        self.model = model
+        self.ttl = ttl
+        self.local = TTLCache(local_ttl, local_maxsize)
+        self.channel = f"cache:{name}:invalidate"
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    async def get(self, key: str) -> BaseModel | None:
+        """
+        Returns the cached value for key or None on a miss.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        try:
+            raw = await async_redis_connection.get(self._redis_key(key))
+        except redis.RedisError as e:
+            logger.warning("%s cache is unavailable: %s", self.name, e)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.redis_hits += 1
+        value = self.model.model_validate_json(raw)
+        self.local.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        """
+        Returns the number of hits of each tier and misses since the process started.
+
+        Returns:
+        dict: hit and miss counts and the overall hit rate.
+        """
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+    async def set(self, key: str, value: BaseModel, ttl: int | None = None):
+        """
+        Stores a value in both tiers.
+
+        - **ttl**: An optional redis ttl shorter than the default. e.g. when the value itself expires sooner.
+        """
+        self.local.set(key, value)
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        try:
+            await async_redis_connection.set(self._redis_key(key), value.model_dump_json(), ex=ttl)
+        except redis.RedisError as e:
+            logger.warning("%s cache is unavailable: %s", self.name, e)
+
+    async def invalidate(self, *keys: str):
+        """
+        Removes the entries from both tiers and notifies other processes.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self.local.pop(key)
+        try:
+            await async_redis_connection.delete(*[self._redis_key(key) for key in keys])
+            for key in keys:
+                await async_redis_connection.publish(self.channel, key)
+        except redis.RedisError as e:
+            logger.warning("%s cache is unavailable: %s", self.name, e)
+
+    def invalidate_sync(self, *keys: str):
+        """
+        Same as ""invalidate"" for sync path operations.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self.local.pop(key)
+        try:
+            redis_connection.delete(*[self._redis_key(key) for key in keys])
+            for key in keys:
+                redis_connection.publish(self.channel, key)
+        except redis.RedisError as e:
+            logger.warning("%s cache is unavailable: %s", self.name, e)
+
+    async def listen(self):
+        """
+        Drops local entries invalidated by other processes. Runs until cancelled.
+        Meant to be started as a background task in the app's lifespan.
+        """
+        while True:
+            pubsub = async_redis_connection.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    self.local.pop(message["data"].decode())
+            except redis.RedisError as e:
+                logger.warning("%s cache invalidation listener disconnected: %s", self.name, e)
+                # messages may have been missed while disconnected.
+                self.local.clear()
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(5)
@@ -0,0 +1,37 @@
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.models import Task
+from app.utils.retention import remove_task_files
+from app.utils.task_cache import cache_task
+from app.utils.cache import async_redis_connection
+from app.tasks import revoke_classify_task
+
+
+async def cancel_task(db: AsyncSession, task: Task) -> bool:
+    """
+    Cancels a processing task. Its queued message is revoked so no worker spends time on it,
+    and its uploaded file is removed. A worker already classifying it can't store the result.
+
+    - **db**: Database session.
+    - **task**: The task to cancel.
+
+    Returns:
+    bool: False if the task wasn't processing anymore. e.g. a worker finished it in the meantime.
+    """
+    filename = task.filename
+    result = await db.execute(update(Task)
+                              .filter(Task.id == task.id, Task.state == Task.StateEnum.processing)
+                              .values(state=Task.StateEnum.cancelled, filename=None, updated_at=func.now())
+                              .execution_options(synchronize_session=False))
+    await db.commit()
+    await db.refresh(task)
+    if result.rowcount == 0:
+        return False
+    await cache_task(async_redis_connection, task)
+
+    # both talk to other systems and may block.
+    await run_in_threadpool(revoke_classify_task, task.id)
+    await run_in_threadpool(remove_task_files, [filename])
+    return True
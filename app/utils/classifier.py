@@ -1,7 +1,7 @@
 import torch
 from torchvision import models, transforms
 
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 from app.config import PYTORCH_MODEL_PATH
 
 
@@ -10,6 +10,12 @@ classifier_model.classifier[1] = torch.nn.Linear(1280, 10).to("cpu")
 classifier_model.load_state_dict(torch.load(PYTORCH_MODEL_PATH, map_location=torch.device("cpu")))
 
 
+class InvalidImageError(ValueError):
+    """
+    Raised when a file is not an image the classifier can read.
+    """
+
+
 FAHION_MNIST_CLASS_NAMES = [
     "T-shirt/top", "Trouser", "Pullover", "Dress", "Coat",
     "Sandal", "Shirt", "Sneaker", "Bag", "Ankle boot"
@@ -26,7 +32,11 @@ def classify_image(image_path: str) -> int:
     Returns:
     int: An index of the FAHION_MNIST_CLASS_NAMES. Use the list for getting the name of class prediction.
     """
-    img = Image.open(image_path).convert("RGB")
+    try:
+        img = Image.open(image_path).convert("RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError) as e:
+        # truncated or malformed files may raise SyntaxError from the format parsers.
+        raise InvalidImageError(str(e)) from e
 
     transform = transforms.Compose([
             transforms.Grayscale(3),
@@ -0,0 +1,73 @@
+from sqlalchemy import Select, select, delete
+from sqlalchemy.orm import Session
+
+from app.database.models import User, APIKey, Task
+from app.utils.retention import remove_task_files
+from app.utils.task_cache import uncache_tasks_sync
+from app.utils.cache import redis_connection
+from app.config import BULK_CHUNK_SIZE, BACKGROUND_DELETION_THRESHOLD
+
+
+def tasks_beyond_threshold(criterion) -> Select:
+    """
+    Makes a query which returns a task ID only if more than BACKGROUND_DELETION_THRESHOLD tasks match
+    the criterion. It reads at most that many index entries, instead of counting all the tasks.
+
+    - **criterion**: A filter on tasks. e.g. Task.user_id == user_id
+
+    Returns:
+    Select: The query. Run it with scalar. None means the tasks can be deleted in the request.
+    """
+    return select(Task.id).filter(criterion).offset(BACKGROUND_DELETION_THRESHOLD).limit(1)
+
+def delete_tasks_in_chunks(db: Session, criterion, chunk_size: int = BULK_CHUNK_SIZE) -> int:
+    """
+    Deletes the tasks matching the criterion and their uploaded files, one chunk per transaction.
+
+    - **db**: Database session.
+    - **criterion**: A filter on tasks. e.g. Task.user_id == user_id
+    - **chunk_size**: Tasks deleted per transaction.
+
+    Returns:
+    int: Number of deleted tasks.
+    """
+    deleted = 0
+    while True:
+        rows = db.execute(select(Task.id, Task.user_id, Task.filename)
+                          .filter(criterion)
+                          .order_by(Task.id)
+                          .limit(chunk_size)).all()
+        if not rows:
+            return deleted
+        db.execute(delete(Task).filter(Task.id.in_([row.id for row in rows]))
+                   .execution_options(synchronize_session=False))
+        db.commit()
+        uncache_tasks_sync(redis_connection, rows)
+        remove_task_files([row.filename for row in rows])
+        deleted += len(rows)
+        if len(rows) < chunk_size:
+            return deleted
+
+def delete_user_data(db: Session, user_id: int, chunk_size: int = BULK_CHUNK_SIZE) -> dict[str, int]:
+    """
+    Deletes a user's tasks in chunks and then the user. The API keys are deleted by the database cascade.
+
+    Returns:
+    dict[str, int]: Number of deleted tasks and users.
+    """
+    tasks = delete_tasks_in_chunks(db, Task.user_id == user_id, chunk_size)
+    users = db.execute(delete(User).filter(User.id == user_id)).rowcount
+    db.commit()
+    return {"tasks": tasks, "users": users}
+
+def delete_api_key_data(db: Session, api_key_id: int, chunk_size: int = BULK_CHUNK_SIZE) -> dict[str, int]:
+    """
+    Deletes an API key's tasks in chunks and then the key.
+
+    Returns:
+    dict[str, int]: Number of deleted tasks and API keys.
+    """
+    tasks = delete_tasks_in_chunks(db, Task.api_key_id == api_key_id, chunk_size)
+    api_keys = db.execute(delete(APIKey).filter(APIKey.id == api_key_id)).rowcount
+    db.commit()
+    return {"tasks": tasks, "api_keys": api_keys}
@@ -0,0 +1,44 @@
+from fastapi import Request
+
+from app.database.models import Task
+
+from hashlib import sha1
+from typing import Iterable
+
+
+def _task_version(task) -> str:
+    # the result and the error code may change without the state, e.g. by an admin.
+    return f"{task.id}:{task.state.value}:{task.result}:{task.error_code}:{task.updated_at.isoformat()}"
+
+def task_etag(task: Task) -> str:
+    """
+    Returns the strong etag of a task. Cached tasks (see app.utils.task_cache) get the same etag.
+    """
+    return f'"{sha1(_task_version(task).encode()).hexdigest()}"'
+
+def task_list_etag(tasks: Iterable[Task], next_cursor: str | None = None) -> str:
+    """
+    Returns the strong etag of a page of tasks.
+
+    - **tasks**: The tasks on the page, in order.
+    - **next_cursor**: The cursor of the next page, if there is one.
+    """
+    digest = sha1()
+    for task in tasks:
+        digest.update(_task_version(task).encode())
+        digest.update(b"\n")
+    digest.update((next_cursor or "").encode())
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Returns True if the request's If-None-Match header matches the etag, so 304 can be sent.
+    """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison.
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
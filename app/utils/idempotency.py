@@ -0,0 +1,73 @@
+from fastapi import HTTPException
+import redis
+import redis.asyncio
+
+from app.config import (IDEMPOTENCY_TTL,
+                        IDEMPOTENCY_LOCK_TTL,
+                        IDEMPOTENCY_WAIT,
+                        IDEMPOTENCY_POLL_INTERVAL)
+
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# stored while the first request with a key is being handled. replaced with the task's ID when it's done.
+IN_PROGRESS = b"in-progress"
+
+
+def idempotency_redis_key(api_key_id: int, idempotency_key: str) -> str:
+    """
+    Returns the redis key of an Idempotency-Key header. Keys are scoped per API key,
+    so clients can't see each other's tasks by reusing a key.
+    """
+    return f"idempotency:{api_key_id}:{idempotency_key}"
+
+async def begin_idempotent_request(connection: redis.asyncio.Redis, key: str) -> int | None:
+    """
+    Claims an idempotency key for the current request.
+    If another request with the same key is in progress, waits up to IDEMPOTENCY_WAIT seconds for it to finish.
+
+    - **connection**: Async redis connection.
+    - **key**: See idempotency_redis_key.
+
+    Returns:
+    int | None: The task ID of the first request with the key. None if the current request
+    claimed the key and must do the work. Then it must call finish_idempotent_request or release_idempotency_key.
+    """
+    loop = asyncio.get_running_loop()
+    give_up_at = loop.time() + IDEMPOTENCY_WAIT
+    try:
+        while True:
+            # the lock expires on its own in case the request's process dies.
+            if await connection.set(key, IN_PROGRESS, nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+                return None
+            value = await connection.get(key)
+            # if the first request failed, its key is gone and the next loop claims it.
+            if value is not None and value != IN_PROGRESS:
+                return int(value)
+            if loop.time() >= give_up_at:
+                raise HTTPException(409, "A request with the same Idempotency-Key is still in progress.")
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+    except redis.RedisError as e:
+        # requests aren't refused because of redis. retries may be duplicated until it's back.
+        logger.warning("idempotency keys are unavailable: %s", e)
+        return None
+
+async def finish_idempotent_request(connection: redis.asyncio.Redis, key: str, task_id: int):
+    """
+    Stores the task ID of a request for IDEMPOTENCY_TTL seconds. Retries with the same key get it.
+    """
+    try:
+        await connection.set(key, task_id, ex=IDEMPOTENCY_TTL)
+    except redis.RedisError as e:
+        logger.warning("idempotency keys are unavailable: %s", e)
+
+async def release_idempotency_key(connection: redis.asyncio.Redis, key: str):
+    """
+    Removes the claim of a failed request, so a retry with the same key is handled again.
+    """
+    try:
+        await connection.delete(key)
+    except redis.RedisError as e:
+        logger.warning("idempotency keys are unavailable: %s", e)
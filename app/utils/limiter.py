@@ -0,0 +1,30 @@
+from fastapi import HTTPException
+
+
+class ConcurrencyLimiter:
+    """
+    A dependency which limits the number of requests being processed at the same time by the
+    path operations that use it. Requests over the limit are rejected right away instead of
+    waiting, so a burst of expensive requests can't pile up and starve the rest of the API.
+
+    The count is per process. Use the same instance in several path operations to share the limit.
+    """
+    def __init__(self, limit: int):
+        """
+        - **limit**: Max number of requests processed at the same time.
+        """
+        self.limit = limit
+        self.active = 0
+
+    async def __call__(self):
+        if self.active >= self.limit:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many concurrent requests. Try another time.",
+                headers={"Retry-After": "1"},
+            )
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
@@ -0,0 +1,103 @@
+from sqlalchemy import select, delete, func, cast, Float
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.database.models import Task, TaskOutbox
+from app.config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL
+
+from contextlib import AbstractContextManager
+from time import sleep
+from typing import Callable
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the ID of a task and the seconds until its deadline, or None.
+Message = tuple[int, float | None]
+
+
+def _seconds_until(db: Session, timestamp: ColumnElement) -> ColumnElement:
+    # computed by the database, since deadlines are set with its clock. now() of postgres has a time zone
+    # and can't be subtracted from the naive deadlines in python.
+    if db.get_bind().dialect.name == "postgresql":
+        return cast(func.extract("epoch", timestamp - func.localtimestamp()), Float)
+    return (func.julianday(timestamp) - func.julianday(func.localtimestamp())) * 86400.0
+
+def relay_outbox(db: Session, publish: Callable[[list[Message]], None], batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """
+    Publishes the oldest tasks in the outbox and removes them from it in a single transaction.
+    Tasks which aren't processing anymore or are past their deadline are removed without being published.
+    Delivery is at least once. Workers skip the tasks they get twice once they're finished.
+
+    - **db**: Database session.
+    - **publish**: Publishes a batch of messages. e.g. app.tasks.publish_classify_tasks
+    - **batch_size**: Max number of tasks to relay.
+
+    Returns:
+    int: Number of outbox rows handled. Less than batch_size means the outbox is empty.
+    """
+    # locked rows are skipped on postgres, so several relays can run.
+    rows = db.execute(select(TaskOutbox.id, TaskOutbox.task_id, Task.state,
+                             _seconds_until(db, Task.deadline).label("timeout"))
+                      .outerjoin(Task, Task.id == TaskOutbox.task_id)
+                      .order_by(TaskOutbox.id)
+                      .limit(batch_size)
+                      .with_for_update(skip_locked=True, of=TaskOutbox)).all()
+    if not rows:
+        db.rollback()
+        return 0
+
+    messages = []
+    for row in rows:
+        # cancelled or deleted meanwhile.
+        if row.state != Task.StateEnum.processing:
+            continue
+        # the reaper cancels it. null without a deadline.
+        if row.timeout is not None and row.timeout <= 0:
+            continue
+        messages.append((row.task_id, row.timeout))
+
+    # the rows are deleted only after publishing. if the commit fails, they are published again.
+    if messages:
+        publish(messages)
+    db.execute(delete(TaskOutbox).filter(TaskOutbox.id.in_([row.id for row in rows])))
+    db.commit()
+    return len(rows)
+
+def run_outbox_relay(session_factory: Callable[[], AbstractContextManager[Session]],
+                     publish: Callable[[list[Message]], None],
+                     batch_size: int = OUTBOX_BATCH_SIZE, poll_interval: int = OUTBOX_POLL_INTERVAL):
+    """
+    Relays the outbox until the process is stopped. Full batches are relayed one after another.
+    Otherwise the outbox is checked every poll_interval milliseconds.
+
+    - **session_factory**: Makes a database session context. e.g. app.database.db.db_session
+    - **publish**: Publishes a batch of messages. e.g. app.tasks.publish_classify_tasks
+    - **batch_size**: Max tasks published per transaction.
+    - **poll_interval**: Milliseconds to wait after finding the outbox empty.
+    """
+    while True:
+        try:
+            with session_factory() as db:
+                relayed = relay_outbox(db, publish, batch_size)
+        except Exception:
+            logger.exception("relaying the outbox failed. retrying in a second")
+            sleep(1)
+            continue
+        if relayed < batch_size:
+            sleep(poll_interval / 1000)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.database.db import db_session
+    from app.tasks import publish_classify_tasks
+
+    parser = argparse.ArgumentParser(description="Publishes new tasks from the outbox to the broker.")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE, help="Max tasks per transaction")
+    parser.add_argument("--poll-interval", type=int, default=OUTBOX_POLL_INTERVAL,
+                        help="Milliseconds between checks of an empty outbox")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_outbox_relay(db_session, publish_classify_tasks, args.batch_size, args.poll_interval)
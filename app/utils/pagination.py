@@ -0,0 +1,135 @@
+from fastapi import HTTPException, Response
+from sqlalchemy import Select, select, func, literal, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from datetime import datetime
+import base64
+import binascii
+import json
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+
+def encode_cursor(values: list) -> str:
+    """
+    Encodes the sort key values of a row as an opaque cursor.
+
+    - **values**: The values of the columns the list is ordered by.
+
+    Returns:
+    str: A url safe cursor.
+    """
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    """
+    Decodes a cursor made by ""encode_cursor"". Raises an HTTP exception if the cursor is invalid.
+
+    - **cursor**: The cursor.
+    - **columns**: The columns the list is ordered by. Used for converting the values back to their types.
+
+    Returns:
+    list: The sort key values.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if len(values) != len(columns):
+            raise ValueError("wrong number of values")
+        return [datetime.fromisoformat(value) if column.type.python_type is datetime else value
+                for column, value in zip(columns, values)]
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def paginate_query(query: Select, columns: list, cursor: str | None, limit: int, descending: bool = False) -> Select:
+    """
+    Orders a query by columns and limits it to the page after the cursor (keyset pagination).
+    Unlike offsets, the cost of fetching a page doesn't depend on how deep the page is.
+    One extra row is fetched to know if there is a next page. Pass the rows to ""page_result"".
+
+    - **query**: The query. It must not be ordered already.
+    - **columns**: The sort key. The last column must be unique. e.g. (Task.created_at, Task.id)
+    - **cursor**: Cursor of the previous page or None for the first page.
+    - **limit**: Page size.
+    - **descending**: Order of the list.
+
+    Returns:
+    Select: The paginated query.
+    """
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    if cursor:
+        # values are bound with the columns' types, so they are stored the same way as the columns.
+        values = [literal(value, type_=column.type) for column, value in zip(columns, decode_cursor(cursor, columns))]
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+    return query.limit(limit + 1)
+
+def page_result(rows: list, columns: list, limit: int) -> tuple[list, str | None]:
+    """
+    Splits the rows of a query made by ""paginate_query"" into a page and the next page's cursor.
+
+    - **rows**: The fetched rows.
+    - **columns**: The sort key passed to ""paginate_query"".
+    - **limit**: The page size passed to ""paginate_query"".
+
+    Returns:
+    tuple[list, str | None]: The page and the cursor of the next page. The cursor is None on the last page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+async def fetch_page(db: AsyncSession, query: Select, columns: list, cursor: str | None, limit: int,
+                     descending: bool = False) -> tuple[list, str | None]:
+    """
+    Fetches a page of ORM objects using keyset pagination. See ""paginate_query"".
+
+    Returns:
+    tuple[list, str | None]: The page and the cursor of the next page. The cursor is None on the last page.
+    """
+    result = await db.execute(paginate_query(query, columns, cursor, limit, descending))
+    return page_result(result.scalars().all(), columns, limit)
+
+async def fetch_page_rows(db: AsyncSession, query: Select, columns: list, cursor: str | None, limit: int,
+                          descending: bool = False) -> tuple[list, str | None]:
+    """
+    Same as ""fetch_page"" for queries selecting columns instead of ORM objects.
+    The sort key columns must be selected too.
+
+    Returns:
+    tuple[list, str | None]: The page of rows and the cursor of the next page. The cursor is None on the last page.
+    """
+    result = await db.execute(paginate_query(query, columns, cursor, limit, descending))
+    return page_result(result.all(), columns, limit)
+
+async def estimate_count(db: AsyncSession, query: Select) -> int:
+    """
+    Returns the approximate number of rows of a query. On postgres this is the planner's
+    estimate so it is cheap on any table size. Other databases fall back to an exact count.
+
+    - **db**: An async database session.
+    - **query**: The query. It must not be paginated.
+
+    Returns:
+    int: Number of rows.
+    """
+    dialect = db.bind.dialect
+    if dialect.name == "postgresql":
+        compiled = query.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+        plan = await db.scalar(text(f"EXPLAIN (FORMAT JSON) {compiled}"))
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return await db.scalar(select(func.count()).select_from(query.subquery()))
+
+def set_page_headers(response: Response, next_cursor: str | None, total: int | None = None):
+    """
+    Sets the pagination headers of a list response.
+    X-Next-Cursor is only set when there is a next page.
+    """
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if total is not None:
+        response.headers[TOTAL_COUNT_HEADER] = str(total)
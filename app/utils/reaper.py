@@ -0,0 +1,67 @@
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.orm import Session
+
+from app.database.models import Task, TASK_IS_PROCESSING
+from app.utils.retention import remove_task_files
+from app.config import STUCK_TASK_TIMEOUT, CLASSIFY_MAX_ATTEMPTS
+
+from datetime import timedelta
+from typing import Callable, Collection
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def reap_stuck_tasks(db: Session, requeue: Callable[[int], None],
+                     timeout: int = STUCK_TASK_TIMEOUT, max_attempts: int = CLASSIFY_MAX_ATTEMPTS,
+                     pending: Collection[int] = ()) -> dict[str, list[int]]:
+    """
+    Finds the processing tasks which haven't been updated for timeout seconds. e.g. their worker was killed
+    or their message was lost. Tasks with attempts left are queued again, the others fail as "stuck".
+    Processing tasks past their deadline are cancelled, whether they are stuck or not. Their messages
+    expire in the queue, so no worker would get to them.
+
+    - **db**: Database session.
+    - **requeue**: Called with the ID of each task to queue again, after the changes are committed.
+    - **timeout**: Seconds since the last update after which a processing task is stuck.
+    - **max_attempts**: Tasks which were started this many times are failed instead of queued again.
+    - **pending**: IDs of tasks whose results are waiting for a result writer. They are left alone.
+      See app.utils.result_writer.get_pending_results.
+
+    Returns:
+    dict[str, list[int]]: IDs of the requeued, failed and expired tasks.
+    """
+    # timestamps are set by the database, so its clock is used. it may not be in the local timezone.
+    now = db.scalar(select(func.localtimestamp()))
+    cutoff = now - timedelta(seconds=timeout)
+    # uses ix_tasks_processing. there are only a few processing tasks at any time.
+    # locked rows are skipped on postgres, so concurrent runs don't handle a task twice.
+    query = (select(Task.id, Task.attempts, Task.filename, Task.deadline)
+             .filter(TASK_IS_PROCESSING, or_(Task.updated_at < cutoff, Task.deadline <= now))
+             .with_for_update(skip_locked=True))
+    if pending:
+        query = query.filter(Task.id.not_in(pending))
+    rows = db.execute(query).all()
+
+    expired_rows = [row for row in rows if row.deadline is not None and row.deadline <= now]
+    expired = [row.id for row in expired_rows]
+    requeued = [row.id for row in rows if row.id not in expired and row.attempts < max_attempts]
+    failed = [row.id for row in rows if row.id not in expired and row.attempts >= max_attempts]
+    if requeued:
+        # the timeout starts over, so the task isn't requeued again before a worker gets to it.
+        db.execute(update(Task).filter(Task.id.in_(requeued)).values(updated_at=func.now()))
+    if failed:
+        db.execute(update(Task).filter(Task.id.in_(failed))
+                   .values(state=Task.StateEnum.failed, error_code=Task.ErrorEnum.stuck, updated_at=func.now()))
+    if expired:
+        db.execute(update(Task).filter(Task.id.in_(expired))
+                   .values(state=Task.StateEnum.cancelled, error_code=Task.ErrorEnum.deadline_exceeded,
+                           filename=None, updated_at=func.now()))
+    db.commit()
+
+    remove_task_files([row.filename for row in expired_rows])
+    for task_id in requeued:
+        requeue(task_id)
+    if requeued or failed:
+        logger.warning("reaped stuck tasks. requeued: %s, failed: %s", requeued, failed)
+    return {"requeued": requeued, "failed": failed, "expired": expired}
@@ -0,0 +1,88 @@
+from fastapi import Depends, Request
+import redis
+
+from app.database import db as database
+from app.data_models.user import UserPrincipal
+from app.utils.auth import get_current_user
+from app.utils.cache import redis_connection, async_redis_connection
+from app.config import READ_YOUR_WRITES_WINDOW
+
+from typing import Annotated
+import logging
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# users who wrote something recently are marked in redis for READ_YOUR_WRITES_WINDOW seconds.
+# their reads go to the primary until then, so they don't miss their own changes because of replication lag.
+# if redis is unavailable, reads go to the primary.
+# only the user who sent the request is marked, not the owners of the rows it changed. e.g. after an admin
+# changes a user's task, that user may read the old task from the replica until it catches up.
+
+
+def _redis_key(user_id: int) -> str:
+    return f"recent-write:{user_id}"
+
+async def mark_recent_write(user_id: int):
+    """
+    Sends the reads of a user to the primary for the next READ_YOUR_WRITES_WINDOW seconds.
+    """
+    if database.replica_engine is None:
+        return
+    try:
+        await async_redis_connection.set(_redis_key(user_id), 1, ex=READ_YOUR_WRITES_WINDOW)
+    except redis.RedisError as e:
+        logger.warning("read-your-writes marks are unavailable: %s", e)
+
+async def has_recent_write(user_id: int) -> bool:
+    try:
+        return bool(await async_redis_connection.exists(_redis_key(user_id)))
+    except redis.RedisError as e:
+        logger.warning("read-your-writes marks are unavailable: %s", e)
+        return True
+
+def has_recent_write_sync(user_id: int) -> bool:
+    try:
+        return bool(redis_connection.exists(_redis_key(user_id)))
+    except redis.RedisError as e:
+        logger.warning("read-your-writes marks are unavailable: %s", e)
+        return True
+
+async def mark_writes(request: Request):
+    """
+    Router dependency which marks the user of every request that may have written something, once the
+    path operation succeeds. Authentication dependencies store the user's id in request.state.
+    Only needed by the routers whose data is read with get_read_db or get_async_read_db.
+    """
+    # a failed path operation raises here and nothing is marked.
+    yield
+    user_id = getattr(request.state, "user_id", None)
+    if request.method not in SAFE_METHODS and user_id is not None:
+        await mark_recent_write(user_id)
+
+
+def get_read_db(current_user: Annotated[UserPrincipal, Depends(get_current_user)]):
+    """
+    Creates and yields a database session for read-only path operations. Queries go to the replica
+    if there is one and the current user hasn't written anything recently. Writes still go to the primary.
+    The session is closed after the caller is done.
+    """
+    info = {}
+    if database.replica_engine is not None and not has_recent_write_sync(current_user.id):
+        info["replica"] = database.replica_engine
+    db = database.ReadSessionLocal(info=info)
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db(current_user: Annotated[UserPrincipal, Depends(get_current_user)]):
+    """
+    Same as ""get_read_db"" for ""async"" path operations.
+    """
+    info = {}
+    if database.replica_async_engine is not None and not await has_recent_write(current_user.id):
+        info["replica"] = database.replica_async_engine.sync_engine
+    async with database.AsyncReadSessionLocal(info=info) as db:
+        yield db
@@ -0,0 +1,275 @@
+from redis import Redis
+from redis.exceptions import ResponseError
+from sqlalchemy import Integer, bindparam, column, func, update, values
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.orm import Session
+
+from app.database.models import Task
+from app.utils.retention import remove_task_files
+from app.utils.task_cache import refresh_cached_tasks_sync
+from app.config import (RESULT_STREAM,
+                        RESULT_WRITER_BATCH_SIZE,
+                        RESULT_WRITER_FLUSH_INTERVAL,
+                        RESULT_WRITER_CLAIM_IDLE)
+
+from contextlib import AbstractContextManager
+from time import monotonic, sleep
+from typing import Callable
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+# workers add the results of classification tasks to RESULT_STREAM. result writers read them as a consumer group,
+# so each result is handled by one writer. an entry is acknowledged after its result is committed.
+# if a writer dies before that, another one claims the entry. a result may be written twice, which changes nothing.
+RESULT_WRITER_GROUP = "result-writers"
+# IDs of the tasks whose results are in the stream but not written yet. the reaper leaves them alone,
+# since they are still processing in the database even though they're done.
+PENDING_RESULTS_KEY = "task-results:pending"
+
+Entry = tuple[bytes, dict[bytes, bytes]]
+
+# errors of a single result, e.g. a result too large for the column. the other results of its batch are
+# written without it. the database being unavailable is an OperationalError and fails the whole batch.
+BAD_RESULT_ERRORS = (DBAPIError, OverflowError)
+
+
+def write_results(db: Session, results: dict[int, int]) -> int:
+    """
+    Stores the results of processing tasks with a single statement and commits once.
+    Tasks which aren't processing anymore (e.g. cancelled or written already) are left alone.
+
+    - **db**: Database session.
+    - **results**: Classification result by task ID.
+
+    Returns:
+    int: Number of updated tasks.
+    """
+    if not results:
+        return 0
+    tasks = Task.__table__
+    # the files are removed after committing. see flush_results.
+    finished = {"state": Task.StateEnum.done, "error_code": None, "filename": None, "updated_at": func.now()}
+    if db.get_bind().dialect.name == "postgresql":
+        # UPDATE tasks SET ... FROM (VALUES (id, result), ...) AS results (id, result) WHERE tasks.id = results.id
+        rows = values(column("id", Integer), column("result", Integer), name="results").data(list(results.items()))
+        statement = (update(tasks)
+                     .where(tasks.c.id == rows.c.id, tasks.c.state == Task.StateEnum.processing)
+                     .values(result=rows.c.result, **finished))
+        updated = db.execute(statement).rowcount
+    else:
+        # sqlite can't name the columns of a VALUES list. an executemany in one transaction is the closest.
+        statement = (update(tasks)
+                     .where(tasks.c.id == bindparam("task_id"), tasks.c.state == Task.StateEnum.processing)
+                     .values(result=bindparam("task_result"), **finished))
+        updated = db.execute(statement, [{"task_id": task_id, "task_result": result}
+                                         for task_id, result in results.items()]).rowcount
+    db.commit()
+    return updated
+
+def push_result(redis: Redis, task_id: int, result: int, duration_ms: float, filename: str | None):
+    """
+    Adds a classification result to the stream read by the result writers.
+    The writer removes the task's file once the result is written.
+
+    - **redis**: Redis connection.
+    - **task_id**: Task's unique identifier.
+    - **result**: Classification result.
+    - **duration_ms**: Time spent classifying, in milliseconds.
+    - **filename**: The task's uploaded image.
+    """
+    with redis.pipeline() as pipe:
+        pipe.sadd(PENDING_RESULTS_KEY, task_id)
+        pipe.xadd(RESULT_STREAM, {"task_id": task_id, "result": result, "duration_ms": round(duration_ms, 1),
+                                  "filename": filename or ""})
+        pipe.execute()
+
+def get_pending_results(redis: Redis) -> set[int]:
+    """
+    Returns the IDs of the tasks whose results are waiting for a result writer.
+    """
+    return {int(task_id) for task_id in redis.smembers(PENDING_RESULTS_KEY)}
+
+def create_result_group(redis: Redis):
+    """
+    Creates the stream and the consumer group of result writers if they don't exist.
+    """
+    try:
+        redis.xgroup_create(RESULT_STREAM, RESULT_WRITER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+def read_results(redis: Redis, consumer: str, batch_size: int = RESULT_WRITER_BATCH_SIZE,
+                 flush_interval: int = RESULT_WRITER_FLUSH_INTERVAL) -> list[Entry]:
+    """
+    Reads new results until batch_size of them arrive or flush_interval milliseconds pass after the first one.
+
+    - **redis**: Redis connection.
+    - **consumer**: Name of this writer in the consumer group.
+    - **batch_size**: Max number of results.
+    - **flush_interval**: Milliseconds to wait for more results after the first one.
+
+    Returns:
+    list[Entry]: Stream entries. Empty if nothing arrived within flush_interval.
+    """
+    entries = []
+    first_at = None
+    while len(entries) < batch_size:
+        block = flush_interval
+        if first_at is not None:
+            block = flush_interval - (monotonic() - first_at) * 1000
+            if block <= 0:
+                break
+        # block=0 would wait forever.
+        response = redis.xreadgroup(RESULT_WRITER_GROUP, consumer, {RESULT_STREAM: ">"},
+                                    count=batch_size - len(entries), block=max(int(block), 1))
+        if response:
+            first_at = first_at or monotonic()
+            entries.extend(response[0][1])
+        elif first_at is None:
+            break
+    return entries
+
+def claim_stale_results(redis: Redis, consumer: str, min_idle: int = RESULT_WRITER_CLAIM_IDLE,
+                        count: int = RESULT_WRITER_BATCH_SIZE) -> list[Entry]:
+    """
+    Takes over the results which were read but not acknowledged for min_idle milliseconds.
+    e.g. their writer died or couldn't reach the database.
+
+    Returns:
+    list[Entry]: Claimed stream entries. At most count of them.
+    """
+    _, entries, *_ = redis.xautoclaim(RESULT_STREAM, RESULT_WRITER_GROUP, consumer, min_idle, "0-0", count=count)
+    # entries deleted from the stream meanwhile come back as None.
+    return [entry for entry in entries if entry and entry[1]]
+
+def drop_results(redis: Redis, entries: list[Entry], error: Exception):
+    """
+    Logs and acknowledges entries whose result can't be written, so they don't fail their batch again.
+    Their tasks aren't pending anymore, so the reaper requeues or fails them.
+
+    - **redis**: Redis connection.
+    - **entries**: The bad stream entries.
+    - **error**: Why they can't be written.
+    """
+    logger.error("dropping %s result entries which can't be written: %s. entries: %s", len(entries), error, entries)
+    entry_ids = [entry_id for entry_id, _ in entries]
+    redis.xack(RESULT_STREAM, RESULT_WRITER_GROUP, *entry_ids)
+    redis.xdel(RESULT_STREAM, *entry_ids)
+    task_ids = [int(fields[b"task_id"]) for _, fields in entries if fields.get(b"task_id", b"").isdigit()]
+    if task_ids:
+        redis.srem(PENDING_RESULTS_KEY, *task_ids)
+
+def _write_each_result(redis: Redis, db: Session, results: dict[int, int], entries: list[Entry]) -> int:
+    # finds the bad results of a batch which failed to be written, one transaction per result.
+    updated = 0
+    for task_id, result in list(results.items()):
+        try:
+            updated += write_results(db, {task_id: result})
+        except OperationalError:
+            raise
+        except BAD_RESULT_ERRORS as e:
+            db.rollback()
+            del results[task_id]
+            drop_results(redis, [(entry_id, fields) for entry_id, fields in entries
+                                 if int(fields[b"task_id"]) == task_id], e)
+    return updated
+
+def flush_results(redis: Redis, db: Session, entries: list[Entry]) -> int:
+    """
+    Writes the results of the entries and acknowledges them.
+    Entries which can't be parsed or written are dropped. See drop_results.
+
+    Returns:
+    int: Number of updated tasks.
+    """
+    if not entries:
+        return 0
+    # a result delivered twice in the same batch is written once.
+    results = {}
+    parsed = []
+    for entry_id, fields in entries:
+        try:
+            results[int(fields[b"task_id"])] = int(fields[b"result"])
+        except (KeyError, ValueError) as e:
+            drop_results(redis, [(entry_id, fields)], e)
+            continue
+        parsed.append((entry_id, fields))
+    entries = parsed
+    if not entries:
+        return 0
+
+    try:
+        updated = write_results(db, results)
+    except OperationalError:
+        raise
+    except BAD_RESULT_ERRORS:
+        db.rollback()
+        updated = _write_each_result(redis, db, results, entries)
+        entries = [(entry_id, fields) for entry_id, fields in entries if int(fields[b"task_id"]) in results]
+        if not entries:
+            return updated
+    refresh_cached_tasks_sync(db, redis, list(results))
+    # removed only after the commit. until then the task may be reaped and run again.
+    remove_task_files([fields[b"filename"].decode() or None for _, fields in entries if b"filename" in fields])
+    # acknowledged only after the commit. if the writer dies in between, they are written again.
+    entry_ids = [entry_id for entry_id, _ in entries]
+    redis.xack(RESULT_STREAM, RESULT_WRITER_GROUP, *entry_ids)
+    redis.xdel(RESULT_STREAM, *entry_ids)
+    redis.srem(PENDING_RESULTS_KEY, *results)
+
+    durations = [float(fields.get(b"duration_ms", 0)) for _, fields in entries]
+    logger.info("wrote %s results of %s entries. mean classification time: %.1f ms",
+                updated, len(entries), sum(durations) / len(durations))
+    return updated
+
+def run_result_writer(redis: Redis, session_factory: Callable[[], AbstractContextManager[Session]],
+                      consumer: str | None = None, batch_size: int = RESULT_WRITER_BATCH_SIZE,
+                      flush_interval: int = RESULT_WRITER_FLUSH_INTERVAL, claim_idle: int = RESULT_WRITER_CLAIM_IDLE):
+    """
+    Writes results from the stream to the database until the process is stopped.
+    Entries which fail to be written, e.g. while the database is down, stay pending and are claimed again
+    after claim_idle milliseconds. Entries which can't ever be written are dropped. See drop_results.
+
+    - **redis**: Redis connection.
+    - **session_factory**: Makes a database session context. e.g. app.database.db.db_session
+    - **consumer**: Name of this writer. Defaults to host name and process ID.
+    - **batch_size**: Max results written per transaction.
+    - **flush_interval**: Max milliseconds a result waits for its batch to fill up.
+    - **claim_idle**: Milliseconds after which unacknowledged results of other writers are taken over.
+    """
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    create_result_group(redis)
+    last_claim = None
+    while True:
+        try:
+            if last_claim is None or monotonic() - last_claim > claim_idle / 1000:
+                last_claim = monotonic()
+                entries = claim_stale_results(redis, consumer, claim_idle, batch_size)
+            else:
+                entries = read_results(redis, consumer, batch_size, flush_interval)
+            if entries:
+                with session_factory() as db:
+                    flush_results(redis, db, entries)
+        except Exception:
+            logger.exception("writing results failed. retrying in a second")
+            sleep(1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.database.db import db_session
+    from app.utils.cache import redis_connection
+
+    parser = argparse.ArgumentParser(description="Writes classification results to the database in batches.")
+    parser.add_argument("--consumer", default=None, help="Name of this writer. Must be unique among running writers")
+    parser.add_argument("--batch-size", type=int, default=RESULT_WRITER_BATCH_SIZE, help="Max results per transaction")
+    parser.add_argument("--flush-interval", type=int, default=RESULT_WRITER_FLUSH_INTERVAL,
+                        help="Max milliseconds a result waits for its batch")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_result_writer(redis_connection, db_session, args.consumer, args.batch_size, args.flush_interval)
@@ -0,0 +1,122 @@
+from sqlalchemy import select, insert, delete, null
+from sqlalchemy.orm import Session
+
+from app.database.models import Task, TaskArchive
+from app.utils.cache import redis_connection
+from app.utils.task_cache import uncache_tasks_sync
+from app.config import (TASK_RETENTION_DAYS,
+                        TASK_RETENTION_MODE,
+                        TASK_RETENTION_BATCH_SIZE)
+
+from datetime import datetime, timedelta
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+RETENTION_MODES = ("archive", "delete")
+
+ARCHIVED_COLUMNS = ["id", "filename", "api_key_id", "user_id", "state", "created_at", "updated_at", "result", "error_code"]
+
+
+def get_retention_cutoffs(now: datetime) -> dict[Task.StateEnum, datetime]:
+    """
+    Returns the creation time before which tasks of each state are expired.
+    States without a retention period are left out.
+
+    - **now**: The current time.
+
+    Returns:
+    dict[Task.StateEnum, datetime]: Cutoff times by task state.
+    """
+    return {Task.StateEnum(state): now - timedelta(days=days)
+            for state, days in TASK_RETENTION_DAYS.items() if days > 0}
+
+def remove_task_files(filenames: list[str]):
+    """
+    Removes the uploaded files of tasks. Finished tasks' files are usually removed by the worker already.
+    Tasks whose file was removed have no filename and are skipped.
+    """
+    for filename in filenames:
+        if filename is None:
+            continue
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("could not remove %s: %s", filename, e)
+
+def expire_tasks_batch(db: Session, state: Task.StateEnum, cutoff: datetime,
+                       mode: str = TASK_RETENTION_MODE, batch_size: int = TASK_RETENTION_BATCH_SIZE) -> int:
+    """
+    Archives or deletes the oldest tasks of a state created before cutoff in a single transaction.
+
+    - **db**: Database session.
+    - **state**: State of the tasks to expire.
+    - **cutoff**: Tasks created before this are expired.
+    - **mode**: "archive" or "delete".
+    - **batch_size**: Max number of tasks to expire.
+
+    Returns:
+    int: Number of expired tasks. Less than batch_size means there are no more to expire.
+    """
+    if mode not in RETENTION_MODES:
+        raise ValueError(f"unknown retention mode: {mode}")
+
+    # oldest first so the scan uses ix_tasks_created_at_id and stops at the cutoff.
+    # locked rows are skipped on postgres, so concurrent runs don't block each other.
+    rows = db.execute(select(Task.id, Task.user_id, Task.filename)
+                      .where(Task.state == state, Task.created_at < cutoff)
+                      .order_by(Task.created_at, Task.id)
+                      .limit(batch_size)
+                      .with_for_update(skip_locked=True)).all()
+    if not rows:
+        db.rollback()
+        return 0
+
+    ids = [row.id for row in rows]
+    if mode == "archive":
+        # the files are removed below.
+        columns = [null() if name == "filename" else Task.__table__.c[name] for name in ARCHIVED_COLUMNS]
+        db.execute(insert(TaskArchive).from_select(ARCHIVED_COLUMNS,
+                                                   select(*columns).where(Task.id.in_(ids))))
+    db.execute(delete(Task).where(Task.id.in_(ids)).execution_options(synchronize_session=False))
+    db.commit()
+
+    uncache_tasks_sync(redis_connection, rows)
+    remove_task_files([row.filename for row in rows])
+    return len(rows)
+
+def apply_task_retention(db: Session, now: datetime | None = None,
+                         mode: str = TASK_RETENTION_MODE, batch_size: int = TASK_RETENTION_BATCH_SIZE,
+                         max_batches: int | None = None) -> dict[str, int]:
+    """
+    Expires tasks older than the retention period of their state. Tasks are removed in batches
+    with a commit after each one, so locks are short and the work done so far survives a failure.
+    Processing tasks are never expired.
+
+    - **db**: Database session.
+    - **now**: The current time. Defaults to now.
+    - **mode**: "archive" or "delete".
+    - **batch_size**: Tasks removed per transaction.
+    - **max_batches**: Stops after this many batches per state. The rest is left for the next run.
+
+    Returns:
+    dict[str, int]: Number of expired tasks by state.
+    """
+    now = now or datetime.now()
+    expired = {}
+    for state, cutoff in get_retention_cutoffs(now).items():
+        if state == Task.StateEnum.processing:
+            continue
+        expired[state.value] = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            count = expire_tasks_batch(db, state, cutoff, mode, batch_size)
+            expired[state.value] += count
+            batches += 1
+            if count < batch_size:
+                break
+    logger.info("task retention %s: %s", mode, expired)
+    return expired
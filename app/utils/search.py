@@ -0,0 +1,53 @@
+from sqlalchemy import func, or_, and_, bindparam
+from sqlalchemy.sql.elements import ColumnElement
+
+from typing import Literal
+
+# trigrams of shorter searches match too many rows to be selective. they are searched by prefix.
+MIN_SUBSTRING_SEARCH_LENGTH = 3
+
+SearchMode = Literal["prefix", "contains"]
+
+
+def escape_like(text: str) -> str:
+    """
+    Escapes the wildcards of LIKE patterns with a backslash.
+    """
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # the smallest string larger than all the strings starting with prefix.
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _lower_ascii(text: str) -> str:
+    # like sqlite's lower(). other letters are left as they are.
+    return "".join(char.lower() if char.isascii() else char for char in text)
+
+def search_filter(columns: list[ColumnElement], search: str, mode: SearchMode, dialect: str) -> ColumnElement:
+    """
+    Returns a case-insensitive filter matching rows where any of the columns starts with or contains
+    the search text. Each column needs the indexes on lower(column) of app.database.models.User.
+
+    On postgres, prefixes are matched with LIKE on the text_pattern_ops indexes and substrings
+    with LIKE on the trigram indexes. Other databases match substrings by prefix, with a range scan
+    on the lower(column) indexes. There, lower() only changes ASCII letters, so other letters must match
+    the case of the column.
+
+    - **columns**: The columns to search.
+    - **search**: The text to search for. It must not be empty.
+    - **mode**: "prefix" or "contains".
+    - **dialect**: Name of the database's dialect. e.g. db.bind.dialect.name
+    """
+    if dialect == "postgresql":
+        search = search.lower()
+        pattern = escape_like(search) + "%"
+        if mode == "contains" and len(search) >= MIN_SUBSTRING_SEARCH_LENGTH:
+            pattern = "%" + pattern
+        # rendered as a literal, so the planner sees a prefix and uses the indexes even with a cached plan.
+        pattern = bindparam(None, pattern, literal_execute=True)
+        return or_(*[func.lower(column).like(pattern, escape="\\") for column in columns])
+
+    # sqlite only uses indexes for LIKE on columns with NOCASE collation. a range works with any index.
+    search = _lower_ascii(search)
+    upper = _prefix_upper_bound(search)
+    return or_(*[and_(func.lower(column) >= search, func.lower(column) < upper) for column in columns])
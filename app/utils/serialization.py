@@ -0,0 +1,32 @@
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+from typing import Iterable, Mapping
+
+
+# list routes select the columns of their response model as plain rows and encode them with orjson.
+# rows aren't loaded as ORM objects and aren't validated by the response model one by one.
+# orjson encodes enums by value and datetimes in iso format, the same as the response models.
+
+
+def model_columns(model: type[BaseModel], entity) -> list:
+    """
+    Returns the columns of an ORM class with the names of a model's fields, in the same order.
+
+    - **model**: A pydantic model whose fields are all columns of entity. e.g. TaskInline
+    - **entity**: An ORM class. e.g. Task
+    """
+    return [getattr(entity, name) for name in model.model_fields]
+
+def rows_response(rows: Iterable, model: type[BaseModel], headers: Mapping[str, str] | None = None,
+                  status_code: int = 200) -> ORJSONResponse:
+    """
+    Encodes rows as a JSON list of objects with the fields of a model.
+
+    - **rows**: Rows whose first columns are ""model_columns"" of the model. Columns after them
+      (e.g. the sort key) are left out.
+    - **model**: The response model of the route.
+    - **headers**: Extra response headers. e.g. the pagination headers.
+    """
+    fields = list(model.model_fields)
+    return ORJSONResponse([dict(zip(fields, row)) for row in rows], status_code=status_code, headers=headers)
@@ -0,0 +1,39 @@
+from sqlalchemy import select, insert, delete, func
+from sqlalchemy.orm import Session
+
+from app.database.models import Task, TaskStat
+
+from datetime import date, datetime, time, timedelta
+
+STAT_COLUMNS = ["day", "user_id", "api_key_id", "result", "state", "count"]
+
+
+def refresh_task_stats(db: Session, since: date, until: date | None = None) -> int:
+    """
+    Rebuilds the daily task stats of the given days from the tasks table in a single transaction.
+    Only the tasks created in those days are read, using ix_tasks_created_at_id, so the cost depends
+    on the daily volume and not the size of the table.
+
+    Days whose tasks were expired by retention must not be refreshed, or their stats are lost.
+
+    - **db**: Database session.
+    - **since**: The first day to rebuild.
+    - **until**: The last day to rebuild. Defaults to today.
+
+    Returns:
+    int: Number of stat rows written.
+    """
+    until = until or date.today()
+    start = datetime.combine(since, time.min)
+    end = datetime.combine(until + timedelta(days=1), time.min)
+
+    day = func.date(Task.created_at)
+    result = func.coalesce(Task.result, -1)
+    query = (select(day, Task.user_id, Task.api_key_id, result, Task.state, func.count())
+             .where(Task.created_at >= start, Task.created_at < end)
+             .group_by(day, Task.user_id, Task.api_key_id, result, Task.state))
+
+    db.execute(delete(TaskStat).where(TaskStat.day >= since, TaskStat.day <= until))
+    written = db.execute(insert(TaskStat).from_select(STAT_COLUMNS, query)).rowcount
+    db.commit()
+    return written
@@ -0,0 +1,113 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+import redis
+import redis.asyncio
+
+from app.database.models import Task
+from app.data_models import task as task_dm
+from app.config import TASK_CACHE_TTL
+
+from typing import Iterable
+import logging
+
+logger = logging.getLogger(__name__)
+
+# the status of a task is cached in redis, so polls of GET /my-tasks/{task_id} don't query the database.
+# it's written whenever a worker, the reaper or cancellation changes the task, and when the task is read
+# on a miss unless it was written meanwhile. deleting or expiring tasks removes them.
+# the owner's id is part of the key, so users can't read each other's tasks from the cache.
+# bulk changes that don't update it are visible after TASK_CACHE_TTL seconds at most.
+
+CACHED_COLUMNS = [Task.id, Task.user_id, Task.state, Task.result, Task.error_code, Task.created_at, Task.updated_at]
+
+
+def _redis_key(user_id: int, task_id: int) -> str:
+    return f"task:{user_id}:{task_id}"
+
+async def get_cached_task(connection: redis.asyncio.Redis, user_id: int, task_id: int) -> task_dm.Task | None:
+    """
+    Returns the cached status of a task of a user or None on a miss.
+    """
+    try:
+        value = await connection.get(_redis_key(user_id, task_id))
+    except redis.RedisError as e:
+        logger.warning("task cache is unavailable: %s", e)
+        return None
+    return task_dm.Task.model_validate_json(value) if value is not None else None
+
+async def cache_task(connection: redis.asyncio.Redis, task, if_missing: bool = False):
+    """
+    Caches the status of a task for TASK_CACHE_TTL seconds.
+
+    - **task**: A Task or a row with the columns of CACHED_COLUMNS.
+    - **if_missing**: Only cache it if it isn't cached. Set it when caching a task read on a miss,
+      so a newer status cached by whoever changed the task meanwhile isn't replaced with the one read.
+    """
+    try:
+        await connection.set(_redis_key(task.user_id, task.id),
+                             task_dm.Task.model_validate(task).model_dump_json(), nx=if_missing, ex=TASK_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning("task cache is unavailable: %s", e)
+
+def cache_tasks_sync(connection: redis.Redis, tasks: Iterable):
+    """
+    Same as ""cache_task"" for many tasks, for workers and sync code.
+    """
+    try:
+        with connection.pipeline(transaction=False) as pipe:
+            for task in tasks:
+                pipe.set(_redis_key(task.user_id, task.id),
+                         task_dm.Task.model_validate(task).model_dump_json(), ex=TASK_CACHE_TTL)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("task cache is unavailable: %s", e)
+
+def refresh_cached_tasks_sync(db: Session, connection: redis.Redis, task_ids: list[int]):
+    """
+    Caches the current status of changed tasks. Call it after committing the changes.
+
+    - **db**: Database session.
+    - **connection**: Redis connection.
+    - **task_ids**: IDs of the changed tasks. Deleted ones are skipped.
+    """
+    if not task_ids:
+        return
+    cache_tasks_sync(connection, db.execute(select(*CACHED_COLUMNS).filter(Task.id.in_(task_ids))).all())
+
+async def refresh_cached_tasks(db: AsyncSession, connection: redis.asyncio.Redis, task_ids: list[int]):
+    """
+    Same as ""refresh_cached_tasks_sync"" for async sessions.
+    """
+    if not task_ids:
+        return
+    for task in (await db.execute(select(*CACHED_COLUMNS).filter(Task.id.in_(task_ids)))).all():
+        await cache_task(connection, task)
+
+async def uncache_tasks(connection: redis.asyncio.Redis, tasks: Iterable):
+    """
+    Removes deleted tasks from the cache.
+
+    - **tasks**: Tasks or rows with id and user_id.
+    """
+    keys = [_redis_key(task.user_id, task.id) for task in tasks]
+    if not keys:
+        return
+    try:
+        await connection.delete(*keys)
+    except redis.RedisError as e:
+        logger.warning("task cache is unavailable: %s", e)
+
+def uncache_tasks_sync(connection: redis.Redis, tasks: Iterable):
+    """
+    Removes deleted tasks from the cache. For workers and sync routes.
+
+    - **tasks**: Tasks or rows with id and user_id.
+    """
+    keys = [_redis_key(task.user_id, task.id) for task in tasks]
+    if not keys:
+        return
+    try:
+        connection.delete(*keys)
+    except redis.RedisError as e:
+        logger.warning("task cache is unavailable: %s", e)
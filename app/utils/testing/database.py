@@ -1,7 +1,14 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, DateTime, TypeDecorator
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import functions
+from unittest.mock import patch
 
-from app.config import SQLALCHEMY_TEST_DATABASE_URL
+from app.config import SQLALCHEMY_TEST_DATABASE_URL, SQLALCHEMY_TEST_REPLICA_DATABASE_URL
+from app.database.db import get_async_url, enable_sqlite_foreign_keys
+
+from datetime import timezone
 
 # import os
 
@@ -18,10 +25,41 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# test client runs every request in a new event loop. pooled connections can't be shared between them.
+async_engine = create_async_engine(
+    get_async_url(SQLALCHEMY_TEST_DATABASE_URL), poolclass=NullPool
+)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+enable_sqlite_foreign_keys(engine)
+enable_sqlite_foreign_keys(async_engine.sync_engine)
+
+# nothing replicates to it. tests write to it directly to tell which database a query went to.
+replica_engine = create_engine(SQLALCHEMY_TEST_REPLICA_DATABASE_URL)
+
 # Dependency
 def get_test_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_test_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+class _AwareDateTime(TypeDecorator):
+    impl = DateTime
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        # CURRENT_TIMESTAMP of sqlite is in UTC.
+        return value.replace(tzinfo=timezone.utc) if value else value
+
+def postgres_now():
+    """
+    Makes now() return timestamps with a time zone, like postgres does, instead of the naive ones of sqlite.
+    Use it as a context manager or decorator.
+    """
+    return patch.object(functions.now, "type", _AwareDateTime())
@@ -0,0 +1,39 @@
+from sqlalchemy import event
+
+from contextlib import contextmanager
+
+
+@contextmanager
+def capture_statements(*engines):
+    """
+    Collects the sql statements executed by the engines inside the with block.
+    Works with both sync and async engines.
+
+    Returns:
+    list[tuple[str, tuple]]: statements and their parameters in the order they were executed.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    sync_engines = [getattr(engine, "sync_engine", engine) for engine in engines]
+    for engine in sync_engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in sync_engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+def explain_query_plan(connection, statement: str, parameters) -> str:
+    """
+    Returns sqlite's query plan of a statement as text. e.g.
+    "SEARCH tasks USING INDEX ix_tasks_user_id_created_at_id (user_id=?)"
+
+    - **connection**: A connection to the sqlite database.
+    - **statement**: The statement as executed by the driver.
+    - **parameters**: The statement's parameters.
+    """
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    return "\n".join(row[-1] for row in rows)
@@ -0,0 +1,147 @@
+from redis.exceptions import ResponseError
+
+
+def _text(key) -> str:
+    # redis accepts keys as str or bytes and returns them as bytes.
+    return key.decode() if isinstance(key, bytes) else key
+
+class FakeAsyncRedis:
+    """
+    Implements the few redis commands of key-value caches, e.g. idempotency keys and cached tasks,
+    and of usage counters. Strings are in data, hashes in hashes and sets in sets.
+    """
+    def __init__(self):
+        self.data = {}
+        self.hashes = {}
+        self.sets = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def hincrby(self, key, field, amount=1):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+        return fields[field]
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(members)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """
+    Queues the commands of FakeAsyncRedis and runs them on execute.
+    """
+    def __init__(self, redis: FakeAsyncRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        return lambda *args, **kwargs: self.commands.append((command, args, kwargs))
+
+    async def execute(self):
+        results = [await command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.commands = []
+
+
+class FakeRedis:
+    """
+    Implements the redis commands of usage counters and their flush, and of removing cached tasks.
+    Strings are in data, hashes in hashes and sets in sets.
+    """
+    def __init__(self):
+        self.data = {}
+        self.hashes = {}
+        self.sets = {}
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def exists(self, *keys):
+        return sum(key in self.hashes or key in self.sets for key in keys)
+
+    def rename(self, source, destination):
+        if source not in self.sets:
+            raise ResponseError("no such key")
+        self.sets[destination] = self.sets.pop(source)
+
+    def hincrby(self, key, field, amount=1):
+        fields = self.hashes.setdefault(_text(key), {})
+        fields[field] = fields.get(field, 0) + amount
+        return fields[field]
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(_text(key), {})[field] = value
+
+    def hgetall(self, key):
+        # like redis without decode_responses.
+        return {field.encode(): str(value).encode() for field, value in self.hashes.get(_text(key), {}).items()}
+
+    def expire(self, key, seconds):
+        return True
+
+    def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(member.encode() if isinstance(member, str) else member
+                                                for member in members)
+
+    def srandmember(self, key, count):
+        return list(self.sets.get(key, set()))[:count]
+
+    def srem(self, key, *members):
+        self.sets.get(key, set()).difference_update(members)
+        if not self.sets.get(key):
+            self.sets.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakeSyncPipeline(self)
+
+
+class FakeSyncPipeline:
+    """
+    Queues the commands of FakeRedis and runs them on execute.
+    """
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        return lambda *args, **kwargs: self.commands.append((command, args, kwargs))
+
+    def execute(self):
+        results = [command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.commands = []
@@ -0,0 +1,73 @@
+"""
+Compares the cost per row of the two ways list routes can load and encode tasks.
+
+- orm: ORM objects validated by the response model and encoded like FastAPI does by default.
+- rows: the columns of the response model as plain rows, encoded with orjson. See app.utils.serialization.
+
+Run it with python -m app.utils.testing.serialization_benchmark
+"""
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from app.database.db import Base
+from app.database.models import Task
+from app.data_models.task import TaskInline
+from app.utils.serialization import model_columns, rows_response
+
+from time import perf_counter
+from typing import Callable, List
+import argparse
+
+
+def orm_path(db: Session) -> bytes:
+    tasks = db.scalars(select(Task).order_by(Task.id)).all()
+    adapter = TypeAdapter(List[TaskInline])
+    # what FastAPI does with response_model and the default response class.
+    content = adapter.dump_python(adapter.validate_python(tasks, from_attributes=True), mode="json")
+    return JSONResponse(content).body
+
+def rows_path(db: Session) -> bytes:
+    rows = db.execute(select(*model_columns(TaskInline, Task)).order_by(Task.id)).all()
+    return rows_response(rows, TaskInline).body
+
+def measure(path: Callable[[Session], bytes], session_factory: Callable[[], Session], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        # a new session each time, so no ORM object is reused from the identity map.
+        with session_factory() as db:
+            started = perf_counter()
+            path(db)
+            elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the serialization of task lists.")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of tasks in the list")
+    parser.add_argument("--repeat", type=int, default=5, help="The best of this many runs is reported")
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as db:
+        db.execute(insert(Task), [{"filename": "none", "api_key_id": 1, "user_id": 1,
+                                   "state": Task.StateEnum.done, "result": i % 10} for i in range(args.rows)])
+        db.commit()
+
+    def session_factory():
+        return Session(engine)
+
+    with session_factory() as db:
+        if orm_path(db) != rows_path(db):
+            raise SystemExit("the two paths send different responses")
+
+    results = {name: measure(path, session_factory, args.repeat)
+               for name, path in (("orm", orm_path), ("rows", rows_path))}
+    print(f"{args.rows} rows, best of {args.repeat}")
+    for name, elapsed in results.items():
+        print(f"{name:>5}: {elapsed * 1000:8.1f} ms total, {elapsed / args.rows * 1e6:6.2f} us per row")
+    print(f"speedup: {results['orm'] / results['rows']:.1f}x")
@@ -0,0 +1,114 @@
+"""
+Measures the sustained classify throughput of the embedded sqlite profile. See app.database.sqlite.
+
+The api process creates tasks like POST /classify does (a task and its outbox row in one transaction)
+from many concurrent requests, while worker processes write results like classify_task does.
+The model and the broker are left out, so only the database is measured.
+Writes which fail with "database is locked" are counted instead of retried.
+
+Run it with SQLALCHEMY_DATABASE_URL=sqlite:///./sql_benchmark.db python -m app.utils.testing.sqlite_benchmark
+"""
+from sqlalchemy import insert, select
+from sqlalchemy.exc import OperationalError
+
+from app.database import db as database
+from app.database.models import User, APIKey, Task, TaskOutbox
+from app.utils.result_writer import write_results
+
+from multiprocessing import get_context
+from time import perf_counter
+import argparse
+import asyncio
+
+
+def is_locked(error: OperationalError) -> bool:
+    return "database is locked" in str(error.orig)
+
+async def create_tasks(stop_at: float, latencies: list[float], errors: list[int]):
+    # one simulated client sending requests back to back.
+    while perf_counter() < stop_at:
+        started = perf_counter()
+        try:
+            async with database.AsyncSessionLocal() as db:
+                task = Task(user_id=1, api_key_id=1, filename="none")
+                db.add(task)
+                await db.flush()
+                db.add(TaskOutbox(task_id=task.id))
+                await db.commit()
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            errors[0] += 1
+            continue
+        latencies.append(perf_counter() - started)
+
+async def run_api(clients: int, seconds: float) -> tuple[list[float], int]:
+    stop_at = perf_counter() + seconds
+    latencies, errors = [], [0]
+    await asyncio.gather(*(create_tasks(stop_at, latencies, errors) for _ in range(clients)))
+    await database.async_engine.dispose()
+    if database.reader_async_engine is not None:
+        await database.reader_async_engine.dispose()
+    return latencies, errors[0]
+
+def run_worker(worker: int, workers: int, seconds: float, batch: int, results):
+    # workers split the tasks by id so they don't write the same ones.
+    written, errors = 0, 0
+    stop_at = perf_counter() + seconds
+    while perf_counter() < stop_at:
+        try:
+            with database.db_session() as db:
+                ids = db.scalars(select(Task.id)
+                                 .filter(Task.state == Task.StateEnum.processing, Task.id % workers == worker)
+                                 .order_by(Task.id).limit(batch)).all()
+                written += write_results(db, {task_id: task_id % 10 for task_id in ids})
+        except OperationalError as e:
+            if not is_locked(e):
+                raise
+            errors += 1
+    results.put((written, errors))
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks classify throughput on the sqlite profile.")
+    parser.add_argument("--seconds", type=float, default=10, help="How long tasks are created and written")
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent requests in the api process")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes writing results")
+    parser.add_argument("--batch", type=int, default=1, help="Results written per transaction by a worker")
+    args = parser.parse_args()
+
+    if not database.SQLITE_PROFILE:
+        raise SystemExit("SQLALCHEMY_DATABASE_URL must be a sqlite file")
+
+    database.Base.metadata.drop_all(bind=database.engine)
+    database.Base.metadata.create_all(bind=database.engine)
+    with database.db_session() as db:
+        db.execute(insert(User), [{"id": 1, "username": "bench", "email": "bench@example.com",
+                                   "hashed_password": "none"}])
+        db.execute(insert(APIKey), [{"id": 1, "key": "bench", "owner_id": 1}])
+        db.commit()
+    database.engine.dispose()
+
+    # spawned, so every worker opens its own connections like a celery worker does.
+    context = get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=run_worker, args=(i, args.workers, args.seconds, args.batch, results))
+               for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    latencies, api_errors = asyncio.run(run_api(args.clients, args.seconds))
+    worker_results = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    written = sum(result[0] for result in worker_results)
+    worker_errors = sum(result[1] for result in worker_results)
+    print(f"{args.seconds:g} s, {args.clients} clients, {args.workers} workers, {args.batch} results per write")
+    print(f"created: {len(latencies) / args.seconds:8.1f} tasks/s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"written: {written / args.seconds:8.1f} tasks/s")
+    print(f"database is locked: {api_errors} in the api, {worker_errors} in the workers")
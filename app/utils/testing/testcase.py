@@ -1,9 +1,11 @@
 from unittest import TestCase
 from sqlalchemy.orm import Session
 
-from app.database.db import get_db, Base
-from app.utils.testing.database import engine
+from app.database.db import get_db, get_async_db, Base
+from app.utils.testing.database import engine, get_async_test_db
 from app.routes.classify import ip_rate_limiter, api_key_rate_limiter
+from app.utils.auth import api_key_cache, user_cache
+from app.utils.replica import get_read_db, get_async_read_db
 
 async def empty_rate_limiter():
     return
@@ -22,6 +24,9 @@ class MyTestCase(TestCase):
         cls.setTestData() # cls.app must be set here.
         cls.db = Session(bind=cls.connection)
         cls.app.dependency_overrides[get_db] = lambda: cls.db
+        cls.app.dependency_overrides[get_async_db] = get_async_test_db
+        cls.app.dependency_overrides[get_read_db] = lambda: cls.db
+        cls.app.dependency_overrides[get_async_read_db] = get_async_test_db
         cls.app.dependency_overrides[ip_rate_limiter] = empty_rate_limiter
         cls.app.dependency_overrides[api_key_rate_limiter] = empty_rate_limiter
     
@@ -38,4 +43,13 @@ class MyTestCase(TestCase):
         self.transaction = self.connection.begin()
 
     def tearDown(self):
-        self.transaction.rollback()
\ No newline at end of file
+        self.transaction.rollback()
+        self.db.expunge_all()
+        api_key_cache.local.clear()
+        user_cache.local.clear()
+
+        # async sessions commit on their own connections so their changes can't be rolled back.
+        # the test data is rebuilt instead.
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        self.setTestData()
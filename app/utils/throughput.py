@@ -0,0 +1,48 @@
+from redis import Redis
+import redis
+import redis.asyncio
+
+from app.config import THROUGHPUT_KEY, THROUGHPUT_WINDOW
+
+from time import time
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# workers add the time each image was classified to a sorted set. the throughput is
+# the number of images classified in the last THROUGHPUT_WINDOW seconds divided by the window.
+
+
+def record_completion(connection: Redis, task_id: int):
+    """
+    Records that a worker finished classifying an image. Older records are removed.
+    Redis errors are logged and ignored, since the task itself is done.
+
+    - **connection**: Redis connection.
+    - **task_id**: Task's unique identifier.
+    """
+    now = time()
+    try:
+        with connection.pipeline(transaction=False) as pipe:
+            # a task may be classified twice, e.g. when the reaper requeues it. both count.
+            pipe.zadd(THROUGHPUT_KEY, {f"{task_id}:{uuid.uuid4().hex}": now})
+            pipe.zremrangebyscore(THROUGHPUT_KEY, "-inf", now - THROUGHPUT_WINDOW)
+            pipe.expire(THROUGHPUT_KEY, THROUGHPUT_WINDOW)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("throughput can't be recorded: %s", e)
+
+async def get_throughput(connection: redis.asyncio.Redis) -> float | None:
+    """
+    Returns the images classified per second in the last THROUGHPUT_WINDOW seconds.
+    None if nothing was classified in the window or redis is unavailable.
+    """
+    try:
+        completions = await connection.zcount(THROUGHPUT_KEY, time() - THROUGHPUT_WINDOW, "+inf")
+    except redis.RedisError as e:
+        logger.warning("throughput is unavailable: %s", e)
+        return None
+    if not completions:
+        return None
+    return completions / THROUGHPUT_WINDOW
@@ -0,0 +1,171 @@
+from fastapi import HTTPException
+from redis import Redis
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+import redis
+import redis.asyncio
+
+from app.database.models import Usage
+from app.config import (USAGE_DAILY_QUOTA,
+                        USAGE_MONTHLY_QUOTA,
+                        USAGE_DAY_TTL,
+                        USAGE_MONTH_TTL,
+                        USAGE_FLUSH_BATCH_SIZE)
+
+from datetime import date, datetime, timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+# usage is counted in redis and written to the usage table later by flush_usage.
+# each api key has a hash per day with a field per metric, and a hash per month with its requests for the quota.
+# days are in UTC. the hashes changed since the last flush are in USAGE_DIRTY_KEY.
+USAGE_DIRTY_KEY = "usage:dirty"
+# a flush renames the dirty set to this first. hashes changed in the meantime are marked dirty again.
+# if a flush dies, the next one starts with what it left.
+USAGE_FLUSHING_KEY = "usage:flushing"
+
+REQUESTS = "requests" # accepted classify requests
+CPU_MS = "cpu_ms" # cpu time spent classifying, in milliseconds. only accurate with prefork and solo worker pools
+USER_ID = "user_id" # the owner of the api key. not a metric
+
+
+def class_metric(result: int) -> str:
+    """
+    Returns the metric counting the images classified as a class.
+    """
+    return f"class_{result}"
+
+def usage_day() -> date:
+    return datetime.now(timezone.utc).date()
+
+def usage_redis_key(api_key_id: int, day: date) -> str:
+    return f"usage:{api_key_id}:{day.isoformat()}"
+
+def monthly_requests_redis_key(api_key_id: int, day: date) -> str:
+    return f"usage-month:{api_key_id}:{day:%Y-%m}"
+
+async def count_request(connection: redis.asyncio.Redis, api_key_id: int, user_id: int):
+    """
+    Counts a classify request of an API key, unless it would go over the daily or monthly quota.
+    The request must be uncounted with uncount_request if it fails afterwards.
+    Requests aren't refused when redis is unavailable, but they aren't counted either.
+
+    - **connection**: Async redis connection.
+    - **api_key_id**: API key's unique identifier.
+    - **user_id**: ID of the API key's owner.
+
+    Raises:
+    HTTPException: 429 if a quota is used up.
+    """
+    day = usage_day()
+    key, month_key = usage_redis_key(api_key_id, day), monthly_requests_redis_key(api_key_id, day)
+    try:
+        # incremented first and checked after, so concurrent requests can't go over the quota together.
+        async with connection.pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, REQUESTS, 1)
+            pipe.hincrby(month_key, REQUESTS, 1)
+            pipe.hset(key, USER_ID, user_id)
+            pipe.expire(key, USAGE_DAY_TTL)
+            pipe.expire(month_key, USAGE_MONTH_TTL)
+            pipe.sadd(USAGE_DIRTY_KEY, key)
+            daily, monthly, *_ = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("usage can't be counted: %s", e)
+        return
+
+    exceeded = None
+    if USAGE_DAILY_QUOTA and daily > USAGE_DAILY_QUOTA:
+        exceeded = "Daily"
+    elif USAGE_MONTHLY_QUOTA and monthly > USAGE_MONTHLY_QUOTA:
+        exceeded = "Monthly"
+    if exceeded:
+        await uncount_request(connection, api_key_id)
+        raise HTTPException(429, f"{exceeded} quota of this API key is used up.")
+
+async def uncount_request(connection: redis.asyncio.Redis, api_key_id: int):
+    """
+    Takes back a request counted by count_request. e.g. when the task couldn't be created.
+    """
+    day = usage_day()
+    try:
+        async with connection.pipeline(transaction=False) as pipe:
+            pipe.hincrby(usage_redis_key(api_key_id, day), REQUESTS, -1)
+            pipe.hincrby(monthly_requests_redis_key(api_key_id, day), REQUESTS, -1)
+            await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("usage can't be counted: %s", e)
+
+def count_completion(connection: Redis, api_key_id: int, user_id: int, result: int, cpu_ms: float):
+    """
+    Counts an image classified by a worker. Redis errors are logged and ignored, since the task itself is done.
+
+    - **connection**: Redis connection.
+    - **api_key_id**: ID of the task's API key.
+    - **user_id**: ID of the task's owner.
+    - **result**: The predicted class.
+    - **cpu_ms**: CPU time spent classifying the image, in milliseconds. It's the process' CPU time,
+      so it's only the image's own with prefork and solo worker pools.
+    """
+    key = usage_redis_key(api_key_id, usage_day())
+    try:
+        with connection.pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, class_metric(result), 1)
+            pipe.hincrby(key, CPU_MS, round(cpu_ms))
+            pipe.hset(key, USER_ID, user_id)
+            pipe.expire(key, USAGE_DAY_TTL)
+            pipe.sadd(USAGE_DIRTY_KEY, key)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("usage can't be counted: %s", e)
+
+def _upsert_usage(db: Session, rows: list[dict]):
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(Usage)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[Usage.day, Usage.api_key_id, Usage.metric],
+        set_={"user_id": statement.excluded.user_id, "value": statement.excluded.value}), rows)
+
+def flush_usage(db: Session, connection: Redis, batch_size: int = USAGE_FLUSH_BATCH_SIZE) -> int:
+    """
+    Writes the usage counters changed since the last flush to the usage table, a transaction per batch.
+    Rows are set to the counters' values instead of being added to, so writing a counter twice is harmless.
+
+    - **db**: Database session.
+    - **connection**: Redis connection.
+    - **batch_size**: Counter hashes written per transaction.
+
+    Returns:
+    int: Number of counter hashes written.
+    """
+    # renaming would replace what a previous flush left. that's written first and the rest by the next flush.
+    if not connection.exists(USAGE_FLUSHING_KEY):
+        try:
+            connection.rename(USAGE_DIRTY_KEY, USAGE_FLUSHING_KEY)
+        except redis.ResponseError:
+            return 0 # nothing changed
+
+    written = 0
+    while keys := connection.srandmember(USAGE_FLUSHING_KEY, batch_size):
+        with connection.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            counters = pipe.execute()
+
+        rows = []
+        for key, values in zip(keys, counters):
+            if not values:
+                continue # expired before it was flushed
+            _, api_key_id, day = key.decode().split(":")
+            values = {field.decode(): int(value) for field, value in values.items()}
+            user_id = values.pop(USER_ID, None)
+            if user_id is None:
+                continue # only uncounted after the day's hash expired
+            rows.extend({"day": date.fromisoformat(day), "api_key_id": int(api_key_id), "metric": metric,
+                         "user_id": user_id, "value": value} for metric, value in values.items())
+        if rows:
+            _upsert_usage(db, rows)
+        db.commit()
+        connection.srem(USAGE_FLUSHING_KEY, *keys)
+        written += len(keys)
+    return written
@@ -0,0 +1,49 @@
+"""
+Runs a celery worker for classifying images and the periodic jobs.
+
+The pool, concurrency, prefetch multiplier and the tasks per child process default to the
+CELERY_WORKER_* settings of app.config, which celery -A app.tasks worker uses too.
+With the prefork pool, the model is loaded once when app.tasks is imported, before the
+processes are forked, so they share its memory pages.
+
+Run it with python -m app.worker. Add --beat to one of the workers to run the periodic jobs in it too.
+"""
+from app.tasks import app
+from app.config import (CELERY_WORKER_POOL,
+                        CELERY_WORKER_CONCURRENCY,
+                        CELERY_WORKER_PREFETCH_MULTIPLIER,
+                        CELERY_WORKER_MAX_TASKS_PER_CHILD)
+
+import argparse
+
+
+def worker_argv(args: argparse.Namespace) -> list[str]:
+    """
+    Returns the arguments of celery worker for the parsed options.
+    """
+    argv = ["worker",
+            f"--pool={args.pool}",
+            f"--concurrency={args.concurrency}",
+            f"--prefetch-multiplier={args.prefetch_multiplier}",
+            f"--loglevel={args.loglevel}"]
+    if args.max_tasks_per_child:
+        argv.append(f"--max-tasks-per-child={args.max_tasks_per_child}")
+    if args.beat:
+        argv.append("--beat")
+    return argv
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a celery worker.")
+    parser.add_argument("--pool", default=CELERY_WORKER_POOL, choices=["prefork", "threads", "solo"],
+                        help="Pool type. prefork runs tasks in processes. "
+                             "The CPU time of usage metering is only accurate with prefork and solo")
+    parser.add_argument("--concurrency", type=int, default=CELERY_WORKER_CONCURRENCY,
+                        help="Number of processes or threads")
+    parser.add_argument("--prefetch-multiplier", type=int, default=CELERY_WORKER_PREFETCH_MULTIPLIER,
+                        help="Messages reserved per process or thread")
+    parser.add_argument("--max-tasks-per-child", type=int, default=CELERY_WORKER_MAX_TASKS_PER_CHILD,
+                        help="Tasks after which a process is replaced. 0 never replaces them")
+    parser.add_argument("--loglevel", default="INFO")
+    parser.add_argument("--beat", action="store_true", help="Run the periodic jobs in this worker too")
+    app.worker_main(worker_argv(parser.parse_args()))